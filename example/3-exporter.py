@@ -65,6 +65,7 @@ def export():
 def batch_export(max_contacts=None):
     """
     批量导出HTML
+    增量导出：导出记录保存在输出文件夹的export_manifest.json中，再次运行时没有新消息的联系人直接跳过
     :param max_contacts: 最多导出的联系人数量，None表示导出所有
     :return:
     """
@@ -103,7 +104,8 @@ def batch_export(max_contacts=None):
                 type_=FileType.HTML,
                 message_types=None,  # 要导出所有消息类型
                 time_range=['2020-01-01 00:00:00', '2035-03-12 00:00:00'],  # 要导出的日期范围，默认全导出
-                group_members=None  # 指定导出群聊里某个或者几个群成员的聊天记录
+                group_members=None,  # 指定导出群聊里某个或者几个群成员的聊天记录
+                incremental=True  # 只导出上次导出之后有新消息的联系人
             )
 
             exporter.start()
@@ -159,10 +159,17 @@ def get_chat_data(db_dir, db_version=3, time_range=(datetime.datetime(2010, 1, 1
             if contact.wxid == my_id:
                 continue
                 
-            # 获取聊天记录
-            messages = database.get_messages(contact.wxid, time_range)
+            # 只统计条数和发送者，直接在数据库中计数，不需要读取消息
+            try:
+                total_count = database.get_messages_number(contact.wxid, time_range)
+                my_count = database.get_send_messages_number(contact.wxid, time_range)
+            except ValueError:
+                # 没有实现统计接口时只读取消息的整数列自己数，不解析消息内容
+                frame = database.get_message_frame(contact.wxid, time_range=time_range)
+                total_count = len(frame)
+                my_count = frame.send_count()
             
-            if not messages:
+            if not total_count:
                 contact_data = {
                     'wxid': contact.wxid,
                     'nickname': contact.nickname or contact.remark or contact.wxid,
@@ -177,8 +184,6 @@ def get_chat_data(db_dir, db_version=3, time_range=(datetime.datetime(2010, 1, 1
                 continue
                 
             # 计算消息统计
-            total_count = len(messages)
-            my_count = sum(1 for msg in messages if msg.is_sender)
             other_count = total_count - my_count
             
             # 计算发送比例
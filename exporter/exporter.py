@@ -1,6 +1,7 @@
 import csv
 import html
 import io
+import json
 import os
 import re
 import shutil
@@ -18,6 +19,7 @@ from wxManager.model import Contact, Me, Message
 
 from wxManager.log import logger
 from exporter.config import FileType
+from exporter.manifest import ExportManifest
 
 
 def makedirs(path):
@@ -81,6 +83,7 @@ class ExporterBaseBase:
 
 class ExporterBase(ExporterBaseBase):
     i = 1
+    supports_append = False  # 增量导出时能否把新消息追加到上次的输出文件末尾，不能追加的格式有新消息时重新全部导出
 
     def __init__(
             self,
@@ -92,7 +95,9 @@ class ExporterBase(ExporterBaseBase):
             time_range=None,  # 导出的日期范围
             group_members: set[str] = None,  # 群聊中只导出这些人的聊天记录
             progress_callback=None,  # 进度回调函数，func(progress:float)
-            finish_callback=None  # 导出完成回调函数
+            finish_callback=None,  # 导出完成回调函数
+            incremental=False,  # 增量导出，只处理上次导出之后的新消息
+            manifest: ExportManifest = None  # 增量导出的清单，默认使用输出文件夹中的export_manifest.json
     ):
         """
         @param database:
@@ -103,6 +108,8 @@ class ExporterBase(ExporterBaseBase):
         @param time_range: 导出的日期范围
         @param group_members: 群聊中筛选的群成员
         @param progress_callback: 导出进度回调函数
+        @param incremental: 增量导出，没有新消息的联系人直接跳过，CSV、TXT把新消息追加到上次的文件末尾
+        @param manifest: 增量导出的清单
         """
         super().__init__()
         if progress_callback:
@@ -130,6 +137,11 @@ class ExporterBase(ExporterBaseBase):
         self.group_members_set = group_members
         self.origin_path = os.path.join(output_dir, '聊天记录', f'{self.contact.remark}({self.contact.wxid})')
         makedirs(self.origin_path)
+        self.incremental = incremental
+        self.manifest = manifest or (ExportManifest.open(output_dir) if incremental else None)
+        self.export_record = None  # 增量导出时上次导出的记录
+        self.high_water = (None, set())  # 已导出的最后一条消息的(sort_seq, 同一sort_seq的(server_id, local_id))
+        self.output_file = ''  # 导出的文件，增量导出时记录到清单中
 
     def print_progress(self, progress):
         logger.info(f'导出进度：{progress * 100:.2f}%')
@@ -166,8 +178,97 @@ class ExporterBase(ExporterBaseBase):
         # 判断该消息是否应该导出
         return self._is_select_by_type(message) and self._is_select_by_contact(message)
 
+    def selection(self) -> str:
+        """
+        导出的筛选条件，条件变了之前导出的内容不能复用
+        """
+        return json.dumps({
+            'time_range': [str(t) for t in self.time_range] if self.time_range else None,
+            'message_types': sorted(self.message_types) if self.message_types else None,
+            'group_members': sorted(self.group_members) if self.group_members else None,
+        }, ensure_ascii=False)
+
+    def previous_export(self) -> dict | None:
+        """
+        上次导出的记录，筛选条件变了或者输出文件被删除了返回None
+        """
+        record = self.manifest.get(self.contact.wxid, self.output_type)
+        if not record or record.get('selection') != self.selection() or 'message_ids' not in record:
+            return None
+        if record.get('file') and not os.path.exists(record['file']):
+            return None
+        return record
+
+    def append_target(self) -> str:
+        """
+        增量导出时可以继续追加的上次的输出文件，文件在上次导出后被修改过时返回空字符串
+        """
+        record = self.export_record
+        if not record or not record.get('file') or record.get('offset') is None:
+            return ''
+        if os.path.getsize(record['file']) != record['offset']:
+            return ''
+        return record['file']
+
+    def latest_sort_seq(self):
+        messages, _ = self.database.get_messages_by_cursor(self.contact.wxid, None, 1, self.time_range)
+        return messages[0].sort_seq if messages else None
+
+    def iter_export_messages(self):
+        """
+        按时间顺序逐条返回要导出的消息，追加导出时只返回上次导出之后的新消息
+        同时更新high_water，导出结束后记录到清单中
+        """
+        start_sort_seq, exported_ids = None, set()
+        if self.export_record:
+            start_sort_seq = self.export_record['sort_seq']
+            exported_ids = {tuple(message_id) for message_id in self.export_record['message_ids']}
+            self.high_water = (start_sort_seq, set(exported_ids))
+        for message in self.database.iter_messages(self.contact.wxid, self.time_range,
+                                                   start_sort_seq=start_sort_seq):
+            # 3.x中MsgSvrID可能为0，只用server_id区分会把同一秒内的其他消息当成已导出
+            message_id = (message.server_id, message.local_id)
+            if message.sort_seq == start_sort_seq and message_id in exported_ids:
+                continue
+            sort_seq, message_ids = self.high_water
+            if message.sort_seq != sort_seq:
+                message_ids = set()
+                self.high_water = (message.sort_seq, message_ids)
+            message_ids.add(message_id)
+            yield message
+
+    def get_export_messages(self) -> List[Message]:
+        if not self.incremental:
+            return self.database.get_messages(self.contact.wxid, time_range=self.time_range)
+        return list(self.iter_export_messages())
+
     def run(self):
+        if not self.incremental:
+            self.export()
+            return
+        self.export_record = self.previous_export()
+        if self.supports_append:
+            if not self.append_target():
+                self.export_record = None
+        else:
+            # 不能追加的格式：没有新消息时跳过，有新消息时重新全部导出
+            latest_sort_seq = self.latest_sort_seq()
+            last_sort_seq = self.export_record['sort_seq'] if self.export_record else None
+            if self.export_record and (latest_sort_seq is None or
+                                       last_sort_seq is not None and latest_sort_seq <= last_sort_seq):
+                logger.info(f'{self.contact.remark}没有新消息，跳过导出')
+                self.update_progress_callback(1)
+                self.finish_callback(self.exporter_id)
+                return
+            self.export_record = None
+            self.high_water = (latest_sort_seq, set())
         self.export()
+        sort_seq, message_ids = self.high_water
+        offset = None
+        if self.supports_append and self.output_file and os.path.exists(self.output_file):
+            offset = os.path.getsize(self.output_file)
+        self.manifest.update(self.contact.wxid, self.output_type, sort_seq, message_ids, self.output_file, offset,
+                             self.selection())
 
     def export(self):
         return True
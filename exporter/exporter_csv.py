@@ -7,6 +7,8 @@ from exporter.exporter import ExporterBase, get_new_filename
 
 
 class CSVExporter(ExporterBase):
+    supports_append = True
+
     def message_to_list(self, message: Message):
         remark = message.display_name
         nickname = message.display_name
@@ -26,15 +28,23 @@ class CSVExporter(ExporterBase):
     def export(self):
         print(f"【开始导出 CSV {self.contact.remark}】")
         os.makedirs(self.origin_path, exist_ok=True)
-        filename = os.path.join(self.origin_path,f"{self.contact.remark}.csv")
-        filename = get_new_filename(filename)
+        # 增量导出时把新消息追加到上次的文件末尾
+        append_file = self.append_target()
+        if append_file:
+            filename = append_file
+        else:
+            filename = os.path.join(self.origin_path,f"{self.contact.remark}.csv")
+            filename = get_new_filename(filename)
+        self.output_file = filename
         columns = ['消息ID', '类型', '发送人', '时间', '内容', '备注', '昵称', '更多信息']
-        messages = self.database.get_messages(self.contact.wxid, time_range=self.time_range)
+        messages = self.get_export_messages()
         total_steps = len(messages)
         # 写入CSV文件
-        with open(filename, mode='w', newline='', encoding='utf-8-sig') as file:
+        with open(filename, mode='a' if append_file else 'w', newline='',
+                  encoding='utf-8' if append_file else 'utf-8-sig') as file:
             writer = csv.writer(file)
-            writer.writerow(columns)
+            if not append_file:
+                writer.writerow(columns)
             # 写入数据
             csv_res = []
             for index, message in enumerate(messages):
@@ -51,10 +51,12 @@ class DocxExporter(ExporterBase):
             group_members: set[str] = None,  # 群聊中只导出这些人的聊天记录
             progress_callback=None,  # 进度回调函数，func(progress:float)
             finish_callback=None,  # 导出完成回调函数
-            msg_num_per_docx=500  # 每个docx文档的消息数量
+            msg_num_per_docx=500,  # 每个docx文档的消息数量
+            incremental=False,  # 增量导出，只处理上次导出之后的新消息
+            manifest=None  # 增量导出的清单
     ):
         super().__init__(database, contact, output_dir, type_, message_types, time_range, group_members,
-                         progress_callback, finish_callback)  # 调用父类的构造函数
+                         progress_callback, finish_callback, incremental, manifest)  # 调用父类的构造函数
         self.msg_num_per_docx = msg_num_per_docx
 
     def add_text_in(self, paragraph, content):
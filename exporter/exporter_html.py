@@ -28,6 +28,7 @@ class HtmlExporter(ExporterBase):
         f_name = '.html'
         filename = os.path.join(self.origin_path, f'{self.contact.remark}{f_name}')
         filename = get_new_filename(filename)
+        self.output_file = filename
         # 获取当前脚本的目录
         current_dir = os.path.dirname(os.path.abspath(__file__))
         # 构建要读取的文件路径
@@ -3,6 +3,7 @@ import random
 import os
 
 from wxManager import Me, MessageType
+from wxManager.model import MessageFrame
 from exporter.exporter import ExporterBase, remove_privacy_info, get_new_filename
 
 
@@ -109,10 +110,12 @@ class JsonExporter(ExporterBase):
             group_members: set[str] = None,  # 群聊中只导出这些人的聊天记录
             progress_callback=None,  # 进度回调函数，func(progress:float)
             finish_callback=None,  # 导出完成回调函数
-            json_config: JsonConfig = None
+            json_config: JsonConfig = None,
+            incremental=False,  # 增量导出，只处理上次导出之后的新消息
+            manifest=None  # 增量导出的清单
     ):
         super().__init__(database, contact, output_dir, type_, message_types, time_range, group_members,
-                         progress_callback, finish_callback)  # 调用父类的构造函数
+                         progress_callback, finish_callback, incremental, manifest)  # 调用父类的构造函数
         if json_config:
             self.json_config: JsonConfig = json_config
         else:
@@ -164,6 +167,16 @@ class JsonExporter(ExporterBase):
             return []
         return merge_content(conversions)
 
+    def message_frame(self, messages):
+        """
+        切分只用到时间和发送方两列
+        @param messages:
+        @return: (MessageFrame, 第i项为>=i的第一条user角色消息的下标，没有时为len(messages))
+        """
+        frame = MessageFrame(self.contact.wxid, timestamp=[message.timestamp for message in messages],
+                             is_sender=[message.is_sender for message in messages])
+        return frame, frame.next_index(self.is_user(frame.is_sender)).tolist()
+
     def split_by_time(self, length=300):
         """
         通过第一条消息和最后一条消息的时间间隔分割数据集
@@ -172,33 +185,19 @@ class JsonExporter(ExporterBase):
         """
         messages = self.database.get_messages_by_type(self.contact.wxid, type_=MessageType.Text,
                                                       time_range=self.time_range)
+        frame, next_user = self.message_frame(messages)
+        num = len(messages)
         start_time = 0
         res = []
         i = 0
-        while i < len(messages):
-            message = messages[i]
-            timestamp = message.timestamp
-            is_send = message.is_sender
-            group = []
-            while i < len(messages) and timestamp - start_time < length:
-                group.append(message)
-                i += 1
-                if i >= len(messages):
-                    break
-                message = messages[i]
-                timestamp = message.timestamp
-                is_send = message.is_sender
-            while not self.is_user(is_send):
-                group.append(message)
-                i += 1
-                if i >= len(messages):
-                    break
-                message = messages[i]
-                timestamp = message.timestamp
-                is_send = message.is_sender
-            start_time = timestamp
-            if len(group) > 4:
-                res.append(group)
+        while i < num:
+            # 先取length秒内的消息，再延长到下一条user消息之前
+            end = next_user[frame.first_time_at_least(i, start_time + length)]
+            if end - i > 4:
+                res.append(messages[i:end])
+            if end < num:
+                start_time = messages[end].timestamp
+            i = end
         return res
 
     def split_by_intervals(self, max_diff_seconds=300):
@@ -209,27 +208,17 @@ class JsonExporter(ExporterBase):
         """
         messages = self.database.get_messages_by_type(self.contact.wxid, type_=MessageType.Text,
                                                       time_range=self.time_range)
+        frame, next_user = self.message_frame(messages)
+        next_gap = frame.next_gap(max_diff_seconds).tolist()
+        num = len(messages)
         res = []
         i = 0
-        current_group = []
-        while i < len(messages):
-            message = messages[i]
-            timestamp = message.timestamp
-            is_send = message.is_sender
-            while not self.is_user(is_send) and i + 1 < len(messages):
-                i += 1
-                message = messages[i]
-                is_send = message.is_sender
-            current_group = [messages[i]]
-            i += 1
-            while i < len(messages) and messages[i].timestamp - current_group[-1].timestamp <= max_diff_seconds:
-                current_group.append(messages[i])
-                i += 1
-            while i < len(messages) and not self.is_user(messages[i].is_sender):
-                current_group.append(messages[i])
-                i += 1
-            if len(current_group) > 4:
-                res.append(current_group)
+        while i < num:
+            # 从user消息开始，到时间间隔超过max_diff_seconds的位置，再延长到下一条user消息之前
+            start = min(next_user[i], num - 1)
+            i = next_user[next_gap[start + 1]]
+            if i - start > 4:
+                res.append(messages[start:i])
         return res
 
     def split_by_window(self, window_size=10, step=3):
@@ -241,25 +230,13 @@ class JsonExporter(ExporterBase):
         """
         messages = self.database.get_messages_by_type(self.contact.wxid, type_=MessageType.Text,
                                                       time_range=self.time_range)
+        frame, next_user = self.message_frame(messages)
+        num = len(messages)
         res = []
-        i = 0
-        while i < len(messages):
-            message = messages[i]
-            timestamp = message.timestamp
-            is_send = message.is_sender
-            current_group = []
-            j = i
-            while not self.is_user(is_send) and j + 1 < len(messages) and j - i < window_size:
-                j += 1
-                message = messages[j]
-                is_send = message.is_sender
-            current_group = [messages[j]]
-            j += 1
-            while j < len(messages) and j - i < window_size:
-                current_group.append(messages[j])
-                j += 1
-            res.append(current_group)
-            i += step
+        for i in range(0, num, step):
+            # 窗口从第一条user消息开始，窗口内没有user消息时只保留窗口后的第一条
+            j = min(next_user[i], num - 1, i + window_size)
+            res.append(messages[j:max(j + 1, min(num, i + window_size))])
         return res
 
     def export(self):
@@ -267,6 +244,7 @@ class JsonExporter(ExporterBase):
         origin_path = self.origin_path
         filename = os.path.join(origin_path, f"{self.contact.remark}.json")
         filename = get_new_filename(filename)
+        self.output_file = filename
         messages_groups = []
         match self.json_config.strategy:
             case JsonStrategy.SPLIT_BY_INTERVALS:
@@ -0,0 +1,237 @@
+import dataclasses
+import inspect
+import json
+import glob
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wxManager import DataBaseInterface
+from wxManager.log import logger
+from wxManager.model import message as message_module
+from wxManager.model.message import Message, MessageType, field_names
+from exporter.exporter import ExporterBaseBase
+
+# 字段注解对应的列类型，其他类型（引用的消息、合并转发的消息列表等）转成json字符串
+ARROW_TYPES = {
+    int: pa.int64(),
+    MessageType: pa.int64(),
+    bool: pa.bool_(),
+    float: pa.float64(),
+    str: pa.string(),
+}
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+def _to_bool(value):
+    return None if value is None else bool(value)
+
+
+def _to_json(value):
+    if value is None:
+        return None
+    if isinstance(value, Message):
+        value = value.to_json()
+    elif isinstance(value, (list, tuple)):
+        value = [item.to_json() if isinstance(item, Message) else item for item in value]
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+CONVERTERS = {
+    pa.int64(): _to_int,
+    pa.bool_(): _to_bool,
+    pa.float64(): _to_float,
+    pa.string(): _to_str,
+}
+
+
+def message_fields() -> List[Tuple[str, pa.DataType, bool]]:
+    """
+    所有消息类型的字段，Message基类的字段在前，各类型特有的字段按出现顺序排在后面
+    @return: [(字段名, 列类型, 是否转成json)]
+    """
+    fields = OrderedDict()
+    classes = [Message] + [cls for _, cls in inspect.getmembers(message_module, inspect.isclass)
+                           if dataclasses.is_dataclass(cls) and issubclass(cls, Message) and cls is not Message]
+    for cls in classes:
+        for field in dataclasses.fields(cls):
+            if field.name in fields or field.name.startswith('_'):
+                continue
+            arrow_type = ARROW_TYPES.get(field.type)
+            fields[field.name] = (field.name, arrow_type or pa.string(), arrow_type is None)
+            if field.name == 'timestamp':
+                # str_time不是dataclass的字段（由timestamp得到），仍然单独作为一列
+                fields['str_time'] = ('str_time', pa.string(), False)
+    return list(fields.values())
+
+
+class ParquetExporter(ExporterBaseBase):
+    """
+    把聊天记录导出成一个Parquet数据集，按会话和月份分区：
+    <output_dir>/parquet/talker=<wxid>/month=<yyyy-mm>/part-<n>.parquet
+    每个字段一列并保留类型，各消息类型特有的字段也各占一列（其他类型的消息为空），
+    message_class列记录消息的类名，可以直接用pyarrow.dataset、pandas、DuckDB等读取分析
+    消息边读边写，每个分区攒够row_group_size条写一个row group，内存占用和消息总数无关
+    重新导出时覆盖之前的结果：导出整个账号的全部消息时先清空数据集，否则每个分区第一次写入前删除其中旧的文件
+    """
+    row_group_size = 50000  # 每个row group的消息条数
+    max_buffered_rows = 200000  # 所有分区缓存的消息总数超过后全部写出
+    max_open_files = 64  # 同时打开的分区文件数，超过后关闭最久没有写入的
+
+    def __init__(
+            self,
+            database: DataBaseInterface,
+            output_dir,
+            time_range=None,  # 导出的日期范围
+            contacts: List[str] = None,  # 只导出这些会话，None表示整个账号
+            progress_callback=None,  # 进度回调函数，func(progress:float)
+            finish_callback=None  # 导出完成回调函数
+    ):
+        super().__init__()
+        self.database = database
+        self.output_path = os.path.join(output_dir, 'parquet')
+        self.time_range = time_range
+        self.contacts = contacts
+        self.update_progress_callback = progress_callback or self.print_progress
+        self.finish_callback = finish_callback or self.finish
+        self.fields = message_fields()
+        self.schema = pa.schema(
+            [(name, arrow_type) for name, arrow_type, _ in self.fields] + [('message_class', pa.string())]
+        )
+        self.converters = [(name, _to_json if is_json else CONVERTERS[arrow_type])
+                           for name, arrow_type, is_json in self.fields]
+        self.class_fields = {}  # 消息类 -> 字段名
+        self.buffers: Dict[Tuple[str, str], list] = {}  # (talker, month) -> 待写入的行
+        self.buffered_num = 0
+        self.writers: OrderedDict[Tuple[str, str], pq.ParquetWriter] = OrderedDict()
+        self.part_numbers: Dict[Tuple[str, str], int] = {}  # 分区已经写过的文件数
+        self.current_months: Dict[str, str] = {}  # 每个会话当前写入的月份
+        self.num = 0
+
+    def print_progress(self, progress):
+        logger.info(f'导出进度：{progress * 100:.2f}%')
+
+    def finish(self, success):
+        if success:
+            logger.info(f'导出完成\n{"-" * 20}')
+        else:
+            logger.info(f'导出失败\n{"-" * 20}')
+
+    def iter_messages(self) -> Iterator[Tuple[str, Message]]:
+        if self.contacts is None:
+            yield from self.database.get_messages_all(self.time_range)
+            return
+        for index, wxid in enumerate(self.contacts):
+            for message in self.database.iter_messages(wxid, self.time_range):
+                yield wxid, message
+            self.update_progress_callback((index + 1) / len(self.contacts))
+
+    def message_to_row(self, message: Message) -> dict:
+        names = self.class_fields.get(type(message))
+        if names is None:
+            names = self.class_fields[type(message)] = set(field_names(type(message))) | {'str_time'}
+        row = {name: converter(getattr(message, name)) if name in names else None
+               for name, converter in self.converters}
+        row['message_class'] = type(message).__name__
+        return row
+
+    def _partition_path(self, key) -> str:
+        talker, month = key
+        part_number = self.part_numbers.get(key, 0)
+        self.part_numbers[key] = part_number + 1
+        path = os.path.join(self.output_path, f'talker={talker}', f'month={month}')
+        if part_number == 0:
+            # 文件编号每次导出都从0开始，上次导出多出来的文件不删除会被当作重复的数据读进来
+            for old_file in glob.glob(os.path.join(glob.escape(path), 'part-*.parquet')):
+                os.remove(old_file)
+        os.makedirs(path, exist_ok=True)
+        return os.path.join(path, f'part-{part_number}.parquet')
+
+    def _get_writer(self, key) -> pq.ParquetWriter:
+        writer = self.writers.get(key)
+        if writer is not None:
+            self.writers.move_to_end(key)
+            return writer
+        while len(self.writers) >= self.max_open_files:
+            _, oldest = self.writers.popitem(last=False)
+            oldest.close()
+        writer = self.writers[key] = pq.ParquetWriter(self._partition_path(key), self.schema, compression='zstd')
+        return writer
+
+    def flush(self, key, close=False):
+        rows = self.buffers.pop(key, None)
+        if rows:
+            self.buffered_num -= len(rows)
+            self._get_writer(key).write_table(pa.Table.from_pylist(rows, schema=self.schema),
+                                              row_group_size=self.row_group_size)
+        if close:
+            writer = self.writers.pop(key, None)
+            if writer is not None:
+                writer.close()
+
+    def export(self):
+        st = time.time()
+        logger.info(f'开始导出Parquet：{self.output_path}')
+        if self.contacts is None and self.time_range is None and os.path.isdir(self.output_path):
+            shutil.rmtree(self.output_path)  # 导出整个账号时已经删除的会话也不能留下
+        for talker, message in self.iter_messages():
+            if not self._is_running:
+                break
+            month = message.str_time[:7]
+            key = (talker, month)
+            last_month = self.current_months.get(talker)
+            if last_month != month:
+                # 同一个会话的消息按时间顺序到来，上个月的分区不会再有数据
+                if last_month is not None:
+                    self.flush((talker, last_month), close=True)
+                self.current_months[talker] = month
+            rows = self.buffers.setdefault(key, [])
+            rows.append(self.message_to_row(message))
+            self.buffered_num += 1
+            self.num += 1
+            if len(rows) >= self.row_group_size:
+                self.flush(key)
+            elif self.buffered_num >= self.max_buffered_rows:
+                for buffered_key in list(self.buffers):
+                    self.flush(buffered_key)
+        for key in list(self.buffers):
+            self.flush(key)
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+        if not self._is_running:
+            # 中途停止的数据集不完整，不通知导出完成
+            logger.info(f'导出Parquet已停止：已写入{self.num}条消息，耗时{time.time() - st:.2f}s')
+            return False
+        logger.info(f'导出Parquet完成：{self.num}条消息，耗时{time.time() - st:.2f}s')
+        self.update_progress_callback(1)
+        self.finish_callback(self.exporter_id)
+        return True
+
+    def run(self):
+        self.export()
+
+    def start(self):
+        self.run()
@@ -7,6 +7,8 @@ from exporter.exporter import ExporterBase, get_new_filename
 
 
 class TxtExporter(ExporterBase):
+    supports_append = True
+
     def title(self, message: Message):
         str_time = message.str_time
         if message.type == MessageType.System:
@@ -19,9 +21,15 @@ class TxtExporter(ExporterBase):
         print(f"【开始导出 TXT {self.contact.remark}】")
         origin_path = self.origin_path
         os.makedirs(origin_path, exist_ok=True)
-        filename = os.path.join(origin_path, self.contact.remark + '.txt')
-        filename = get_new_filename(filename)
-        messages = self.database.get_messages(self.contact.wxid, time_range=self.time_range)
+        # 增量导出时把新消息追加到上次的文件末尾
+        append_file = self.append_target()
+        if append_file:
+            filename = append_file
+        else:
+            filename = os.path.join(origin_path, self.contact.remark + '.txt')
+            filename = get_new_filename(filename)
+        self.output_file = filename
+        messages = self.get_export_messages()
         total_steps = len(messages)
         txt_res = []
         for index, message in enumerate(messages):
@@ -30,7 +38,9 @@ class TxtExporter(ExporterBase):
             if not self.is_selected(message):
                 continue
             txt_res.append(f'{self.title(message)}\n{message.to_text()}')
-        with open(filename, mode='w', newline='', encoding='utf-8') as f:
+        with open(filename, mode='a' if append_file else 'w', newline='', encoding='utf-8') as f:
+            if append_file and txt_res and f.tell():
+                f.write('\n\n')
             f.write('\n\n'.join(txt_res))
         self.update_progress_callback(1)
         print(f"【完成导出 TXT {self.contact.remark}】")
@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+
+from wxManager.log import logger
+
+
+class ExportManifest:
+    """
+    增量导出的清单，保存在输出文件夹的export_manifest.json中
+    记录每个联系人每种导出格式上次导出到的位置：
+    {
+        wxid: {
+            格式: {
+                'sort_seq': 已导出的最后一条消息的sort_seq,
+                'message_ids': sort_seq等于上面的值的消息中已经导出的[server_id, local_id]（3.x中同一秒可能有多条消息，MsgSvrID可能为0）,
+                'file': 输出文件,
+                'offset': 输出文件写到的位置，追加前核对文件没有被修改过,
+                'selection': 导出时的筛选条件，条件变了要重新导出,
+                'time': 导出时间
+            }
+        }
+    }
+    同一个输出文件夹共用一个实例，批量导出时多个线程可以同时更新
+    """
+    file_name = 'export_manifest.json'
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+    @classmethod
+    def open(cls, output_dir) -> 'ExportManifest':
+        """
+        获取输出文件夹的清单
+        @param output_dir: 输出文件夹
+        @return:
+        """
+        path = os.path.abspath(os.path.join(output_dir, cls.file_name))
+        with cls._instances_lock:
+            manifest = cls._instances.get(path)
+            if manifest is None:
+                manifest = cls._instances[path] = cls(path)
+            return manifest
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.error(f'导出清单读取失败，将全部重新导出：{self.path}')
+            return {}
+
+    def get(self, wxid, file_type) -> dict | None:
+        """
+        @param wxid:
+        @param file_type: 导出格式，FileType
+        @return: 上次导出的记录，没有导出过返回None
+        """
+        with self.lock:
+            return self.data.get(wxid, {}).get(file_type.name)
+
+    def update(self, wxid, file_type, sort_seq, message_ids, file='', offset=None, selection=''):
+        """
+        记录一次导出并立即写入文件，导出中途退出时已完成的联系人不用重新导出
+        """
+        record = {
+            'sort_seq': sort_seq,
+            'message_ids': sorted(list(message_id) for message_id in message_ids),
+            'file': file,
+            'offset': offset,
+            'selection': selection,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self.lock:
+            self.data.setdefault(wxid, {})[file_type.name] = record
+            self.save()
+
+    def remove(self, wxid, file_type=None):
+        """
+        删除记录，下次导出时重新全部导出
+        @param wxid:
+        @param file_type: None表示删除该联系人所有格式的记录
+        @return:
+        """
+        with self.lock:
+            if file_type is None:
+                self.data.pop(wxid, None)
+            else:
+                self.data.get(wxid, {}).pop(file_type.name, None)
+            self.save()
+
+    def save(self):
+        # 先写临时文件再替换，写到一半中断也不会损坏原来的清单
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,26 @@
+import pytest
+
+from tests.fixture_db import make_v4_db
+from wxManager import DataBaseV4
+from wxManager.log.logger import file_handler, logger
+
+
+@pytest.fixture(autouse=True, scope='session')
+def no_log_file():
+    # 日志文件写在当前目录，测试时只输出到终端，不在工作区留下文件
+    logger.removeHandler(file_handler)
+    yield
+    logger.addHandler(file_handler)
+
+
+@pytest.fixture
+def v4_dir(tmp_path):
+    return make_v4_db(str(tmp_path / 'db_v4'))
+
+
+@pytest.fixture
+def v4_db(v4_dir):
+    database = DataBaseV4(parallel=False)
+    assert database.init_database(v4_dir)
+    yield database
+    database.close()
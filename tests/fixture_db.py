@@ -0,0 +1,152 @@
+"""
+测试用的小型解密后数据库，表结构和真实数据库一致，只包含解析消息用到的列
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+import zstandard
+
+ME = 'wxid_me'
+FRIEND = 'wxid_friend'
+BIZ = 'gh_pub'
+
+TEXT = 1
+IMAGE = 3
+QUOTE = 244813135921
+
+BASE_TIME = 1700000000
+V4_MESSAGE_COLUMNS = ('local_id INTEGER PRIMARY KEY, server_id, local_type, sort_seq, real_sender_id, create_time, '
+                      'status, upload_status, server_seq, origin_source, source, message_content, compress_content')
+
+
+def table_name(username):
+    return 'Msg_' + hashlib.md5(username.encode('utf-8')).hexdigest()
+
+
+def friend_rows(num=40):
+    """
+    和FRIEND的聊天记录：每5小时一条，sort_seq从1开始，奇数条在message_1.db中
+    第5、15、25…条是图片，第10、20、30…条是引用三条之前那条消息的引用消息，其余是文本，每三条压缩一条
+    @return: [(分库下标, local_type, sort_seq, server_id, real_sender_id, create_time, message_content)]
+    """
+    compressor = zstandard.ZstdCompressor()
+    rows = []
+    for i in range(num):
+        seq = i + 1
+        if i % 10 == 4:
+            local_type, content = IMAGE, '<msg><img length="10" md5="" /></msg>'
+        elif i % 10 == 9:
+            local_type = QUOTE
+            content = (f'<msg><appmsg><title>reply {seq}</title><type>57</type><refermsg><type>1</type>'
+                       f'<svrid>{1000 + seq - 3}</svrid><content>x</content><displayname>{FRIEND}</displayname>'
+                       f'</refermsg></appmsg></msg>')
+        else:
+            local_type, content = TEXT, f'hello {seq}'
+        content = compressor.compress(content.encode('utf-8')) if i % 3 == 0 else content
+        rows.append((i % 2, local_type, seq, 1000 + seq, 1 + i % 2, BASE_TIME + i * 5 * 3600, content))
+    return rows
+
+
+def make_v4_db(root, num=40, biz=True):
+    """
+    在root下创建4.0的解密数据库目录
+    @param root:
+    @param num: 和FRIEND的消息条数
+    @param biz: 是否在biz_message_0.db中放入BIZ的消息（公众号消息表没有packed_info_data列）
+    @return: root
+    """
+    for name in ('contact', 'head_image', 'session', 'message', 'hardlink', 'emoticon'):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    with open(os.path.join(root, 'info.json'), 'w', encoding='utf-8') as f:
+        json.dump({'username': ME, 'nickname': 'me'}, f)
+    DB = sqlite3.connect(os.path.join(root, 'contact', 'contact.db'))
+    DB.execute('create table contact(username, alias, local_type, flag, remark, nick_name, pin_yin_initial, '
+               'remark_pin_yin_initial, small_head_url, big_head_url, extra_buffer, head_img_md5, chat_room_notify, '
+               'is_in_chat_room, description, chat_room_type, quan_pin, remark_quan_pin)')
+    DB.execute('create table chat_room(id, ext_buffer, username, owner)')
+    DB.execute('create table contact_label(label_id_, label_name_)')
+    for username in (ME, FRIEND, BIZ):
+        DB.execute('insert into contact values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                   (username, '', 1, 0, f'remark_{username}', username, '', '', f'http://head/{username}', '', b'',
+                    '', 0, 0, '', 0, username, ''))
+    DB.commit()
+    DB.close()
+    for name in ('head_image/head_image.db', 'session/session.db', 'hardlink/hardlink.db', 'emoticon/emoticon.db'):
+        sqlite3.connect(os.path.join(root, name)).close()
+
+    shards = [sqlite3.connect(os.path.join(root, 'message', f'message_{i}.db')) for i in range(2)]
+    for DB in shards:
+        DB.execute('create table Name2Id(user_name)')
+        DB.executemany('insert into Name2Id values (?)', [(ME,), (FRIEND,)])
+        DB.execute(f'create table {table_name(FRIEND)}({V4_MESSAGE_COLUMNS}, packed_info_data)')
+    for shard, local_type, seq, server_id, sender, create_time, content in friend_rows(num):
+        shards[shard].execute(
+            f'insert into {table_name(FRIEND)}(server_id, local_type, sort_seq, real_sender_id, create_time, status, '
+            f'upload_status, server_seq, origin_source, source, message_content, compress_content, packed_info_data) '
+            f'values (?,?,?,?,?,2,0,0,NULL,"",?,NULL,?)',
+            (server_id, local_type, seq, sender, create_time, content, b'')
+        )
+    for DB in shards:
+        DB.commit()
+        DB.close()
+
+    DB = sqlite3.connect(os.path.join(root, 'message', 'biz_message_0.db'))
+    DB.execute('create table Name2Id(user_name)')
+    if biz:
+        DB.executemany('insert into Name2Id values (?)', [(ME,), (BIZ,)])
+        DB.execute(f'create table {table_name(BIZ)}({V4_MESSAGE_COLUMNS})')
+        for i, (local_type, content) in enumerate([(TEXT, 'welcome'), (IMAGE, '<msg><img length="10" /></msg>'),
+                                                   (TEXT, 'news')]):
+            DB.execute(
+                f'insert into {table_name(BIZ)}(server_id, local_type, sort_seq, real_sender_id, create_time, status, '
+                f'upload_status, server_seq, origin_source, source, message_content, compress_content) '
+                f'values (?,?,?,2,?,2,0,0,NULL,"",?,NULL)',
+                (5000 + i, local_type, i + 1, BASE_TIME + i * 60, content)
+            )
+    DB.commit()
+    DB.close()
+    return root
+
+
+V3_MSG_COLUMNS = ('localId INTEGER PRIMARY KEY, TalkerId, MsgSvrID, Type, SubType, IsSender, CreateTime, Status, '
+                  'StrContent, StrTalker, BytesExtra, CompressContent, DisplayContent')
+
+
+def make_v3_db(root, rows):
+    """
+    在root下创建3.x的解密数据库目录
+    @param root:
+    @param rows: FRIEND的文本消息[(分库下标, MsgSvrID, IsSender, CreateTime, StrContent)]
+    @return: root
+    """
+    os.makedirs(os.path.join(root, 'Multi'), exist_ok=True)
+    with open(os.path.join(root, 'info.json'), 'w', encoding='utf-8') as f:
+        json.dump({'username': ME, 'nickname': 'me'}, f)
+    for name in ('Misc.db', 'PublicMsg.db', 'HardLinkImage.db', 'HardLinkFile.db', 'HardLinkVideo.db', 'Emotion.db',
+                 'Multi/MediaMSG0.db', 'OpenIMContact.db', 'OpenIMMedia.db', 'OpenIMMsg.db'):
+        sqlite3.connect(os.path.join(root, name)).close()
+    DB = sqlite3.connect(os.path.join(root, 'MicroMsg.db'))
+    DB.execute('create table Contact(UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ExTraBuf, '
+               'LabelIDList)')
+    DB.execute('create table ContactHeadImgUrl(usrName, smallHeadImgUrl, bigHeadImgUrl)')
+    for username in (ME, FRIEND):
+        DB.execute('insert into Contact values (?,?,?,?,?,?,?,?,?)',
+                   (username, '', 1, f'remark_{username}', username, '', '', b'', ''))
+        DB.execute('insert into ContactHeadImgUrl values (?,?,?)', (username, f'http://head/{username}', ''))
+    DB.commit()
+    DB.close()
+    shards = [sqlite3.connect(os.path.join(root, 'Multi', f'MSG{i}.db')) for i in range(2)]
+    for DB in shards:
+        DB.execute(f'create table MSG({V3_MSG_COLUMNS})')
+    for shard, server_id, is_sender, create_time, content in rows:
+        shards[shard].execute(
+            'insert into MSG(TalkerId, MsgSvrID, Type, SubType, IsSender, CreateTime, Status, StrContent, StrTalker, '
+            'BytesExtra, CompressContent, DisplayContent) values (1,?,1,0,?,?,2,?,?,?,NULL,"")',
+            (server_id, is_sender, create_time, content, FRIEND, b'')
+        )
+    for DB in shards:
+        DB.commit()
+        DB.close()
+    return root
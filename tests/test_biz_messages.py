@@ -0,0 +1,18 @@
+from tests.fixture_db import BIZ, IMAGE
+from wxManager import MessageType
+from wxManager.model import ImageMessage, TextMessage
+
+
+def test_biz_image_row_without_packed_info_data(v4_db):
+    messages = v4_db.get_messages(BIZ)
+    assert [type(message) for message in messages] == [TextMessage, ImageMessage, TextMessage]
+    assert [message.server_id for message in messages] == [5000, 5001, 5002]
+    assert messages[0].content == 'welcome'
+    assert messages[1].type == IMAGE
+
+
+def test_biz_messages_by_type_and_stream(v4_db):
+    images = v4_db.get_messages_by_type(BIZ, MessageType.Image)
+    assert [message.server_id for message in images] == [5001]
+    assert list(v4_db.iter_messages(BIZ, batch_size=2)) == v4_db.get_messages(BIZ)
+    assert {username for username, _ in v4_db.get_messages_all()} >= {BIZ}
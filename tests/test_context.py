@@ -0,0 +1,27 @@
+from wxManager import DataBaseV4
+from wxManager.manager_v4 import get_context, _contexts
+
+
+def test_context_is_registered_and_removed_on_close(v4_dir):
+    database = DataBaseV4(parallel=False)
+    assert database.init_database(v4_dir)
+    assert get_context(v4_dir) is database
+    database.close()
+    assert v4_dir not in _contexts
+
+    # 关闭后再取上下文会重新打开数据库，而不是返回已经关闭的对象
+    context = get_context(v4_dir)
+    assert context is not database
+    assert context.get_messages_number('wxid_friend') == 40
+    context.close()
+    assert v4_dir not in _contexts
+
+
+def test_close_keeps_other_registration(v4_dir):
+    first = DataBaseV4(parallel=False)
+    first.init_database(v4_dir)
+    second = DataBaseV4(parallel=False)
+    second.init_database(v4_dir)
+    first.close()
+    assert get_context(v4_dir) is second
+    second.close()
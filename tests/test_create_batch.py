@@ -0,0 +1,45 @@
+import pytest
+
+from tests.fixture_db import BIZ, FRIEND, IMAGE, QUOTE, TEXT
+from wxManager.manager_v4 import create_messages
+from wxManager.parser.wechat_v4 import FACTORY_REGISTRY, Singleton
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    Singleton.reset_messages()
+    Singleton.quoted_messages.clear()
+    Singleton.contacts.clear()
+    yield
+    Singleton.reset_messages()
+    Singleton.quoted_messages.clear()
+
+
+def create_one_by_one(rows, username, database):
+    return [FACTORY_REGISTRY.get(row[2], FACTORY_REGISTRY[-1]).create(row, username, database) for row in rows]
+
+
+@pytest.mark.parametrize('username', [FRIEND, BIZ])
+def test_grouped_parse_matches_per_message_create(v4_db, username):
+    message_db = v4_db.biz_message_db if username.startswith('gh_') else v4_db.message_db
+    rows = message_db.get_messages_by_username(username)
+    expected = create_one_by_one(rows, username, v4_db)
+    Singleton.reset_messages()
+    messages = create_messages(rows, username, v4_db)
+    assert messages == expected
+    assert [type(message) for message in messages] == [type(message) for message in expected]
+
+
+def test_quotes_resolve_within_the_batch(v4_db, monkeypatch):
+    rows = v4_db.message_db.get_messages_by_username(FRIEND)
+    monkeypatch.setattr(v4_db, 'get_message_by_server_id', lambda *args: pytest.fail('逐条查询了引用消息'))
+    messages = create_messages(rows, FRIEND, v4_db)
+    quotes = [message for message in messages if message.type == QUOTE]
+    assert quotes and all(message.quote_message.server_id == message.server_id - 3 for message in quotes)
+
+
+def test_cost_stats_are_recorded_per_type(v4_db):
+    rows = v4_db.message_db.get_messages_by_username(FRIEND)
+    cost_stats = {}
+    create_messages(rows, FRIEND, v4_db, cost_stats)
+    assert {type_: count for type_, (count, _) in cost_stats.items()} == {TEXT: 32, IMAGE: 4, QUOTE: 4}
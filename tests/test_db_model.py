@@ -0,0 +1,59 @@
+import os
+import sqlite3
+
+import pytest
+
+from tests.fixture_db import make_v4_db
+from wxManager.db_v4.message import MessageDB
+
+
+def index_names(db_path):
+    with sqlite3.connect(db_path) as DB:
+        return {row[0] for row in DB.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'table')")}
+
+
+def table_indexes(db_path):
+    with sqlite3.connect(db_path) as DB:
+        return {row[0] for row in DB.execute("SELECT name FROM sqlite_master WHERE type='index' "
+                                              "AND name NOT LIKE 'sqlite_%'")}
+
+
+def test_read_only_database_provisions_indexes_by_default(tmp_path):
+    root = make_v4_db(str(tmp_path / 'db'))
+    db_path = os.path.join(root, 'message', 'message_0.db')
+    message_db = MessageDB('message/message_0.db', is_series=True)
+    assert message_db.read_only and not message_db.snapshot_writable()
+    assert message_db.init_database(root)
+    with pytest.raises(sqlite3.OperationalError):
+        message_db.DB[0].execute('CREATE TABLE t(a)')
+    message_db.close()
+    assert table_indexes(db_path)
+
+
+def test_immutable_database_is_not_modified(tmp_path):
+    root = make_v4_db(str(tmp_path / 'db'))
+    db_path = os.path.join(root, 'message', 'message_0.db')
+    before = index_names(db_path)
+
+    class ImmutableMessageDB(MessageDB):
+        immutable = True
+
+    message_db = ImmutableMessageDB('message/message_0.db', is_series=True)
+    assert message_db.init_database(root)
+    message_db.close()
+    assert index_names(db_path) == before
+
+
+def test_provision_indexes_is_idempotent(tmp_path):
+    root = make_v4_db(str(tmp_path / 'db'))
+    db_path = os.path.join(root, 'message', 'message_0.db')
+    for _ in range(2):
+        message_db = MessageDB('message/message_0.db', is_series=True)
+        assert message_db.init_database(root)
+        message_db.close()
+    names = index_names(db_path)
+    assert 'wxManager_meta' in names
+    with sqlite3.connect(db_path) as DB:
+        meta = {row[0] for row in DB.execute('SELECT key FROM wxManager_meta')}
+    indexes = table_indexes(db_path)
+    assert indexes and indexes <= meta
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from tests.fixture_db import FRIEND, make_v4_db
+from wxManager import DataBaseV4
+
+pq = pytest.importorskip('pyarrow.parquet')
+exporter_parquet = pytest.importorskip('exporter.exporter_parquet')
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = DataBaseV4(parallel=False)
+    assert database.init_database(make_v4_db(str(tmp_path / 'db_v4'), biz=False))
+    yield database
+    database.close()
+
+
+def export(database, output_dir, **kwargs):
+    finished = []
+    exporter = exporter_parquet.ParquetExporter(database, output_dir, finish_callback=finished.append, **kwargs)
+    return exporter, finished
+
+
+def test_reexport_replaces_previous_parts(database, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    dataset = os.path.join(output_dir, 'parquet')
+    messages = database.get_messages(FRIEND)
+    exporter, finished = export(database, output_dir)
+    assert exporter.export()
+    assert finished == [exporter.exporter_id]
+    # 上次导出留下的编号更大的文件、已经不存在的会话
+    month = messages[0].str_time[:7]
+    friend_part = os.path.join(dataset, f'talker={FRIEND}', f'month={month}', 'part-0.parquet')
+    os.rename(friend_part, friend_part.replace('part-0', 'part-7'))
+    pq.write_table(pq.read_table(friend_part.replace('part-0', 'part-7')), friend_part)
+    stale = os.path.join(dataset, 'talker=wxid_gone', 'month=2020-01')
+    os.makedirs(stale)
+    pq.write_table(pq.read_table(friend_part), os.path.join(stale, 'part-0.parquet'))
+
+    exporter, _ = export(database, output_dir, contacts=[FRIEND])
+    assert exporter.export()
+    talkers = pq.read_table(dataset).column('talker').to_pylist()
+    assert talkers.count(FRIEND) == len(messages)
+    assert 'wxid_gone' in talkers
+    # 导出整个账号时不存在的会话也被删除
+    exporter, _ = export(database, output_dir)
+    assert exporter.export()
+    table = pq.read_table(dataset)
+    assert set(table.column('talker').to_pylist()) == {FRIEND}
+    assert sorted(table.column('server_id').to_pylist()) == sorted(message.server_id for message in messages)
+
+
+def test_stopped_export_does_not_report_completion(database, tmp_path):
+    exporter, finished = export(database, str(tmp_path / 'out'))
+    exporter.stop()
+    assert exporter.export() is False
+    assert finished == []
@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from tests.fixture_db import FRIEND, TEXT, BASE_TIME, table_name
+
+exporter = pytest.importorskip('exporter')
+from exporter.config import FileType  # noqa: E402
+from exporter.manifest import ExportManifest  # noqa: E402
+
+
+def add_messages(v4_dir, seqs, server_id=None, content='late'):
+    with sqlite3.connect(os.path.join(v4_dir, 'message', 'message_1.db')) as DB:
+        DB.executemany(
+            f'insert into {table_name(FRIEND)}(server_id, local_type, sort_seq, real_sender_id, create_time, status, '
+            f'message_content, packed_info_data) values (?,?,?,2,?,2,?,?)',
+            [(1000 + seq if server_id is None else server_id, TEXT, seq, BASE_TIME + seq * 5 * 3600,
+              f'{content} {seq}', b'') for seq in seqs]
+        )
+
+
+def txt_exporter(v4_db, output_dir, time_range=None):
+    return exporter.TxtExporter(v4_db, v4_db.get_contact_by_username(FRIEND), output_dir, type_=FileType.TXT,
+                                time_range=time_range, incremental=True,
+                                manifest=ExportManifest(os.path.join(output_dir, ExportManifest.file_name)))
+
+
+def export_txt(v4_db, output_dir):
+    instance = txt_exporter(v4_db, output_dir)
+    instance.start()
+    return instance.output_file
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_new_messages_are_appended_once(v4_dir, v4_db, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    path = export_txt(v4_db, output_dir)
+    first = read(path)
+    assert 'hello 39' in first and 'late' not in first
+
+    # 没有新消息时文件不变
+    assert export_txt(v4_db, output_dir) == path
+    assert read(path) == first
+
+    add_messages(v4_dir, [41, 42])
+    assert export_txt(v4_db, output_dir) == path
+    content = read(path)
+    assert content.startswith(first)
+    assert content.count('late 41') == 1 and content.count('late 42') == 1
+    with open(os.path.join(output_dir, ExportManifest.file_name), encoding='utf-8') as f:
+        record = json.load(f)[FRIEND]['TXT']
+    assert (record['sort_seq'], record['message_ids'], record['offset']) == (42, [[1042, 22]], os.path.getsize(path))
+
+
+def test_boundary_messages_without_server_id_are_kept(v4_dir, v4_db, tmp_path):
+    # 3.x中MsgSvrID为0的消息，同一位置后来又出现一条，只按server_id去重会被当成已导出
+    output_dir = str(tmp_path / 'out')
+    add_messages(v4_dir, [41], server_id=0)
+    path = export_txt(v4_db, output_dir)
+    assert read(path).count('late 41') == 1
+    add_messages(v4_dir, [41], server_id=0, content='same second')
+    assert export_txt(v4_db, output_dir) == path
+    content = read(path)
+    assert content.count('late 41') == 1 and content.count('same second 41') == 1
+
+
+def test_latest_sort_seq_respects_time_range(v4_db, tmp_path):
+    # 第seq条消息的create_time为BASE_TIME + (seq - 1) * 5小时，时间范围的结束时间不包含在内
+    time_range = (BASE_TIME - 1, BASE_TIME + 20 * 5 * 3600)
+    assert txt_exporter(v4_db, str(tmp_path / 'out'), time_range).latest_sort_seq() == 20
+    assert txt_exporter(v4_db, str(tmp_path / 'out')).latest_sort_seq() == 40
+
+
+def test_edited_file_is_exported_again(v4_dir, v4_db, tmp_path):
+    output_dir = str(tmp_path / 'out')
+    path = export_txt(v4_db, output_dir)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('note')
+    add_messages(v4_dir, [41])
+    new_path = export_txt(v4_db, output_dir)
+    assert new_path != path
+    assert 'hello 1\n' in read(new_path) and 'late 41' in read(new_path)
@@ -0,0 +1,18 @@
+from tests.fixture_db import FRIEND, QUOTE
+from wxManager.model.message import message_values
+
+
+def test_iter_messages_matches_get_messages(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    streamed = list(v4_db.iter_messages(FRIEND, batch_size=3))
+    assert [m.sort_seq for m in streamed] == list(range(1, 41))
+    assert [message_values(m) for m in streamed] == [message_values(m) for m in messages]
+
+
+def test_iter_messages_start_sort_seq_and_quotes(v4_db):
+    streamed = list(v4_db.iter_messages(FRIEND, batch_size=4, start_sort_seq=21))
+    assert [m.sort_seq for m in streamed] == list(range(21, 41))
+    quotes = [m for m in streamed if m.type == QUOTE]
+    assert quotes and all(m.quote_message is not None for m in quotes)
+    assert [m.quote_message.server_id for m in quotes] == [m.server_id - 3 for m in quotes]
+    assert [m.quote_message.content for m in quotes] == [f'hello {m.sort_seq - 3}' for m in quotes]
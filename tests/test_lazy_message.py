@@ -0,0 +1,30 @@
+import pickle
+
+from tests.fixture_db import FRIEND
+from wxManager.model import LazyMessage, TextMessage
+
+
+def test_metadata_is_read_without_parsing(v4_db):
+    expected = v4_db.get_messages(FRIEND)
+    messages = v4_db.get_messages(FRIEND, lazy=True)
+    assert all(isinstance(message, LazyMessage) for message in messages)
+    assert [(m.sort_seq, m.is_sender, m.timestamp, m.type, m.sender_id, m.str_time) for m in messages] == \
+           [(m.sort_seq, m.is_sender, m.timestamp, m.type, m.sender_id, m.str_time) for m in expected]
+    assert all(message._message is None for message in messages)
+
+
+def test_content_access_loads_the_concrete_message(v4_db):
+    expected = v4_db.get_messages(FRIEND)
+    messages = v4_db.get_messages(FRIEND, lazy=True)
+    text = next(i for i, message in enumerate(expected) if isinstance(message, TextMessage))
+    assert messages[text].content == expected[text].content
+    assert isinstance(messages[text]._message, TextMessage)
+    assert messages[text + 1]._message is None
+    assert messages == expected
+
+
+def test_pickled_lazy_message_becomes_concrete(v4_db):
+    messages = list(v4_db.iter_messages(FRIEND, batch_size=7, lazy=True))
+    restored = pickle.loads(pickle.dumps(messages))
+    assert [type(message) for message in restored] == [type(message) for message in v4_db.get_messages(FRIEND)]
+    assert not any(isinstance(message, LazyMessage) for message in restored)
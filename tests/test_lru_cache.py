@@ -0,0 +1,47 @@
+from tests.fixture_db import FRIEND
+from wxManager.cache import LRUCache, cache_stats
+from wxManager.parser.wechat_v4 import Singleton
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache('test.lru', maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_hit_rate_counts_lookups_only():
+    cache = LRUCache('test.hits', maxsize=4)
+    cache['a'] = 1
+    assert cache.get('a') == 1
+    assert cache.get('missing') is None
+    assert 'a' in cache  # 不计入统计
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+    assert cache_stats()['test.hits']['hits'] == 1
+
+
+def test_max_bytes_limits_total_size():
+    cache = LRUCache('test.bytes', maxsize=0, max_bytes=10, sizeof=len)
+    cache['a'] = 'x' * 4
+    cache['b'] = 'y' * 4
+    cache['a'] = 'z' * 6  # 覆盖时扣除旧值大小
+    assert cache.nbytes == 10
+    cache['c'] = 'w'
+    assert 'b' not in cache
+    assert cache.nbytes == 7
+
+
+def test_parser_contact_cache_is_hit_on_repeated_parse(v4_db):
+    Singleton.contacts.clear()
+    Singleton.contacts.reset_stats()
+    messages = v4_db.get_messages(FRIEND)
+    assert messages
+    v4_db.get_messages(FRIEND)
+    stats = Singleton.contacts.stats()
+    assert stats['size'] > 0
+    assert stats['hits'] > stats['misses']
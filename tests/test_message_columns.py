@@ -0,0 +1,35 @@
+import pickle
+
+from tests.fixture_db import FRIEND
+from wxManager.manager_v4 import split_work_units
+from wxManager.model import MessageColumns
+
+
+def test_columns_round_trip_through_pickle(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    columns = pickle.loads(pickle.dumps(MessageColumns.from_messages(messages)))
+    assert len(columns) == len(messages)
+    restored = list(columns)
+    assert restored == messages
+    assert [type(message) for message in restored] == [type(message) for message in messages]
+    assert columns[-1] == messages[-1]
+    # 整个会话的talker_id只在字符串表中保存一次
+    assert columns.strings.count(FRIEND) == 1
+
+
+def test_columns_are_smaller_than_messages(v4_db):
+    messages = [message for _ in range(20) for message in v4_db.get_messages(FRIEND)]
+    assert len(pickle.dumps(MessageColumns.from_messages(messages))) < len(pickle.dumps(messages))
+
+
+def test_seq_ranges_cover_every_message_once(v4_db):
+    message_db = v4_db.message_db
+    sort_seqs = message_db.get_sort_seqs(FRIEND)
+    work_units = split_work_units(sort_seqs, 5)
+    assert len(work_units) > 2
+    seqs = []
+    for index, start, end in work_units:
+        rows = message_db.get_messages_by_seq_range(FRIEND, index, start, end)
+        assert all(start <= row[3] and (end is None or row[3] < end) for row in rows)
+        seqs.extend(row[3] for row in rows)
+    assert sorted(seqs) == [message.sort_seq for message in v4_db.get_messages(FRIEND)]
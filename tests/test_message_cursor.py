@@ -0,0 +1,69 @@
+from tests.fixture_db import BASE_TIME, FRIEND, make_v3_db
+from wxManager import DataBaseV3
+from wxManager.manager_v3 import _contexts
+from wxManager.model import MessageCursor
+
+
+def same_second_rows():
+    # 每三条消息同一秒，两个分库交替写入，翻页边界一定会落在同一秒的消息中间
+    return [(i % 2, 100 + i, i % 2, BASE_TIME + i // 3, f'message {i}') for i in range(20)]
+
+
+def page_through(database, msg_num):
+    pages = []
+    cursor = None
+    while True:
+        messages, cursor = database.get_messages_by_cursor(FRIEND, cursor, msg_num)
+        pages.append(messages)
+        if cursor is None:
+            return pages
+
+
+def test_v3_cursor_does_not_skip_messages_in_the_same_second(tmp_path):
+    root = make_v3_db(str(tmp_path / 'db_v3'), same_second_rows())
+    database = DataBaseV3(parallel=False)
+    assert database.init_database(root)
+    try:
+        for msg_num in (1, 2, 3, 4, 7):
+            pages = page_through(database, msg_num)
+            server_ids = [message.server_id for page in pages for message in page]
+            assert sorted(server_ids) == list(range(100, 120)), msg_num
+            assert len(set(server_ids)) == 20
+            assert all(len(page) <= msg_num for page in pages)
+            timestamps = [message.timestamp for page in pages for message in page]
+            assert timestamps == sorted(timestamps, reverse=True)
+    finally:
+        database.close()
+    assert root not in _contexts
+
+
+def test_v4_cursor_pages_across_shards(v4_db):
+    messages, token = v4_db.get_messages_by_cursor(FRIEND, None, 15)
+    assert [m.sort_seq for m in messages] == list(range(40, 25, -1))
+    cursor = MessageCursor.from_token(token)
+    assert cursor.sort_seq == 26 and len(cursor.shard_marks) == 2
+    seen = [m.sort_seq for m in messages]
+    while token:
+        messages, token = v4_db.get_messages_by_cursor(FRIEND, token, 15)
+        seen.extend(m.sort_seq for m in messages)
+    assert seen == list(range(40, 0, -1))
+
+
+def test_cursor_pages_within_time_range(v4_db, tmp_path):
+    # 第seq条消息的create_time为BASE_TIME + (seq - 1) * 5小时
+    time_range = (BASE_TIME + 9 * 5 * 3600, BASE_TIME + 20 * 5 * 3600)
+    messages, token = v4_db.get_messages_by_cursor(FRIEND, None, 4, time_range)
+    seen = [m.sort_seq for m in messages]
+    while token:
+        messages, token = v4_db.get_messages_by_cursor(FRIEND, token, 4, time_range)
+        seen.extend(m.sort_seq for m in messages)
+    assert seen == list(range(20, 10, -1))
+
+    root = make_v3_db(str(tmp_path / 'db_v3'), same_second_rows())
+    database = DataBaseV3(parallel=False)
+    assert database.init_database(root)
+    try:
+        messages, _ = database.get_messages_by_cursor(FRIEND, None, 20, (BASE_TIME, BASE_TIME + 3))
+        assert sorted(message.server_id for message in messages) == [103, 104, 105, 106, 107, 108]
+    finally:
+        database.close()
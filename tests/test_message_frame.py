@@ -0,0 +1,58 @@
+import numpy as np
+
+from tests.fixture_db import BASE_TIME, BIZ, FRIEND, IMAGE, ME, make_v3_db
+from wxManager import DataBaseV3, MessageType
+from wxManager.model import MessageFrame
+
+
+def test_v4_frame_matches_parsed_messages(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    frame = v4_db.get_message_frame(FRIEND)
+    assert len(frame) == len(messages)
+    assert frame.sort_seq.tolist() == [message.sort_seq for message in messages]
+    assert frame.server_id.tolist() == [message.server_id for message in messages]
+    assert frame.is_sender.tolist() == [bool(message.is_sender) for message in messages]
+    assert [frame.senders[i] for i in frame.sender.tolist()] == [message.sender_id for message in messages]
+    assert frame.send_count() == v4_db.get_send_messages_number(FRIEND)
+    assert frame.count_by_day() == v4_db.get_messages_by_days(FRIEND)
+    assert frame.count_by_month() == v4_db.get_messages_by_month(FRIEND)
+    assert frame.count_by_hour() == v4_db.get_messages_by_hour(FRIEND)
+    assert frame.count_by_type()[IMAGE] == len(v4_db.get_messages_by_type(FRIEND, MessageType.Image))
+    assert len(v4_db.get_message_frame(BIZ)) == 3
+
+
+def test_from_messages_and_take(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    frame = MessageFrame.from_messages(messages)
+    assert frame.talker_id == FRIEND
+    assert frame.count_by_day() == v4_db.get_message_frame(FRIEND).count_by_day()
+    assert dict(frame.count_by_sender()) == {ME: frame.send_count(), FRIEND: len(messages) - frame.send_count()}
+    sent = frame.take(frame.is_sender)
+    assert len(sent) == frame.send_count() and sent.is_sender.all()
+    assert sent.count_by_hour() == v4_db.get_send_messages_number_by_hour()
+    assert len(MessageFrame.from_messages([])) == 0
+
+
+def test_v3_frame_matches_parsed_messages(tmp_path):
+    rows = [(i % 2, 100 + i, i % 3 == 0, BASE_TIME + i * 4000, f'message {i}') for i in range(30)]
+    database = DataBaseV3(parallel=False)
+    assert database.init_database(make_v3_db(str(tmp_path / 'db_v3'), rows))
+    try:
+        messages = database.get_messages(FRIEND)
+        frame = database.get_message_frame(FRIEND)
+        assert frame.server_id.tolist() == [message.server_id for message in messages]
+        assert frame.is_sender.tolist() == [bool(message.is_sender) for message in messages]
+        assert frame.count_by_day() == MessageFrame.from_messages(messages).count_by_day()
+    finally:
+        database.close()
+
+
+def test_json_split_helpers():
+    frame = MessageFrame(FRIEND, timestamp=[0, 10, 20, 500, 510, 5000, 100])
+    assert frame.next_index(np.array([False, True, False, False, True, False, False])).tolist() == \
+           [1, 1, 4, 4, 4, 7, 7, 7]
+    assert frame.next_gap(300).tolist() == [3, 3, 3, 3, 5, 5, 7, 7]
+    assert frame.first_time_at_least(0, 20) == 2
+    assert frame.first_time_at_least(0, 6000) == 7
+    # 时间不是单调的：第6条比前面的早
+    assert frame.first_time_at_least(6, 50) == 6
@@ -0,0 +1,74 @@
+import pickle
+import threading
+
+from tests.fixture_db import FRIEND
+from wxManager.model import MessageType, QuoteMessage, TextMessage
+from wxManager.model.message import format_time
+
+TIMESTAMP = 1700000000
+
+
+def text_message(*args):
+    return TextMessage(1, 1001, 1, TIMESTAMP, *args, MessageType.Text, FRIEND, False, FRIEND, 'friend', '', 2, '',
+                       'hello')
+
+
+def test_positional_constructor_keeps_baseline_order():
+    message = text_message(format_time(TIMESTAMP))
+    assert (message.timestamp, message.type, message.talker_id, message.content) == \
+           (TIMESTAMP, MessageType.Text, FRIEND, 'hello')
+    assert not hasattr(message, '__dict__')
+
+
+def test_str_time_is_derived_unless_it_differs():
+    message = text_message(format_time(TIMESTAMP))
+    assert message._str_time is None
+    assert message.str_time == format_time(TIMESTAMP)
+    raw = text_message('昨天 下午3:00')
+    assert raw.str_time == '昨天 下午3:00'
+    raw.str_time = ''
+    assert raw.str_time == format_time(TIMESTAMP)
+    assert text_message('') == message
+
+
+def test_str_time_is_independent_per_thread():
+    messages = [TextMessage(i, i, i, TIMESTAMP + i * 86400, '', MessageType.Text, FRIEND, False, FRIEND, '', '', 2,
+                            '', '') for i in range(200)]
+    results = {}
+
+    def read(offset):
+        results[offset] = [messages[(i + offset) % 200].str_time for i in range(200)]
+
+    threads = [threading.Thread(target=read, args=(offset,)) for offset in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for offset, values in results.items():
+        assert values == [format_time(TIMESTAMP + (i + offset) % 200 * 86400) for i in range(200)]
+
+
+def test_interned_strings_and_subclass_json():
+    quote = QuoteMessage(2, 1002, 2, TIMESTAMP, '', MessageType.Quote, ''.join(['wxid_', 'friend']), True, FRIEND,
+                         'friend', '', 2, '', 'reply', text_message(''))
+    assert quote.talker_id is text_message('').talker_id
+    data = quote.to_json()
+    assert data['timestamp'] == TIMESTAMP and data['text'] == 'reply'
+
+
+def test_pickle_keeps_raw_time(v4_db):
+    raw = text_message('昨天 下午3:00')
+    assert pickle.loads(pickle.dumps(raw)).str_time == '昨天 下午3:00'
+    messages = v4_db.get_messages(FRIEND)
+    restored = pickle.loads(pickle.dumps(messages))
+    assert restored == messages
+    assert [m.str_time for m in restored] == [format_time(m.timestamp) for m in messages]
+    assert all(m._str_time is None for m in messages)
+
+
+def test_format_time_is_memoized_per_second():
+    format_time.cache_clear()
+    messages = [text_message(format_time(TIMESTAMP)) for _ in range(100)]
+    assert all(message.str_time == format_time(TIMESTAMP) for message in messages)
+    info = format_time.cache_info()
+    assert info.misses == 1 and info.hits >= 300
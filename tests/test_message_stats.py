@@ -0,0 +1,36 @@
+import time
+from collections import Counter
+
+from tests.fixture_db import BASE_TIME, BIZ, FRIEND
+
+
+def local(timestamp, fmt):
+    return time.strftime(fmt, time.localtime(timestamp))
+
+
+def test_counts_match_parsed_messages(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    assert v4_db.get_messages_number(FRIEND) == len(messages)
+    assert v4_db.get_send_messages_number(FRIEND) == sum(message.is_sender for message in messages)
+    assert v4_db.get_messages_number(BIZ) == len(v4_db.get_messages(BIZ, lazy=True))
+
+
+def test_grouped_counts_match_parsed_messages(v4_db):
+    messages = v4_db.get_messages(FRIEND)
+    for method, fmt in ((v4_db.get_messages_by_days, '%Y-%m-%d'), (v4_db.get_messages_by_month, '%Y-%m')):
+        assert method(FRIEND) == sorted(Counter(local(m.timestamp, fmt) for m in messages).items())
+    assert v4_db.get_messages_by_hour(FRIEND) == \
+           sorted(Counter(local(m.timestamp, '%H:00') for m in messages).items())
+
+
+def test_time_range_is_pushed_down(v4_db):
+    time_range = (BASE_TIME + 3600, BASE_TIME + 24 * 3600)
+    expected = [m for m in v4_db.get_messages(FRIEND) if time_range[0] <= m.timestamp <= time_range[1]]
+    assert 0 < len(expected) < v4_db.get_messages_number(FRIEND)
+    assert v4_db.get_messages_number(FRIEND, time_range) == len(expected)
+
+
+def test_sent_sum_covers_all_contacts(v4_db):
+    sent = sum(m.is_sender for username in (FRIEND, BIZ) for m in v4_db.get_messages(username, lazy=True))
+    assert v4_db.get_send_messages_number_sum() == sent
+    assert sum(count for _, count in v4_db.get_send_messages_number_by_hour()) == sent
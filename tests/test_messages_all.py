@@ -0,0 +1,64 @@
+import os
+import sqlite3
+
+from tests.fixture_db import BIZ, FRIEND, V4_MESSAGE_COLUMNS, make_v4_db, table_name
+from wxManager import DataBaseV4
+
+
+def test_all_conversations_in_sort_seq_order(v4_db):
+    items = list(v4_db.get_messages_all(lazy=True))
+    assert [item[1].sort_seq for item in items] == sorted(item[1].sort_seq for item in items)
+    by_user = {}
+    for username, message in items:
+        by_user.setdefault(username, []).append(message.server_id)
+    assert set(by_user) == {FRIEND, BIZ}
+    assert by_user[FRIEND] == [message.server_id for message in v4_db.get_messages(FRIEND)]
+    assert by_user[BIZ] == [5000, 5001, 5002]
+
+
+def test_parsed_messages_match_per_contact_api(tmp_path):
+    database = DataBaseV4(parallel=False)
+    assert database.init_database(make_v4_db(str(tmp_path / 'db_v4'), biz=False))
+    try:
+        items = list(database.get_messages_all())
+        assert {username for username, _ in items} == {FRIEND}
+        assert [message for _, message in items] == database.get_messages(FRIEND)
+    finally:
+        database.close()
+
+
+def test_tables_without_contact_are_skipped(v4_dir):
+    DB = sqlite3.connect(os.path.join(v4_dir, 'message', 'message_0.db'))
+    DB.execute(f'create table {table_name("wxid_stranger")}({V4_MESSAGE_COLUMNS}, packed_info_data)')
+    DB.execute(f'insert into {table_name("wxid_stranger")}(server_id, local_type, sort_seq, real_sender_id, '
+               f'create_time, status, message_content) values (9000, 1, 500, 1, 1700000000, 2, "lost")')
+    DB.commit()
+    DB.close()
+    database = DataBaseV4(parallel=False)
+    assert database.init_database(v4_dir)
+    try:
+        usernames = {username for username, _ in database.get_messages_all(lazy=True)}
+        assert usernames == {FRIEND, BIZ}
+    finally:
+        database.close()
+
+
+def test_contacts_resolved_once_and_windows_keep_order(v4_db, monkeypatch):
+    from wxManager import manager_v4
+    expected = [(username, message.server_id) for username, message in v4_db.get_messages_all()]
+    calls = []
+    conversation_contacts = manager_v4.conversation_contacts
+    monkeypatch.setattr(manager_v4, 'conversation_contacts',
+                        lambda context, username: calls.append(username) or conversation_contacts(context, username))
+    prefetches = []
+    prefetch_quote_messages = manager_v4.Singleton.prefetch_quote_messages
+    monkeypatch.setattr(manager_v4.Singleton, 'prefetch_quote_messages',
+                        lambda rows, username, *args, **kwargs:
+                        prefetches.append(len(rows)) or prefetch_quote_messages(rows, username, *args, **kwargs))
+    monkeypatch.setattr(manager_v4, 'PREFETCH_BATCH_SIZE', 7)
+    items = [(username, message.server_id) for username, message in v4_db.get_messages_all()]
+    assert items == expected
+    assert sorted(calls) == sorted({FRIEND, BIZ})
+    # 每个窗口内每个会话只预取一次
+    windows = -(-len(items) // 7)
+    assert len(prefetches) <= windows * 2 and sum(prefetches) == len(items)
@@ -0,0 +1,60 @@
+import multiprocessing
+
+import pytest
+
+from tests.fixture_db import FRIEND, IMAGE, QUOTE, TEXT
+from wxManager.planner import ParsePlanner
+
+
+def test_small_conversation_is_parsed_serially():
+    planner = ParsePlanner({TEXT: 15e-6})
+    plan = planner.plan({TEXT: 30000}, workers=8, pool_started=False)
+    assert not plan.parallel
+    assert plan.batch_num >= 1
+
+
+def test_slow_types_switch_to_parallel():
+    planner = ParsePlanner({TEXT: 15e-6, QUOTE: 500e-6})
+    planner.startup_seconds = 0.3
+    # 条数相同，只有类型分布不同
+    assert not planner.plan({TEXT: 20000}, workers=8, pool_started=False).parallel
+    plan = planner.plan({TEXT: 10000, QUOTE: 10000}, workers=8, pool_started=False)
+    assert plan.parallel
+    assert plan.batch_num == 20000 // ParsePlanner.min_batch_size
+
+
+@pytest.mark.parametrize('start_method, startup_seconds', [('fork', 0.3), ('spawn', 2.0), ('forkserver', 2.0)])
+def test_startup_seconds_follow_start_method(monkeypatch, start_method, startup_seconds):
+    monkeypatch.setattr(multiprocessing, 'get_start_method', lambda allow_none=False: start_method)
+    assert ParsePlanner().startup_seconds == startup_seconds
+
+
+def test_spawn_startup_keeps_mid_sized_conversations_serial(monkeypatch):
+    counts = {TEXT: 3000, QUOTE: 3000}
+    monkeypatch.setattr(multiprocessing, 'get_start_method', lambda allow_none=False: 'fork')
+    assert ParsePlanner({TEXT: 15e-6, QUOTE: 500e-6}).plan(counts, workers=8, pool_started=False).parallel
+    # spawn启动进程池更慢，同样的分布串行更快，条数更多时才值得并行
+    monkeypatch.setattr(multiprocessing, 'get_start_method', lambda allow_none=False: 'spawn')
+    planner = ParsePlanner({TEXT: 15e-6, QUOTE: 500e-6})
+    assert not planner.plan(counts, workers=8, pool_started=False).parallel
+    assert planner.plan({TEXT: 10000, QUOTE: 10000}, workers=8, pool_started=False).parallel
+
+
+def test_forced_mode_and_batch_size():
+    planner = ParsePlanner()
+    plan = planner.plan({TEXT: 100}, workers=4, pool_started=True, parallel=True, batch_size=30)
+    assert plan.parallel and plan.batch_num == 4
+    assert not planner.plan({TEXT: 10 ** 6}, workers=4, pool_started=True, parallel=False).parallel
+
+
+def test_record_smooths_measured_costs():
+    planner = ParsePlanner({TEXT: 10e-6})
+    planner.record({TEXT: (1000, 0.04), IMAGE: (0, 0.0)})
+    assert planner.cost(TEXT) == 10e-6 + (40e-6 - 10e-6) * ParsePlanner.smoothing
+    assert planner.cost(IMAGE) == ParsePlanner.default_cost
+
+
+def test_database_records_parse_costs_per_type(v4_db):
+    v4_db.parse_planner.costs.clear()
+    v4_db.get_messages(FRIEND)
+    assert {TEXT, IMAGE} <= set(v4_db.parse_planner.costs)
@@ -0,0 +1,27 @@
+from tests.fixture_db import BASE_TIME, FRIEND, IMAGE, table_name
+from wxManager import MessageType
+from wxManager.db_v4.message import message_filter
+from wxManager.model import DataBaseBase
+
+
+def test_build_select_uses_placeholders():
+    sql = DataBaseBase.build_select('Msg_x as msg', 'local_id', (('local_type', '='), ('create_time', '>')),
+                                    'sort_seq', True)
+    assert sql == 'select local_id\nfrom Msg_x as msg\nwhere local_type=? and create_time>?\norder by sort_seq\nlimit ?'
+
+
+def test_different_time_ranges_share_one_statement(v4_db):
+    message_db = v4_db.message_db
+    first = message_filter(None, (BASE_TIME, BASE_TIME + 86400))
+    second = message_filter(None, (BASE_TIME + 86400, BASE_TIME + 3 * 86400))
+    assert first[0] == second[0] and first[1] != second[1]
+    table = table_name(FRIEND)
+    assert message_db._build_sql(table, first[0]) == message_db._build_sql(table, second[0])
+
+
+def test_filtered_queries_return_matching_rows(v4_db):
+    time_range = (BASE_TIME + 20 * 3600, BASE_TIME + 60 * 3600)
+    rows = v4_db.message_db.get_messages_by_username(FRIEND, time_range)
+    assert rows and all(time_range[0] < row[5] < time_range[1] for row in rows)
+    images = v4_db.message_db.get_messages_by_type(FRIEND, MessageType.Image)
+    assert [row[3] for row in images] == [5, 15, 25, 35] and {row[2] for row in images} == {IMAGE}
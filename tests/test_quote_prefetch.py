@@ -0,0 +1,46 @@
+import pytest
+
+from tests.fixture_db import FRIEND, QUOTE, friend_rows
+from wxManager.parser.util import zstd_util
+from wxManager.parser.wechat_v4 import Singleton
+
+
+@pytest.fixture(autouse=True)
+def empty_quote_cache():
+    Singleton.reset_messages()
+    Singleton.quoted_messages.clear()
+    yield
+    Singleton.reset_messages()
+    Singleton.quoted_messages.clear()
+
+
+def test_quotes_are_fetched_in_one_batched_lookup(v4_db, monkeypatch):
+    lookups = []
+    get_messages_by_server_ids = v4_db.get_messages_by_server_ids
+
+    def counting(username, server_ids):
+        lookups.append(set(server_ids))
+        return get_messages_by_server_ids(username, server_ids)
+
+    monkeypatch.setattr(v4_db, 'get_messages_by_server_ids', counting)
+    monkeypatch.setattr(v4_db, 'get_message_by_server_id', lambda *args: pytest.fail('逐条查询了引用消息'))
+    messages = list(v4_db.iter_messages(FRIEND, start_sort_seq=10))
+    quotes = [m for m in messages if m.type == QUOTE]
+    assert [m.quote_message.content for m in quotes] == [f'hello {m.sort_seq - 3}' for m in quotes]
+    # 只有第一条引用的消息不在这一批里
+    assert lookups == [{1007}]
+
+
+def test_nested_quote_lookup_keeps_batch_decompression(v4_db, monkeypatch):
+    calls = []
+    decode = zstd_util._decode
+
+    def counting(data):
+        calls.append(data)
+        return decode(data)
+
+    monkeypatch.setattr(zstd_util, '_decode', counting)
+    messages = list(v4_db.iter_messages(FRIEND, start_sort_seq=10))
+    assert messages[0].type == QUOTE and messages[0].quote_message.content == 'hello 7'
+    blobs = [content for _, _, seq, _, _, _, content in friend_rows() if seq >= 10 and isinstance(content, bytes)]
+    assert blobs and all(calls.count(blob) == 1 for blob in blobs)
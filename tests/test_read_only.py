@@ -0,0 +1,28 @@
+import os
+import sqlite3
+
+import pytest
+
+from tests.fixture_db import FRIEND, table_name
+from wxManager.model import DataBaseBase
+
+
+def test_read_only_connection_rejects_writes(v4_db):
+    DB = v4_db.message_db.DB[0]
+    assert DB.execute('PRAGMA query_only').fetchone()[0] == 1
+    with pytest.raises(sqlite3.OperationalError):
+        DB.execute(f'delete from {table_name(FRIEND)}')
+    # 每个线程自己的连接也是只读的
+    with pytest.raises(sqlite3.OperationalError):
+        v4_db.message_db.get_connection(1).execute(f'delete from {table_name(FRIEND)}')
+
+
+def test_default_connection_is_writable(v4_dir):
+    db = DataBaseBase('contact/contact.db')
+    assert not db.read_only
+    assert db.init_database(v4_dir)
+    db.DB.execute("update contact set remark='x' where username=?", [FRIEND])
+    db.commit()
+    db.close()
+    with sqlite3.connect(os.path.join(v4_dir, 'contact', 'contact.db')) as DB:
+        assert DB.execute('select remark from contact where username=?', [FRIEND]).fetchone()[0] == 'x'
@@ -0,0 +1,40 @@
+import threading
+
+from tests.fixture_db import FRIEND, table_name
+
+
+def shard_info(cursor, table):
+    cursor.execute(f'select count(*) from {table}')
+    return threading.current_thread().name, id(cursor.connection), cursor.fetchone()[0]
+
+
+def test_map_shards_reuses_executor_and_per_thread_connections(v4_db):
+    message_db = v4_db.message_db
+    first = message_db.map_shards(shard_info, table_name(FRIEND))
+    executor = message_db.executor
+    second = message_db.map_shards(shard_info, table_name(FRIEND))
+    assert message_db.executor is executor
+    assert [count for _, _, count in first] == [20, 20]
+    assert all(name.startswith('MessageDB') for name, _, _ in first + second)
+    # 主线程的连接不会被工作线程使用
+    main_connections = {id(DB) for DB in message_db.DB}
+    assert not main_connections & {connection for _, connection, _ in first + second}
+    assert message_db.map_shards(shard_info, table_name(FRIEND), indexes=[1])[0][2] == 20
+
+
+def test_close_shuts_down_executor_and_connections(v4_db):
+    message_db = v4_db.message_db
+    message_db.map_shards(shard_info, table_name(FRIEND))
+    assert message_db._pool
+    message_db.close()
+    assert message_db._executor is None and message_db._pool == []
+
+
+def test_stream_shards_yields_rows_from_every_shard(v4_db):
+    def rows(cursor, table):
+        cursor.execute(f'select sort_seq from {table} order by sort_seq')
+        yield from cursor
+
+    iterators = v4_db.message_db.stream_shards(rows, {0: (table_name(FRIEND),), 1: (table_name(FRIEND),)})
+    assert [row[0] for row in iterators[0]] == list(range(1, 41, 2))
+    assert [row[0] for row in iterators[1]] == list(range(2, 41, 2))
@@ -0,0 +1,32 @@
+import os
+import sqlite3
+
+from tests.fixture_db import BIZ, FRIEND, TEXT, table_name
+from wxManager import MessageType
+from wxManager.db_v4.biz_message import BizMessageDB
+from wxManager.db_v4.message import MessageDB
+
+
+def test_table_index_only_lists_shards_with_the_conversation(v4_db):
+    assert v4_db.message_db.get_shard_indexes(FRIEND) == [0, 1]
+    assert v4_db.message_db.get_shard_indexes('wxid_unknown') == []
+    assert v4_db.get_messages('wxid_unknown') == []
+    assert v4_db.biz_message_db.get_shard_indexes(BIZ) == [0]
+
+
+def test_biz_message_db_shares_the_message_db_queries(v4_db):
+    assert isinstance(v4_db.biz_message_db, MessageDB)
+    assert 'packed_info_data' not in BizMessageDB.columns
+    rows = v4_db.biz_message_db.get_messages_by_type(BIZ, MessageType.Text)
+    assert [row[2] for row in rows] == [TEXT, TEXT]
+    assert [row[12] for row in rows] == ['welcome', 'news']
+
+
+def test_table_index_refreshes_after_new_table(v4_dir):
+    db_path = os.path.join(v4_dir, 'message', 'message_1.db')
+    with sqlite3.connect(db_path) as DB:
+        DB.execute(f'create table {table_name("wxid_new")}(local_id INTEGER PRIMARY KEY, sort_seq)')
+    message_db = MessageDB('message/message_0.db', is_series=True)
+    message_db.init_database(v4_dir)
+    assert message_db.get_shard_indexes('wxid_new') == [1]
+    message_db.close()
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+
+from tests.fixture_db import FRIEND, ME, table_name
+from wxManager.db_v4.message import TABLE_OWNER_TABLE, MessageDB
+
+
+def saved_owners(v4_dir, index):
+    with sqlite3.connect(os.path.join(v4_dir, 'message', f'message_{index}.db')) as DB:
+        if not DB.execute("select name from sqlite_master where name=?", [TABLE_OWNER_TABLE]).fetchone():
+            return None
+        return dict(DB.execute(f'select table_name, username from {TABLE_OWNER_TABLE}').fetchall())
+
+
+def open_message_db(v4_dir, writable=False):
+    message_db = MessageDB('message/message_0.db', is_series=True)
+    message_db.allow_snapshot_writes = writable
+    assert message_db.init_database(v4_dir)
+    return message_db
+
+
+def test_owners_are_resolved_without_touching_snapshot(v4_dir):
+    message_db = open_message_db(v4_dir)
+    assert message_db.get_table_usernames() == {table_name(FRIEND): FRIEND}
+    message_db.close()
+    assert saved_owners(v4_dir, 0) is None
+    assert saved_owners(v4_dir, 1) is None
+
+
+def test_owners_are_persisted_when_writes_allowed(v4_dir):
+    message_db = open_message_db(v4_dir, writable=True)
+    assert message_db.get_table_usernames([ME]) == {table_name(FRIEND): FRIEND}
+    message_db.close()
+    assert saved_owners(v4_dir, 0) == saved_owners(v4_dir, 1) == {table_name(FRIEND): FRIEND}
+    # 下次打开直接读取保存的结果，不需要候选用户名
+    message_db = open_message_db(v4_dir)
+    assert message_db.table_owners == {table_name(FRIEND): FRIEND}
+    message_db.close()
@@ -0,0 +1,39 @@
+from tests.fixture_db import FRIEND
+from wxManager import DataBaseV4
+
+
+def test_pool_is_created_lazily_and_reused(v4_dir, v4_db):
+    expected = v4_db.get_messages(FRIEND)
+    database = DataBaseV4(worker_num=2, parallel=True, parse_batch_size=10)
+    assert database.init_database(v4_dir)
+    try:
+        assert database._process_pool is None
+        assert database.get_messages(FRIEND) == expected
+        pool = database._process_pool
+        assert pool is not None
+        assert database.get_messages(FRIEND) == expected
+        assert database._process_pool is pool
+    finally:
+        database.close()
+    assert database._process_pool is None
+
+
+def test_serial_parse_never_starts_pool(v4_db):
+    assert v4_db.get_messages(FRIEND)
+    assert v4_db._process_pool is None
+
+
+def test_set_worker_num_recreates_pool(v4_dir):
+    database = DataBaseV4(worker_num=2, parallel=True, parse_batch_size=10)
+    assert database.init_database(v4_dir)
+    try:
+        database.get_messages(FRIEND)
+        pool = database._process_pool
+        database.set_worker_num(3)
+        assert database._process_pool is None
+        assert database.worker_count == 3
+        database.get_messages(FRIEND)
+        assert database._process_pool is not pool
+        assert database._process_pool._max_workers == 3
+    finally:
+        database.close()
@@ -0,0 +1,78 @@
+import pytest
+
+from tests.fixture_db import FRIEND, QUOTE
+from wxManager.parser.link_parser import parser_file, parser_link, parser_pat, parser_reply, parser_transfer, \
+    wx_pay_data
+from wxManager.parser.xml_parser import get_md5_from_xml, parse_xml
+
+LINK = '''<msg><appmsg appid="wx6618f1cfc6c132f8" sdkver="0"><title>标题</title><des>摘要</des><type>5</type>
+<url>https://mp.weixin.qq.com/s?__biz=MzA&amp;mid=1</url><thumburl>https://mmbiz.qpic.cn/0</thumburl>
+<sourceusername>gh_123456</sourceusername><sourcedisplayname>某公众号</sourcedisplayname></appmsg>
+<appinfo><appname>微信</appname></appinfo></msg>'''
+
+
+def test_text_follows_xmltodict_conventions():
+    document = parse_xml('<msg><a> x </a><b /><c k="v"/></msg>')
+    assert document.text('a') == 'x'
+    assert document.text('b') is None
+    assert document.text('missing') == ''
+    assert document.text('missing', None) is None
+    assert document.attr('c', 'k') == 'v'
+    assert document.attr('missing', 'k', None) is None
+
+
+def test_broken_xml_is_recovered_and_non_xml_rejected():
+    assert parse_xml('<msg><title>a & b</title><title2 x="1" x="2">t</title2></msg>').text('title2') == 't'
+    with pytest.raises(ValueError):
+        parse_xml('hello')
+
+
+def test_document_is_parsed_once():
+    assert parse_xml(LINK) is parse_xml(LINK)
+
+
+def test_flat_parsers_read_fields_by_path():
+    assert parser_link(LINK) == {
+        'title': '标题', 'desc': '摘要', 'url': 'https://mp.weixin.qq.com/s?__biz=MzA&mid=1',
+        'cover_url': 'https://mmbiz.qpic.cn/0', 'sourcedisplayname': '某公众号', 'appname': '微信',
+        'appid': 'wx6618f1cfc6c132f8', 'sourceusername': 'gh_123456'
+    }
+    assert parser_file('<msg><appmsg><title>报告.pdf</title><appattach><totallen>1048576</totallen>'
+                       '<fileext>pdf</fileext></appattach><md5>abc</md5></appmsg></msg>') == {
+        'file_name': '报告.pdf', 'file_size': 1048576, 'md5': 'abc', 'file_type': 'pdf', 'app_name': ''
+    }
+    assert parser_transfer('<msg><appmsg><wcpayinfo><paysubtype>3</paysubtype><feedesc>￥1.00</feedesc>'
+                           '<receiver_username>wxid_b</receiver_username></wcpayinfo></appmsg></msg>') == {
+        'pay_subtype': 3, 'pay_memo': '', 'fee_desc': '￥1.00', 'receiver_username': 'wxid_b'
+    }
+    assert parser_pat('<msg><appmsg><title>拍了拍</title><patinfo><fromusername>a</fromusername>'
+                      '<chatusername>b</chatusername><pattedusername>c</pattedusername>'
+                      '<template><![CDATA["${a}" 拍了拍我]]></template></patinfo></appmsg></msg>') == {
+        'title': '拍了拍', 'from_username': 'a', 'patted_username': 'c', 'chat_username': 'b',
+        'template': '"${a}" 拍了拍我'
+    }
+
+
+def test_pay_card_lines():
+    card = wx_pay_data('<msg><appmsg><title>微信支付凭证</title><template_id>t</template_id><mmreader>'
+                       '<template_header><title>微信支付凭证</title><display_name>微信支付</display_name>'
+                       '</template_header><template_detail><line_content><topline><value><word>￥12.00</word>'
+                       '</value></topline><lines><line><key><word>支付方式</word></key><value><word>零钱</word>'
+                       '</value></line><line><key><word>备注</word></key><value><word>午餐</word></value></line>'
+                       '</lines></line_content></template_detail></mmreader></appmsg></msg>')
+    assert (card['title'], card['display_name'], card['money'], card['payment_type'], card['more']) == \
+           ('微信支付凭证', '微信支付', '12.00', '零钱', '午餐')
+
+
+def test_md5_from_image_and_video():
+    assert get_md5_from_xml('<msg><img md5="aa" /></msg>') == 'aa'
+    assert get_md5_from_xml('<msg><videomsg md5="bb" /></msg>', 'video') == 'bb'
+    assert get_md5_from_xml('') is None
+
+
+def test_quote_messages_parsed_from_fixture(v4_db):
+    quotes = [message for message in v4_db.get_messages(FRIEND) if message.type == QUOTE]
+    assert quotes
+    for message in quotes:
+        assert message.content == f'reply {message.sort_seq}'
+        assert parser_reply(message.xml_content)['svrid'] == str(message.server_id - 3)
@@ -0,0 +1,56 @@
+import os
+
+import zstandard
+
+from wxManager.parser.util import zstd_util
+from wxManager.parser.util.zstd_util import decompress_many, decompress_text, load_dictionaries, prefetched
+
+
+def compress(text, **kwargs):
+    return zstandard.ZstdCompressor(**kwargs).compress(text.encode('utf-8'))
+
+
+def count_decodes(monkeypatch):
+    calls = []
+    decode = zstd_util._decode
+
+    def counting(data):
+        calls.append(data)
+        return decode(data)
+
+    monkeypatch.setattr(zstd_util, '_decode', counting)
+    return calls
+
+
+def test_decompress_many_returns_mapping_without_thread_state(monkeypatch):
+    outer, inner = compress('outer'), compress('inner')
+    texts = decompress_many([outer, outer, inner])
+    assert texts == {outer: 'outer', inner: 'inner'}
+    calls = count_decodes(monkeypatch)
+    assert decompress_text(outer) == 'outer'
+    assert calls == [outer]
+
+
+def test_nested_prefetch_keeps_outer_results(monkeypatch):
+    outer, inner = compress('outer message'), compress('inner message')
+    calls = count_decodes(monkeypatch)
+    with prefetched(decompress_many([outer])):
+        with prefetched(decompress_many([inner])):
+            assert decompress_text(inner) == 'inner message'
+            assert decompress_text(outer) == 'outer message'
+        # 内层退出后外层批量解压的结果还在
+        assert decompress_text(outer) == 'outer message'
+    assert calls == [outer, inner]
+    assert decompress_text(inner) == 'inner message'
+    assert calls == [outer, inner, inner]
+
+
+def test_trained_dictionary_is_loaded_from_snapshot(tmp_path):
+    samples = [f'<msg><appmsg><title>title {i}</title><des>description {i % 7}</des></appmsg></msg>'.encode()
+               for i in range(2000)]
+    dictionary = zstandard.train_dictionary(1024, samples)
+    os.makedirs(tmp_path / 'zstd_dict')
+    (tmp_path / 'zstd_dict' / 'message.dict').write_bytes(dictionary.as_bytes())
+    assert load_dictionaries(str(tmp_path)) == 1
+    data = zstandard.ZstdCompressor(dict_data=dictionary).compress(samples[5])
+    assert decompress_text(data) == samples[5].decode()
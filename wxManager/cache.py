@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/2 15:20
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-cache.py
+@Description : 进程内共享的LRU缓存，按条数或字节数限制容量，并统计命中率
+"""
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from wxManager.log import logger
+
+_MISSING = object()
+
+# 所有创建过的缓存，用于统一输出统计信息；缓存对象被回收后自动移除
+_registry = weakref.WeakSet()
+_registry_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    最近最少使用缓存，命中时刷新位置，超出容量时淘汰最久未使用的项
+    maxsize限制条数，max_bytes限制总字节数（由sizeof估算），两者任意一个超出都会淘汰
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, max_bytes: int = 0,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        """
+        @param name: 缓存名称，统计信息中按名称汇总
+        @param maxsize: 最多缓存的条数，0表示不限制
+        @param max_bytes: 最多占用的字节数，0表示不限制
+        @param sizeof: 估算单个值大小的函数，默认sys.getsizeof
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or sys.getsizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._data = OrderedDict()  # key -> (value, size)
+        self._lock = threading.RLock()
+        with _registry_lock:
+            _registry.add(self)
+
+    def _size(self, value):
+        if not self.max_bytes:
+            return 0
+        try:
+            return self.sizeof(value)
+        except:
+            return sys.getsizeof(value)
+
+    def _evict(self):
+        while self._data and (
+                (self.maxsize and len(self._data) > self.maxsize) or
+                (self.max_bytes and self.nbytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self._size(value)
+        with self._lock:
+            old = self._data.pop(key, _MISSING)
+            if old is not _MISSING:
+                self.nbytes -= old[1]
+            self._data[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            if item is _MISSING:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def update(self, items):
+        for key, value in dict(items).items():
+            self.put(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        # 只判断是否存在，不计入命中统计，也不刷新位置
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'<LRUCache {self.name} {len(self._data)}/{self.maxsize or "∞"}>'
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    所有缓存的统计信息，同名缓存（例如多个数据库对象各自的缓存）合并计算
+    @return: {name: {'size', 'maxsize', 'bytes', 'max_bytes', 'hits', 'misses', 'evictions', 'hit_rate'}}
+    """
+    with _registry_lock:
+        caches = list(_registry)
+    result = {}
+    for cache in caches:
+        stats = cache.stats()
+        if cache.name in result:
+            total = result[cache.name]
+            for key in ('size', 'maxsize', 'bytes', 'max_bytes', 'hits', 'misses', 'evictions'):
+                total[key] += stats[key]
+            lookups = total['hits'] + total['misses']
+            total['hit_rate'] = total['hits'] / lookups if lookups else 0.0
+        else:
+            result[cache.name] = stats
+    return dict(sorted(result.items()))
+
+
+def log_cache_stats():
+    """把所有缓存的统计信息输出到日志"""
+    for name, stats in cache_stats().items():
+        logger.info(
+            f'cache {name}: {stats["size"]}/{stats["maxsize"] or "∞"} items, {stats["bytes"]} bytes, '
+            f'hit_rate={stats["hit_rate"]:.2%} hits={stats["hits"]} misses={stats["misses"]} '
+            f'evictions={stats["evictions"]}'
+        )
+
+
+if __name__ == '__main__':
+    cache = LRUCache('demo', maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache.get('a')
+    cache['c'] = 3  # 淘汰最久未使用的b
+    print('b' in cache, cache_stats())
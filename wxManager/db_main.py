@@ -12,16 +12,39 @@
 from abc import ABC, abstractmethod
 
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 from typing import List, Any, Tuple
 
 from wxManager import MessageType
+from wxManager.cache import LRUCache, cache_stats
+from wxManager.log import logger
 from wxManager.model.contact import Contact
+from wxManager.planner import ParsePlanner, ParsePlan
 
 
 class DataBaseInterface(ABC):
-    def __init__(self):
-        self.chatroom_members_map = {}
+    # 工作进程启动时执行的函数，参数为db_dir，子类设置为打开数据库的函数
+    worker_initializer = None
+    # 测量之前各类型消息每条的解析耗时（秒），key和子类统计耗时用的类型一致
+    parse_cost_priors = {}
+
+    def __init__(self, worker_num=None, parallel=None, parse_batch_size=None):
+        """
+        @param worker_num: 解析消息的常驻进程池大小，None表示min(cpu核数, 16)
+        @param parallel: 解析消息时强制串行(False)或并行(True)，None表示根据实测的解析耗时自动选择
+        @param parse_batch_size: 并行解析时每批的消息数，None表示自动计算
+        """
+        self.db_dir = ''
+        self.worker_num = worker_num
+        self.parallel = parallel
+        self.parse_batch_size = parse_batch_size
+        self.parse_planner = ParsePlanner(self.parse_cost_priors)
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
+        self.chatroom_members_map = LRUCache('chatroom_members', maxsize=64)  # 群名 -> {wxid: 群成员}
+        self.emoji_urls = LRUCache('emoji_urls', maxsize=20000, max_bytes=8 * 1024 * 1024)  # (md5, thumb) -> url
         self.contacts_map = {}
 
     def init_database(self, db_dir=''):
@@ -30,6 +53,60 @@ class DataBaseInterface(ABC):
     def close(self):
         raise ValueError("子类必须实现该方法")
 
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """
+        解析消息用的常驻进程池，第一次使用时才创建，之后所有聊天记录共用，close()时关闭
+        每个工作进程只在启动时导入模块、打开一次数据库，批量导出时不用每个会话都重新启动进程
+        """
+        if self._process_pool is None:
+            with self._process_pool_lock:
+                if self._process_pool is None:
+                    self._process_pool = ProcessPoolExecutor(
+                        max_workers=self.worker_count,
+                        initializer=self.worker_initializer,
+                        initargs=(self.db_dir,) if self.worker_initializer else ()
+                    )
+        return self._process_pool
+
+    @property
+    def worker_count(self) -> int:
+        return self.worker_num or min(os.cpu_count() or 1, 16)
+
+    def plan_parse(self, type_counts, username='') -> ParsePlan:
+        """
+        根据消息的类型分布和各类型实测的解析耗时，决定串行还是并行解析以及拆分的批数
+        @param type_counts: {类型: 条数}
+        @param username:
+        @return:
+        """
+        plan = self.parse_planner.plan(type_counts, self.worker_count, self._process_pool is not None,
+                                       self.parallel, self.parse_batch_size)
+        logger.info(f'解析计划 {username}：{plan}')
+        return plan
+
+    def set_worker_num(self, worker_num):
+        """
+        修改进程池大小，已经启动的进程池会被关闭，下次使用时按新的大小创建
+        @param worker_num: None表示min(cpu核数, 16)
+        @return:
+        """
+        self.worker_num = worker_num
+        self.shutdown_process_pool()
+
+    def shutdown_process_pool(self):
+        with self._process_pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def cache_stats(self):
+        """
+        进程内所有缓存（解析出的消息、联系人、群成员、表情包链接等）的容量和命中率
+        @return: {name: {'size', 'maxsize', 'bytes', 'max_bytes', 'hits', 'misses', 'evictions', 'hit_rate'}}
+        """
+        return cache_stats()
+
     def get_session(self):
         """
         获取聊天会话窗口，在聊天界面显示
@@ -41,7 +118,35 @@ class DataBaseInterface(ABC):
             self,
             username_: str,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            lazy=False
+    ):
+        """
+        获取聊天记录
+        @param username_:
+        @param time_range:
+        @param lazy: 为True时返回LazyMessage，只统计条数、时间、发送者时不需要解压和解析消息内容（目前只有4.0支持）
+        @return: List[Message]
+        """
+        raise ValueError("子类必须实现该方法")
+
+    def iter_messages(
+            self,
+            username_: str,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+            lazy=False,
+            start_sort_seq=None
     ):
+        """
+        流式获取聊天记录，按时间顺序逐条返回解析好的消息，适合导出超大的聊天记录
+        @param username_:
+        @param time_range:
+        @param batch_size: 每次从数据库读取的行数
+        @param lazy: 同get_messages
+        @param start_sort_seq: 只返回sort_seq大于等于它的消息，增量导出时从上次导出的位置继续，
+                               等于它的消息需要调用方按server_id去重
+        @return: Iterator[Message]
+        """
         raise ValueError("子类必须实现该方法")
 
     def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
@@ -54,6 +159,17 @@ class DataBaseInterface(ABC):
         """
         raise ValueError("子类必须实现该方法")
 
+    def get_messages_by_cursor(self, username, cursor: str = None, msg_num=20, time_range=None):
+        """
+        键集分页获取聊天记录，从新到旧翻页，只解析本页返回的消息
+        @param username:
+        @param cursor: 上一页返回的游标，None表示从最新的消息开始
+        @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息，翻页时每一页都要传同样的值
+        @return: messages, 下一页的游标（没有更早的消息时为None）
+        """
+        raise ValueError("子类必须实现该方法")
+
     def get_message_by_server_id(self, username, server_id):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -63,6 +179,31 @@ class DataBaseInterface(ABC):
         """
         raise ValueError("子类必须实现该方法")
 
+    def get_messages_by_server_ids(self, username, server_ids) -> dict:
+        """
+        批量按server_id获取消息
+        @param username:
+        @param server_ids:
+        @return: {server_id: Message}
+        """
+        raise ValueError("子类必须实现该方法")
+
+    def get_message_frame(
+            self,
+            username_: str,
+            type_: MessageType = None,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ):
+        """
+        按列读取聊天记录的元数据（时间、类型、发送者等），不读取消息内容也不创建Message，
+        用于几千万条消息的条数、按天/小时/发送者统计
+        @param username_:
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: MessageFrame，按sort_seq排序
+        """
+        raise ValueError("子类必须实现该方法")
+
     def get_messages_group_by_day(
             self,
             username_: str,
@@ -72,6 +213,11 @@ class DataBaseInterface(ABC):
         raise ValueError("子类必须实现该方法")
 
     def get_messages_all(self, time_range=None):
+        """
+        获取所有会话的聊天记录，4.0按时间顺序流式返回(username, Message)
+        @param time_range:
+        @return:
+        """
         raise ValueError("子类必须实现该方法")
 
     def get_message_by_num(self, username_, local_id):
@@ -121,6 +267,16 @@ class DataBaseInterface(ABC):
     ) -> int:
         raise ValueError("子类必须实现该方法")
 
+    def get_send_messages_number(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        """
+        自己发给该联系人（群）的消息条数
+        """
+        raise ValueError("子类必须实现该方法")
+
     def get_chatted_top_contacts(
             self,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
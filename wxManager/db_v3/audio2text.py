@@ -42,6 +42,24 @@ class Audio2TextDB(DataBaseBase):
         else:
             return ''
 
+    def get_audio_texts(self, server_ids) -> dict:
+        """
+        批量获取语音转文字的结果
+        @param server_ids:
+        @return: {server_id: 文字}，没有转换过的server_id不在结果中
+        """
+        server_ids = list(set(server_ids))
+        texts = {}
+        cursor = self.DB.cursor()
+        # sqlite单条语句的参数个数有限制，分批查询
+        for start in range(0, len(server_ids), 900):
+            batch = server_ids[start:start + 900]
+            cursor.execute(f'select msgSvrId, text from Audio2Text where msgSvrId in ({",".join("?" * len(batch))})',
+                           batch)
+            for server_id, text in cursor.fetchall():
+                texts.setdefault(server_id, text)
+        return texts
+
     def add_text(self, server_id, text):
         try:
             cursor = self.DB.cursor()
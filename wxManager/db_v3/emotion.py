@@ -25,6 +25,7 @@ def singleton(cls):
 # 一定要保证只有一个实例对象
 
 class Emotion(DataBaseBase):
+    read_only = True
 
     def get_emoji_url(self, md5: str, thumb: bool) -> str | bytes:
         """供下载用，返回可能是url可能是bytes"""
@@ -12,39 +12,17 @@ import binascii
 import hashlib
 import os
 import traceback
-import xml.etree.ElementTree as ET
 
 from wxManager.merge import increase_data
 from wxManager.model.db_model import DataBaseBase
 from wxManager.log import logger
 from wxManager.model.message import Message
 from wxManager.parser.util.protocbuf.msg_pb2 import MessageBytesExtra
+from wxManager.parser.xml_parser import get_md5_from_xml
 
 image_root_path = "FileStorage\\MsgAttach\\"
 
 
-def get_md5_from_xml(content, type_="img"):
-    try:
-        if not content:
-            return None
-        content = content.strip('null:').strip()
-        # 解析XML
-        root = ET.fromstring(content)
-        if type_ == "img":
-            # 提取md5的值
-            md5_value = root.find(".//img").get("md5")
-        elif type_ == "video":
-            md5_value = root.find(".//videomsg").get("md5")
-        else:
-            md5_value = None
-        # print(md5_value)
-        return md5_value
-    except:
-        logger.error(traceback.format_exc())
-        logger.error(content)
-        return None
-
-
 class HardLinkImage(DataBaseBase):
     def get_image_path(self):
         pass
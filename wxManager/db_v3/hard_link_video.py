@@ -14,36 +14,16 @@ import hashlib
 import os
 import sqlite3
 import traceback
-import xml.etree.ElementTree as ET
 
 from wxManager.merge import increase_data
 from wxManager.model.db_model import DataBaseBase
 from wxManager.log import logger
 from wxManager.parser.util.protocbuf.msg_pb2 import MessageBytesExtra
+from wxManager.parser.xml_parser import get_md5_from_xml
 
 video_root_path = "FileStorage\\Video\\"
 
 
-def get_md5_from_xml(content, type_="img"):
-    try:
-        content = content.strip('null:').strip()
-        # 解析XML
-        root = ET.fromstring(content)
-        if type_ == "img":
-            # 提取md5的值
-            md5_value = root.find(".//img").get("md5")
-        elif type_ == "video":
-            md5_value = root.find(".//videomsg").get("md5")
-        else:
-            md5_value = None
-        # print(md5_value)
-        return md5_value
-    except ET.ParseError:
-        logger.error(traceback.format_exc())
-        logger.error(content)
-        return None
-
-
 class HardLinkVideo(DataBaseBase):
     def get_video_by_md5(self, md5: bytes | str):
         if not md5:
@@ -24,6 +24,8 @@ def get_ffmpeg_path():
 
 
 class MediaMsg(DataBaseBase):
+    read_only = True
+
     voice_visited = {}
 
     def get_media_buffer(self, reserved0):
@@ -2,17 +2,18 @@ import os.path
 import shutil
 import sqlite3
 import traceback
-import concurrent
 import hashlib
+import heapq
 import threading
-from concurrent.futures import ThreadPoolExecutor
+from array import array
 from datetime import datetime, date
 from typing import Tuple
 
 from wxManager import MessageType
 from wxManager.merge import increase_data, increase_update_data
 from wxManager.log import logger
-from wxManager.model import DataBaseBase
+from wxManager.model import DataBaseBase, MessageCursor, Me
+from wxManager.parser.util.proto_util import get_bytes_extra_sender
 
 
 
@@ -50,6 +51,35 @@ def convert_to_timestamp(time_range) -> Tuple[int, int]:
         return convert_to_timestamp_(time_range[0]), convert_to_timestamp_(time_range[1])
 
 
+def time_range_sql(time_range) -> Tuple[str, list]:
+    """
+    时间范围对应的参数化查询条件
+    @param time_range:
+    @return: 拼接在where后面的条件（没有时间范围时为空字符串）, 参数
+    """
+    if not time_range:
+        return '', []
+    return ' and CreateTime>? and CreateTime<?', list(convert_to_timestamp(time_range))
+
+
+def cursor_position(mark) -> Tuple[int, int]:
+    """
+    3.x分页游标的位置(CreateTime, localId)，CreateTime只精确到秒，同一秒内的消息再按localId区分
+    @param mark: 上一页最后一条消息的[CreateTime, localId]，整数表示CreateTime小于它的消息
+    @return:
+    """
+    if isinstance(mark, int):
+        return mark, 0
+    return mark[0], mark[1]
+
+
+def cursor_key(row) -> Tuple[int, int]:
+    """
+    一行消息在分页和多路归并中的排序键(CreateTime, localId)
+    """
+    return row[5], row[0]
+
+
 def get_local_type(type_: MessageType):
     type_name_dict = {
         MessageType.Text: (1, 0),
@@ -90,6 +120,18 @@ def get_local_type(type_: MessageType):
 
 
 class Msg(DataBaseBase):
+    read_only = True  # 消息分库体积大且只读，用只读连接减少IO
+
+    def self_init(self):
+        self.provision_indexes()
+
+    def index_definitions(self, table_names):
+        if 'MSG' not in table_names:
+            return []
+        return [
+            ('MSG_StrTalker_CreateTime', 'MSG', ('StrTalker', 'CreateTime')),
+            ('MSG_MsgSvrID', 'MSG', ('MsgSvrID',)),
+        ]
 
     def _get_messages_by_num(self, cursor, username_, start_sort_seq, msg_num):
         try:
@@ -101,11 +143,11 @@ class Msg(DataBaseBase):
             sql = '''
                 select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
                 from MSG
-                where StrTalker = ? and CreateTime < ?
-                order by CreateTime desc 
+                where StrTalker = ? and (CreateTime, localId) < (?, ?)
+                order by CreateTime desc, localId desc
                 limit ?
             '''
-            cursor.execute(sql, [username_, start_sort_seq, msg_num])
+            cursor.execute(sql, [username_, *cursor_position(start_sort_seq), msg_num])
             result = cursor.fetchall()
             if result:
                 return result
@@ -117,32 +159,48 @@ class Msg(DataBaseBase):
             return []
 
     def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
-        results = []
-        # for db in self.DB:
-        #     cursor = db.cursor()
-        #     yield self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
-        lock = threading.Lock()  # 锁，用于确保线程安全地写入 results
+        return self.map_shards(self._get_messages_by_num, username, start_sort_seq, msg_num)
 
-        def task(db):
-            """
-            每个线程执行的任务，获取某个数据库实例中的查询结果。
-            """
-            cursor = db.cursor()
-            try:
-                data = self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
-                with lock:  # 确保对 results 的操作是线程安全的
-                    results.append(data)
-            except Exception as e:
-                # 记录错误但不影响其他线程
-                logger.error(f"获取消息出错: {e}")
-            finally:
-                cursor.close()
+    def _iter_messages_by_num(self, cursor, username_, start_sort_seq, msg_num, time_range=None):
+        try:
+            # 先检查表是否存在
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MSG'")
+            if not cursor.fetchone():
+                return  # 表不存在
 
-        # 使用线程池
-        with ThreadPoolExecutor(max_workers=len(self.DB)) as executor:
-            executor.map(task, self.DB)
-        self.commit()
-        return results
+            time_sql, time_params = time_range_sql(time_range)
+            sql = f'''
+                select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+                from MSG
+                where StrTalker = ? and (CreateTime, localId) < (?, ?){time_sql}
+                order by CreateTime desc, localId desc
+                limit ?
+            '''
+            cursor.execute(sql, [username_, *cursor_position(start_sort_seq), *time_params, msg_num])
+            # 逐行读取，堆归并用到哪一行才从数据库取哪一行
+            yield from cursor
+        except Exception as e:
+            # 记录错误但不中断程序
+            logger.error(f"按数量查询数据库出错: {e}")
+        finally:
+            cursor.close()
+
+    def get_messages_by_cursor(self, username, message_cursor: MessageCursor = None, msg_num=20, time_range=None):
+        """
+        键集分页，从游标位置开始往前获取msg_num个消息
+        @param username:
+        @param message_cursor: 上一页返回的游标，None表示从最新的消息开始
+        @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息
+        @return: 本页消息（按CreateTime、localId倒序）, 下一页的游标
+        """
+        message_cursor = message_cursor or MessageCursor()
+        marks = message_cursor.marks(len(self.DB))
+        iterators = [
+            self._iter_messages_by_num(db.cursor(), username, mark, msg_num, time_range) if mark is not None else None
+            for db, mark in zip(self.DB, marks)
+        ]
+        return message_cursor.next_page(iterators, msg_num, key=cursor_key)
 
     def _get_messages_by_username(self, cursor, username: str,
                                   time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
@@ -174,27 +232,115 @@ class Msg(DataBaseBase):
 
     def get_messages_by_username(self, username: str,
                                  time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # 创建一个任务列表
-            futures = [
-                executor.submit(self._get_messages_by_username, db.cursor(), username, time_range)
-                for db in self.DB
-            ]
-
-            # 等待所有任务完成，并获取结果
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    r1 = future.result()
-                    if r1:
-                        # results.append(future.result())
-                        results.extend(r1)
-                except Exception as e:
-                    # 捕获并记录异常，但继续处理其他结果
-                    logger.error(f"获取用户消息时出错: {e}")
-
+        results = []
+        for r1 in self.map_shards(self._get_messages_by_username, username, time_range):
+            if r1:
+                results.extend(r1)
         return results
 
+    def _iter_messages_by_username(self, cursor, username: str,
+                                   time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+                                   batch_size=1000, start_sort_seq=None):
+        try:
+            # 先检查表是否存在
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MSG'")
+            if not cursor.fetchone():
+                return  # 表不存在
+
+            if time_range:
+                start_time, end_time = convert_to_timestamp(time_range)
+            sql = f'''
+                select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+                from MSG
+                where StrTalker=?
+                {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
+                {'AND CreateTime>=?' if start_sort_seq is not None else ''}
+                order by CreateTime, localId
+            '''
+            cursor.execute(sql, [username] if start_sort_seq is None else [username, start_sort_seq])
+            while True:
+                result = cursor.fetchmany(batch_size)
+                if not result:
+                    break
+                yield from result
+        except Exception as e:
+            # 记录错误但不中断程序
+            logger.error(f"查询数据库出错: {e}")
+        finally:
+            cursor.close()
+
+    def iter_messages_by_username(self, username: str,
+                                  time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+                                  batch_size=1000, start_sort_seq=None):
+        """
+        按CreateTime顺序逐条返回该联系人的所有消息
+        每个分库使用独立的游标，每次只读取batch_size条，再多路归并，内存占用与消息总数无关
+        @param username:
+        @param time_range:
+        @param batch_size: 每个分库游标一次读取的行数
+        @param start_sort_seq: 只返回CreateTime大于等于它的消息，增量导出时从上次导出的位置继续
+                               （包含同一秒的消息，由调用方按server_id去重）
+        @return: Iterator[tuple]
+        """
+        iterators = [
+            self._iter_messages_by_username(db.cursor(), username, time_range, batch_size, start_sort_seq)
+            for db in self.DB
+        ]
+        return heapq.merge(*iterators, key=cursor_key)
+
+    def _get_frame_rows(self, cursor, username: str, type_: MessageType = None,
+                        time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+                        batch_size=100000):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MSG'")
+        if not cursor.fetchone():
+            return array('q'), {}
+        where = ['StrTalker=?']
+        params = [username]
+        if type_ is not None:
+            where.append('Type=? AND SubType=?')
+            params.extend(get_local_type(type_))
+        if time_range:
+            start_time, end_time = convert_to_timestamp(time_range)
+            where.append('CreateTime>? AND CreateTime<?')
+            params.extend([start_time, end_time])
+        # 只有群聊里别人发的消息需要从BytesExtra中解析发送者
+        is_chatroom = username.endswith('@chatroom')
+        bytes_extra = 'case when IsSender=0 then BytesExtra end' if is_chatroom else 'NULL'
+        sql = f'''
+            select localId,ifnull(MsgSvrID,0),Type,SubType,CreateTime,IsSender,{bytes_extra}
+            from MSG
+            where {' AND '.join(where)}
+        '''
+        cursor.execute(sql, params)
+        # 发送者编号只在这个分库内有效：0是自己，1是私聊的对方，群成员依次往后编号
+        sender_index = {Me().wxid: 0}
+        talker = sender_index.setdefault(username, 1)
+        rows = array('q')
+        while True:
+            result = cursor.fetchmany(batch_size)
+            if not result:
+                break
+            for local_id, server_id, local_type, sub_type, create_time, is_sender, extra in result:
+                if is_sender:
+                    sender = 0
+                elif not is_chatroom:
+                    sender = talker
+                else:
+                    sender = sender_index.setdefault(get_bytes_extra_sender(extra), len(sender_index))
+                rows.extend((local_id, server_id, local_type | sub_type << 32, create_time, create_time, sender))
+        return rows, {index: wxid for wxid, index in sender_index.items()}
+
+    def get_frame_rows(self, username, type_: MessageType = None,
+                       time_range: Tuple[int | float | str | date, int | float | str | date] = None) -> list:
+        """
+        各分库中该联系人消息的整数列，用于构建MessageFrame，sort_seq即CreateTime
+        @param username:
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: [(array('q'), {发送者编号: wxid})]，每个分库一项
+        """
+        return self.map_shards(self._get_frame_rows, username, type_, time_range)
+
     def get_message_by_server_id(self, username, server_id):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -227,6 +373,43 @@ class Msg(DataBaseBase):
 
         return None
 
+    def _get_messages_by_server_ids(self, cursor, server_ids):
+        try:
+            # 先检查表是否存在
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='MSG'")
+            if not cursor.fetchone():
+                return []  # 表不存在，返回空列表
+
+            results = []
+            # sqlite单条语句的参数个数有限制，分批查询
+            for start in range(0, len(server_ids), 900):
+                batch = server_ids[start:start + 900]
+                sql = f'''
+                    select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+                    from MSG
+                    where MsgSvrID in ({",".join("?" * len(batch))})
+                '''
+                cursor.execute(sql, batch)
+                results.extend(cursor.fetchall())
+            return results
+        except Exception as e:
+            # 记录错误但不中断程序
+            logger.error(f"根据服务器ID批量查询消息出错: {e}")
+            return []
+
+    def get_messages_by_server_ids(self, username, server_ids):
+        """
+        批量按server_id获取消息，每个分库只查询一次
+        @param username:
+        @param server_ids:
+        @return: List[tuple]
+        """
+        server_ids = list(server_ids)
+        results = []
+        for r1 in self.map_shards(self._get_messages_by_server_ids, server_ids):
+            results.extend(r1)
+        return results
+
     def _get_messages_calendar(self, cursor, username):
         """
         获取某个人的聊天日历列表
@@ -292,25 +475,10 @@ class Msg(DataBaseBase):
 
     def get_messages_by_type(self, username: str, type_: MessageType,
                              time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # 创建一个任务列表
-            futures = [
-                executor.submit(self._get_messages_by_type, db.cursor(), username, type_, time_range)
-                for db in self.DB
-            ]
-
-            # 等待所有任务完成，并获取结果
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    r1 = future.result()
-                    if r1:
-                        # results.append(future.result())
-                        results.extend(r1)
-                except Exception as e:
-                    # 捕获并记录异常，但继续处理其他结果
-                    logger.error(f"按类型获取消息时出错: {e}")
-
+        results = []
+        for r1 in self.map_shards(self._get_messages_by_type, username, type_, time_range):
+            if r1:
+                results.extend(r1)
         return results
 
     def update_audio_text(self, MsgSvrID_, voicetrans_text):
@@ -24,6 +24,7 @@ from typing import Tuple
 from wxManager import MessageType
 from wxManager.merge import increase_data, increase_update_data
 from wxManager.log import logger
+from wxManager.db_v3.msg import cursor_position, time_range_sql
 from wxManager.model import DataBaseBase
 from wxManager.parser.util.protocbuf.msg_pb2 import MessageBytesExtra
 
@@ -102,32 +103,35 @@ def get_local_type(type_: MessageType):
 
 
 class OpenIMMsgDB(DataBaseBase):
+    read_only = True
 
-    def _get_messages_by_num(self, cursor, username_, start_sort_seq, msg_num):
+    def _get_messages_by_num(self, cursor, username_, start_sort_seq, msg_num, time_range=None):
         """
 
         @param cursor:
         @param username_:
         @param start_sort_seq:
         @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息
         @return:
         """
-        sql = '''
+        time_sql, time_params = time_range_sql(time_range)
+        sql = f'''
         select localId,TalkerId,Type,statusEx,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,'',Reserved1
         from ChatCRMsg
-        where StrTalker = ? and CreateTime < ?
-        order by CreateTime desc 
+        where StrTalker = ? and (CreateTime, localId) < (?, ?){time_sql}
+        order by CreateTime desc, localId desc
         limit ?
         '''
-        cursor.execute(sql, [username_, start_sort_seq, msg_num])
+        cursor.execute(sql, [username_, *cursor_position(start_sort_seq), *time_params, msg_num])
         result = cursor.fetchall()
         if result:
             return result
         else:
             return []
 
-    def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
-        results = [self._get_messages_by_num(self.DB.cursor(), username, start_sort_seq, msg_num)]
+    def get_messages_by_num(self, username, start_sort_seq, msg_num=20, time_range=None):
+        results = [self._get_messages_by_num(self.DB.cursor(), username, start_sort_seq, msg_num, time_range)]
         self.commit()
         return results
 
@@ -10,11 +10,12 @@ from concurrent.futures import ThreadPoolExecutor
 
 from wxManager import MessageType
 from wxManager.merge import increase_data
-from wxManager.db_v3.msg import convert_to_timestamp,get_local_type
+from wxManager.db_v3.msg import convert_to_timestamp,get_local_type, cursor_position, time_range_sql
 from wxManager.model import DataBaseBase
 
 
 class PublicMsg(DataBaseBase):
+    read_only = True
 
     def _get_messages_by_type(self, cursor, username: str, type_: MessageType,
                               time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
@@ -44,24 +45,25 @@ class PublicMsg(DataBaseBase):
         if not self.open_flag:
             return 0
 
-    def _get_messages_by_num(self, cursor, username_, start_sort_seq, msg_num):
-        sql = '''
+    def _get_messages_by_num(self, cursor, username_, start_sort_seq, msg_num, time_range=None):
+        time_sql, time_params = time_range_sql(time_range)
+        sql = f'''
             select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
             from PublicMsg
-            where StrTalker = ? and CreateTime < ?
-            order by CreateTime desc 
+            where StrTalker = ? and (CreateTime, localId) < (?, ?){time_sql}
+            order by CreateTime desc, localId desc
             limit ?
         '''
-        cursor.execute(sql, [username_, start_sort_seq, msg_num])
+        cursor.execute(sql, [username_, *cursor_position(start_sort_seq), *time_params, msg_num])
         result = cursor.fetchall()
         if result:
             return result
         else:
             return []
 
-    def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
+    def get_messages_by_num(self, username, start_sort_seq, msg_num=20, time_range=None):
         cursor = self.DB.cursor()
-        yield self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
+        yield self._get_messages_by_num(cursor, username, start_sort_seq, msg_num, time_range)
 
     def _get_messages_by_username(self, cursor, username: str,
                                   time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
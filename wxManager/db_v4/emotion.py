@@ -16,6 +16,8 @@ from wxManager.model import DataBaseBase
 
 
 class EmotionDB(DataBaseBase):
+    read_only = True
+
     def get_emoji_url(self, md5, thumb=False):
         emoji_info = self._get_emoji_info(md5)
         if emoji_info:
@@ -11,42 +11,43 @@
 import hashlib
 import os
 import traceback
-from lxml import etree
+from typing import List, Tuple
 
 from wxManager import Me
 from wxManager.merge import increase_data
 from wxManager.model.db_model import DataBaseBase
 from wxManager.log import logger
 from wxManager.model.message import Message
-from wxManager.parser.util.protocbuf import file_info_pb2
-from google.protobuf.json_format import MessageToJson, MessageToDict
+from wxManager.parser.util.common import DirListing
+from wxManager.parser.util.proto_util import get_file_dir
+from wxManager.parser.xml_parser import get_md5_from_xml
 
 image_root_path = "msg\\attach\\"
 video_root_path = "msg\\video\\"
 file_root_path = "msg\\file\\"
 
-
-def get_md5_from_xml(content, type_="img"):
-    if not content:
-        return None
-    try:
-        content = content.strip('null:').strip().replace(' length="0" ', ' ')  # 哪个天才在xml里写两个一样的字段 length="0"
-        # 解析XML
-        parser = etree.XMLParser(recover=True)
-        root = etree.fromstring(content, parser=parser)
-        if type_ == "img":
-            # 提取md5的值
-            md5_value = root.find(".//img").get("md5")
-        elif type_ == "video":
-            md5_value = root.find(".//videomsg").get("md5")
-        else:
-            md5_value = None
-        # print(md5_value)
-        return md5_value
-    except:
-        logger.error(traceback.format_exc())
-        logger.error(content)
-        return None
+# 按md5查询hardlink，{}处填入查询条件，最后一列md5用于批量查询时对应结果
+IMAGE_INFO_SQL = '''
+        select file_size,type,file_name,dir2id.username,dir2id2.username,_rowid_,modify_time,extra_buffer,md5
+        from image_hardlink_info_v3
+        join dir2id on dir2id.rowid = dir1
+        join dir2id as dir2id2 on dir2id2.rowid=dir2
+        where {}
+        '''
+VIDEO_INFO_SQL = '''
+        SELECT file_size, type, file_name, dir2id.username, dir2id2.username, _rowid_, modify_time, extra_buffer, md5
+        FROM video_hardlink_info_v3
+        JOIN dir2id ON dir2id.rowid = dir1
+        LEFT JOIN dir2id AS dir2id2 ON dir2id2.rowid = dir2 AND dir2 != 0
+        WHERE {}
+        '''
+FILE_INFO_SQL = '''
+        select file_size,type,file_name,dir2id.username,dir2id2.username,_rowid_,modify_time,extra_buffer,md5
+        from file_hardlink_info_v3
+        join dir2id on dir2id.rowid = dir1
+        LEFT JOIN dir2id AS dir2id2 ON dir2id2.rowid = dir2 AND dir2 != 0
+        where {}
+        '''
 
 
 class HardLinkDB(DataBaseBase):
@@ -82,74 +83,81 @@ class HardLinkDB(DataBaseBase):
             pass
 
     def get_image_by_md5(self, md5: str):
-        sql = '''
-        select file_size,type,file_name,dir2id.username,dir2id2.username,_rowid_,modify_time,extra_buffer
-        from image_hardlink_info_v3
-        join dir2id on dir2id.rowid = dir1
-        join dir2id as dir2id2 on dir2id2.rowid=dir2
-        where md5=?
-        '''
         cursor = self.DB.cursor()
-        cursor.execute(sql, [md5])
+        cursor.execute(IMAGE_INFO_SQL.format('md5=?'), [md5])
         result = cursor.fetchall()
         if result:
             return result[0]
         return None
 
     def get_video_by_md5(self, md5: str):
-        sql = '''
-        SELECT file_size, type, file_name, dir2id.username, dir2id2.username, _rowid_, modify_time, extra_buffer
-        FROM video_hardlink_info_v3
-        JOIN dir2id ON dir2id.rowid = dir1
-        LEFT JOIN dir2id AS dir2id2 ON dir2id2.rowid = dir2 AND dir2 != 0
-        WHERE md5 = ?
-        '''
         cursor = self.DB.cursor()
-        cursor.execute(sql, [md5])
+        cursor.execute(VIDEO_INFO_SQL.format('md5 = ?'), [md5])
         result = cursor.fetchall()
         if result:
             return result[0]
         return None
 
     def get_file_by_md5(self, md5: str):
-        sql = '''
-        select file_size,type,file_name,dir2id.username,dir2id2.username,_rowid_,modify_time,extra_buffer
-        from file_hardlink_info_v3
-        join dir2id on dir2id.rowid = dir1
-        LEFT JOIN dir2id AS dir2id2 ON dir2id2.rowid = dir2 AND dir2 != 0
-        where md5=?
-        '''
         cursor = self.DB.cursor()
-        cursor.execute(sql, [md5])
+        cursor.execute(FILE_INFO_SQL.format('md5=?'), [md5])
         result = cursor.fetchall()
         if result:
             return result[0]
         return None
 
+    def _get_infos_by_md5s(self, sql, md5s) -> dict:
+        """
+        批量按md5查询
+        @param sql: IMAGE_INFO_SQL等，{}处填入查询条件
+        @param md5s:
+        @return: {md5: 查询结果}，和逐条查询一样同一个md5只取第一条
+        """
+        md5s = list(set(md5s))
+        infos = {}
+        cursor = self.DB.cursor()
+        # sqlite单条语句的参数个数有限制，分批查询
+        for start in range(0, len(md5s), 900):
+            batch = md5s[start:start + 900]
+            cursor.execute(sql.format(f'md5 in ({",".join("?" * len(batch))})'), batch)
+            for info in cursor.fetchall():
+                infos.setdefault(info[8], info)
+        return infos
+
+    @staticmethod
+    def _video_path(video_info, thumb=False):
+        type_ = video_info[1]
+        if type_ == 5:
+            dir1 = video_info[3]
+            dir2 = video_info[4]
+            extra_buffer = video_info[7]
+            dir3 = get_file_dir(extra_buffer)
+            file_name = video_info[2]
+            result = os.path.join(video_root_path, dir1, dir2, 'Rec', dir3, 'V', file_name)
+        else:
+            dir1 = video_info[3]
+            data_image = video_info[2].split('.')[0] + '_thumb.jpg' if thumb else video_info[2]
+            dat_image = os.path.join(video_root_path, dir1, data_image)
+            result = dat_image
+        return result
+
     def get_video(self, md5, thumb=False):
         video_info = self.get_video_by_md5(md5)
         if video_info:
-            type_ = video_info[1]
-            if type_ == 5:
-                dir1 = video_info[3]
-                dir2 = video_info[4]
-                extra_buffer = video_info[7]
-                # 创建顶级消息对象
-                message = file_info_pb2.FileInfoData()
-                # 解析二进制数据
-                message.ParseFromString(extra_buffer)
-                extra_dic = MessageToDict(message)
-                dir3 = extra_dic.get('dir3', '')
-                file_name = video_info[2]
-                result = os.path.join(video_root_path, dir1, dir2, 'Rec', dir3, 'V', file_name)
-            else:
-                dir1 = video_info[3]
-                data_image = video_info[2].split('.')[0] + '_thumb.jpg' if thumb else video_info[2]
-                dat_image = os.path.join(video_root_path, dir1, data_image)
-                result = dat_image
-            return result
+            return self._video_path(video_info, thumb)
         return ''
 
+    def get_videos(self, md5s) -> dict:
+        """
+        批量获取视频路径，md5只查询一次
+        @param md5s:
+        @return: {md5: (视频路径, 缩略图路径)}，没有找到的md5不在结果中
+        """
+        return {
+            md5: (self._video_path(video_info, False), self._video_path(video_info, True))
+            for md5, video_info in self._get_infos_by_md5s(VIDEO_INFO_SQL, md5s).items()
+        }
+
     def get_image_thumb(self, message: Message, talker_username):
         """
         @param message:
@@ -190,6 +198,25 @@ class HardLinkDB(DataBaseBase):
             path1 = os.path.join(image_root_path, dir1, dir2, dir0, data_image)
             return path1
 
+    @staticmethod
+    def _image_path(imginfo):
+        type_ = imginfo[1]
+        if type_ == 4:
+            dir1 = imginfo[3]
+            dir2 = imginfo[4]
+            extra_buffer = imginfo[7]
+            dir3 = get_file_dir(extra_buffer)
+            file_name = imginfo[2]
+            result = os.path.join(image_root_path, dir1, dir2, 'Rec', dir3, 'Img', file_name)
+        else:
+            dir1 = imginfo[3]
+            dir2 = imginfo[4]
+            data_image = imginfo[2]
+            dir0 = "Img"
+            dat_image = os.path.join(image_root_path, dir1, dir2, dir0, data_image)
+            result = dat_image
+        return result
+
     def get_image(self, content, message, up_dir="", md5=None, thumb=False, talker_username='') -> str:
         """
         @param content: image xml
@@ -213,55 +240,83 @@ class HardLinkDB(DataBaseBase):
         if md5:
             imginfo = self.get_image_by_md5(md5)
             if imginfo:
-                type_ = imginfo[1]
-                if type_ == 4:
-                    dir1 = imginfo[3]
-                    dir2 = imginfo[4]
-                    extra_buffer = imginfo[7]
-                    # 创建顶级消息对象
-                    message = file_info_pb2.FileInfoData()
-                    # 解析二进制数据
-                    message.ParseFromString(extra_buffer)
-                    extra_dic = MessageToDict(message)
-                    dir3 = extra_dic.get('dir3', '')
-                    file_name = imginfo[2]
-                    result = os.path.join(image_root_path, dir1, dir2, 'Rec', dir3, 'Img', file_name)
-                else:
-                    dir1 = imginfo[3]
-                    dir2 = imginfo[4]
-                    data_image = imginfo[2]
-                    dir0 = "Img"
-                    dat_image = os.path.join(image_root_path, dir1, dir2, dir0, data_image)
-                    result = dat_image
+                result = self._image_path(imginfo)
             else:
                 result = self.get_image_thumb(message, talker_username)
         else:
             result = self.get_image_by_time(message, talker_username)
         return result
 
+    def get_images(self, messages: List[Message], talker_username) -> List[Tuple[str, str]]:
+        """
+        批量获取一组图片消息的原图和缩略图路径，结果和逐条调用get_image一样
+        每个目录只列一次文件，按时间找不到原图的消息最后一起按md5查询
+        @param messages: 图片消息，xml_content为图片的xml
+        @param talker_username: 聊天对象的wxid
+        @return: [(原图路径, 缩略图路径)]，和messages一一对应
+        """
+        self.create_index()
+        dir1 = hashlib.md5(talker_username.encode('utf-8')).hexdigest()
+        wx_dir = Me().wx_dir
+        listing = DirListing()
+        results = []
+        md5s = {}  # 需要按md5查找的消息下标 -> md5
+        for i, message in enumerate(messages):
+            image_dir = os.path.join(image_root_path, dir1, message.str_time[:7], "Img")
+            name = message.file_name if message.file_name else f'{message.local_id}_{message.timestamp}'
+            thumb_path = os.path.join(image_dir, f'{name}_t.dat')
+            path = ''
+            for suffix in ('_W.dat', '_h.dat', '.dat'):
+                image_path = os.path.join(image_dir, f'{name}{suffix}')
+                if listing.exists(os.path.join(wx_dir, image_path)):
+                    path = image_path
+                    break
+            if not path:
+                md5 = get_md5_from_xml(message.xml_content)
+                if md5:
+                    md5s[i] = md5
+                else:
+                    path = os.path.join(image_dir, f'{name}.dat')
+            results.append((path, thumb_path))
+        if md5s:
+            imginfos = self._get_infos_by_md5s(IMAGE_INFO_SQL, md5s.values())
+            for i, md5 in md5s.items():
+                thumb_path = results[i][1]
+                imginfo = imginfos.get(md5)
+                results[i] = (self._image_path(imginfo) if imginfo else thumb_path, thumb_path)
+        return results
+
+    @staticmethod
+    def _file_path(file_info):
+        type_ = file_info[1]
+        if type_ == 6:
+            dir1 = file_info[3]
+            dir2 = file_info[4]
+            extra_buffer = file_info[7]
+            dir3 = get_file_dir(extra_buffer)
+            file_name = file_info[2]
+            filepath = os.path.join(image_root_path, dir1, dir2, dir3, file_name)
+        else:
+            dir1 = file_info[3]
+            filename = file_info[2]
+            filepath = os.path.join(file_root_path, dir1, filename)
+        return filepath
+
     def get_file(self, md5):
         file_info = self.get_file_by_md5(md5)
         if file_info:
-            type_ = file_info[1]
-            if type_ == 6:
-                dir1 = file_info[3]
-                dir2 = file_info[4]
-                extra_buffer = file_info[7]
-                # 创建顶级消息对象
-                message = file_info_pb2.FileInfoData()
-                # 解析二进制数据
-                message.ParseFromString(extra_buffer)
-                extra_dic = MessageToDict(message)
-                dir3 = extra_dic.get('dir3', '')
-                file_name = file_info[2]
-                filepath = os.path.join(image_root_path, dir1, dir2, dir3, file_name)
-            else:
-                dir1 = file_info[3]
-                filename = file_info[2]
-                filepath = os.path.join(file_root_path, dir1, filename)
-            return filepath
+            return self._file_path(file_info)
         return ''
 
+    def get_files(self, md5s) -> dict:
+        """
+        批量获取文件路径，md5只查询一次
+        @param md5s:
+        @return: {md5: 文件路径}，没有找到的md5不在结果中
+        """
+        return {md5: self._file_path(file_info) for md5, file_info in
+                self._get_infos_by_md5s(FILE_INFO_SQL, md5s).items()}
+
     def merge(self, db_path):
         if not (os.path.exists(db_path) or os.path.isfile(db_path)):
             print(f'{db_path} 不存在')
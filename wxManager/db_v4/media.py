@@ -30,6 +30,8 @@ def get_ffmpeg_path():
 
 
 class MediaDB(DataBaseBase):
+    read_only = True
+
     def get_media_buffer(self, server_id) -> bytes:
         sql = '''
         select voice_data
@@ -8,20 +8,23 @@
 @File        : MemoTrace-message.py 
 @Description : 
 """
-import concurrent
 import hashlib
+import heapq
+import itertools
 import os
 import shutil
 import sqlite3
-import threading
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+from array import array
+from contextlib import closing
 from datetime import date, datetime
+from functools import lru_cache
 from typing import Tuple
 
 from wxManager import MessageType
+from wxManager.log import logger
 from wxManager.merge import increase_data, increase_update_data
-from wxManager.model.db_model import DataBaseBase
+from wxManager.model.db_model import DataBaseBase, MessageCursor
 
 
 def convert_to_timestamp_(time_input) -> int:
@@ -62,12 +65,185 @@ def get_local_type(type_: MessageType):
     return type_
 
 
+def time_range_filter(time_range) -> Tuple[tuple, list]:
+    """
+    时间范围对应的参数化查询条件
+    @param time_range:
+    @return: 条件, 参数
+    """
+    if not time_range:
+        return (), []
+    start_time, end_time = convert_to_timestamp(time_range)
+    return (('create_time', '>'), ('create_time', '<')), [start_time, end_time]
+
+
+def message_filter(type_: MessageType = None, time_range=None, start_sort_seq=None, end_sort_seq=None) \
+        -> Tuple[tuple, list]:
+    """
+    按消息类型、时间范围、sort_seq区间[start_sort_seq, end_sort_seq)过滤的参数化查询条件，值为None的条件不生效
+    @return: 条件, 参数
+    """
+    where, params = time_range_filter(time_range)
+    if type_ is not None:
+        where, params = (('local_type', '='),) + where, [get_local_type(type_)] + params
+    if start_sort_seq is not None:
+        where, params = where + (('sort_seq', '>='),), params + [start_sort_seq]
+    if end_sort_seq is not None:
+        where, params = where + (('sort_seq', '<'),), params + [end_sort_seq]
+    return where, params
+
+
+# 分组统计时的分组表达式，None表示不分组
+GROUP_BY_EXPRESSIONS = {
+    None: "''",
+    'hour': "strftime('%H:00',create_time,'unixepoch','localtime')",
+    'day': "strftime('%Y-%m-%d',create_time,'unixepoch','localtime')",
+    'month': "strftime('%Y-%m',create_time,'unixepoch','localtime')",
+}
+
+
+# MessageFrame需要的整数列，顺序和wxManager.model.frame.FRAME_COLUMNS一致
+FRAME_SQL_COLUMNS = ('local_id,ifnull(server_id,0),local_type,sort_seq,ifnull(create_time,0),'
+                     'ifnull(real_sender_id,0)')
+
+
+def fetch_frame_rows(cursor, table_name, where=(), params=(), batch_size=100000) -> Tuple[array, dict]:
+    """
+    读取一个分库中MessageFrame需要的整数列，不读取消息内容，逐行展开存进array('q')，每条消息只占48字节
+    @param cursor:
+    @param table_name: 消息表名
+    @param where: 同build_select
+    @param params:
+    @param batch_size: 每次从游标读取的行数
+    @return: (array('q'), {real_sender_id: 发送者wxid})
+    """
+    sql = DataBaseBase.build_select(f'{table_name} as msg', FRAME_SQL_COLUMNS, where)
+    cursor.execute(sql, params)
+    rows = array('q')
+    while True:
+        result = cursor.fetchmany(batch_size)
+        if not result:
+            break
+        rows.extend(itertools.chain.from_iterable(result))
+    sender_ids = set(rows[5::6])
+    cursor.execute('SELECT rowid, user_name FROM Name2Id')
+    sender_names = {rowid: user_name for rowid, user_name in cursor.fetchall() if rowid in sender_ids}
+    return rows, sender_names
+
+
+# 消息表名 -> 用户名的反查表，保存在每个分库中，下次打开时不用再计算md5匹配
+TABLE_OWNER_TABLE = 'wxManager_table_owner'
+
+
+def load_table_owners(cursor) -> dict:
+    """
+    读取分库中保存的消息表对应的用户名
+    @param cursor:
+    @return: {表名: username}
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?;", (TABLE_OWNER_TABLE,))
+    if not cursor.fetchone():
+        return {}
+    cursor.execute(f'SELECT table_name, username FROM {TABLE_OWNER_TABLE}')
+    return dict(cursor.fetchall())
+
+
+def save_table_owners(db_path, owners: dict) -> bool:
+    """
+    把消息表对应的用户名保存到分库中，通过单独的可写连接写入，文件不可写时跳过
+    @param db_path:
+    @param owners: {表名: username}
+    @return: 是否保存成功
+    """
+    if not owners or not os.access(db_path, os.W_OK):
+        return False
+    try:
+        with closing(sqlite3.connect(db_path)) as DB:
+            DB.execute(f'CREATE TABLE IF NOT EXISTS {TABLE_OWNER_TABLE}(table_name TEXT PRIMARY KEY, username TEXT)')
+            DB.executemany(f'INSERT OR REPLACE INTO {TABLE_OWNER_TABLE}(table_name, username) VALUES (?, ?)',
+                           owners.items())
+            DB.commit()
+        return True
+    except sqlite3.Error:
+        logger.error(f'保存消息表反查索引失败：{db_path}\n{traceback.format_exc()}')
+        return False
+
+
+@lru_cache(maxsize=4096)
+def get_table_name(username: str) -> str:
+    """
+    联系人对应的消息表名
+    @param username:
+    @return: Msg_<md5(username)>
+    """
+    return f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
+
+
 class MessageDB(DataBaseBase):
+    read_only = True  # 消息分库体积大且只读，用只读连接减少IO
+
     columns = (
         "local_id,server_id,local_type,sort_seq,Name2Id.user_name as sender_username,create_time,strftime('%Y-%m-%d %H:%M:%S',"
         "create_time,'unixepoch','localtime') as StrTime,status,upload_status,server_seq,origin_source,source,"
         "message_content,compress_content,packed_info_data")
 
+    def __init__(self, db_file_name, is_series=False):
+        super().__init__(db_file_name, is_series)
+        self.table_index = {}  # 消息表名 -> 包含该表的分库下标列表
+        self.table_owners = {}  # 消息表名 -> username
+        self._username_tables = {}  # 已经算过md5的用户名 -> 消息表名
+
+    def self_init(self):
+        self.provision_indexes()
+        self.build_table_index()
+
+    def index_definitions(self, table_names):
+        definitions = []
+        for table_name in table_names:
+            if table_name.startswith('Msg_'):
+                definitions.append((f'{table_name}_server_id', table_name, ('server_id',)))
+                definitions.append((f'{table_name}_type_seq', table_name, ('local_type', 'sort_seq')))
+                definitions.append((f'{table_name}_create_time', table_name, ('create_time',)))
+        return definitions
+
+    def build_table_index(self):
+        """
+        记录每个Msg_<md5>表位于哪些分库，查询时只访问包含该联系人消息表的分库，不用再逐个查sqlite_master
+        @return:
+        """
+        table_index = {}
+        table_owners = {}
+        for index, db in enumerate(self.DB):
+            cursor = db.cursor()
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'Msg_%';")
+            for (table_name,) in cursor.fetchall():
+                table_index.setdefault(table_name, []).append(index)
+            table_owners.update(load_table_owners(cursor))
+            cursor.close()
+        self.table_index = table_index
+        self.table_owners = {table_name: username for table_name, username in table_owners.items()
+                             if table_name in table_index}
+
+    def get_shard_indexes(self, username):
+        """
+        获取包含该联系人消息表的分库下标
+        @param username:
+        @return: List[int]
+        """
+        return self.table_index.get(get_table_name(username), [])
+
+    def get_shards(self, username):
+        """
+        获取包含该联系人消息表的分库
+        @param username:
+        @return: List[sqlite3.Connection]
+        """
+        return [self.DB[index] for index in self.get_shard_indexes(username)]
+
+    def _build_sql(self, table_name, where=(), order_by='sort_seq', limit=False):
+        return self.build_select(f'{table_name} as msg', self.columns, where, order_by, limit,
+                                 'join Name2Id on msg.real_sender_id = Name2Id.rowid')
+
     def get_messages(self):
         pass
 
@@ -80,19 +256,9 @@ class MessageDB(DataBaseBase):
 
     def _get_messages_by_username(self, cursor, username: str,
                                   time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        table_name = f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
-        if not self.table_exists(cursor, table_name):
-            return None
-        if time_range:
-            start_time, end_time = convert_to_timestamp(time_range)
-        sql = f'''
-select {MessageDB.columns}
-from {table_name} as msg
-join Name2Id on msg.real_sender_id = Name2Id.rowid
-{'where create_time>' + str(start_time) + ' AND create_time<' + str(end_time) if time_range else ''}
-order by sort_seq
-        '''
-        cursor.execute(sql)
+        where, params = time_range_filter(time_range)
+        sql = self._build_sql(get_table_name(username), where)
+        cursor.execute(sql, params)
         result = cursor.fetchall()
         if result:
             return result
@@ -101,58 +267,48 @@ order by sort_seq
 
     def get_messages_by_username(self, username: str,
                                  time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # 创建一个任务列表
-            futures = [
-                executor.submit(self._get_messages_by_username, db.cursor(), username, time_range)
-                for db in self.DB
-            ]
-
-            # 等待所有任务完成，并获取结果
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                r1 = future.result()
-                if r1:
-                    # results.append(future.result())
-                    results.extend(r1)
-
-        return results
         results = []
-        # for db in self.DB:
-        #     cursor = db.cursor()
-        #     yield self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
-        lock = threading.Lock()  # 锁，用于确保线程安全地写入 results
-
-        def task(db):
-            """
-            每个线程执行的任务，获取某个数据库实例中的查询结果。
-            """
-            cursor = db.cursor()
-            try:
-                data = self._get_messages_by_username(cursor, username, time_range)
-                with lock:  # 确保对 results 的操作是线程安全的
-                    results.append(data)
-            finally:
-                cursor.close()
-
-        # 使用线程池
-        with ThreadPoolExecutor(max_workers=len(self.DB)) as executor:
-            executor.map(task, self.DB)
-        self.commit()
+        for r1 in self.map_shards(self._get_messages_by_username, username, time_range,
+                                  indexes=self.get_shard_indexes(username)):
+            if r1:
+                results.extend(r1)
         return results
 
+    def _iter_messages_by_username(self, cursor, username: str,
+                                   time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+                                   batch_size=1000, start_sort_seq=None):
+        where, params = message_filter(None, time_range, start_sort_seq)
+        sql = self._build_sql(get_table_name(username), where)
+        cursor.execute(sql, params)
+        try:
+            while True:
+                result = cursor.fetchmany(batch_size)
+                if not result:
+                    break
+                yield from result
+        finally:
+            cursor.close()
+
+    def iter_messages_by_username(self, username: str,
+                                  time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+                                  batch_size=1000, start_sort_seq=None):
+        """
+        按sort_seq顺序逐条返回该联系人的所有消息
+        每个分库使用独立的游标，每次只读取batch_size条，再按sort_seq多路归并，内存占用与消息总数无关
+        @param username:
+        @param time_range:
+        @param batch_size: 每个分库游标一次读取的行数
+        @param start_sort_seq: 只返回sort_seq大于等于它的消息，增量导出时从上次导出的位置继续
+        @return: Iterator[tuple]
+        """
+        iterators = [
+            self._iter_messages_by_username(db.cursor(), username, time_range, batch_size, start_sort_seq)
+            for db in self.get_shards(username)
+        ]
+        return heapq.merge(*iterators, key=lambda row: row[3])
+
     def _get_messages_by_num(self, cursor, username, start_sort_seq, msg_num):
-        table_name = f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
-        if not self.table_exists(cursor, table_name):
-            return []
-        sql = f'''
-        select {MessageDB.columns}
-        from {table_name} as msg
-        join Name2Id on msg.real_sender_id = Name2Id.rowid
-        where sort_seq < ?
-        order by sort_seq desc 
-        limit ?
-                '''
+        sql = self._build_sql(get_table_name(username), (('sort_seq', '<'),), 'sort_seq desc', True)
         cursor.execute(sql, [start_sort_seq, msg_num])
         result = cursor.fetchall()
         if result:
@@ -167,56 +323,78 @@ order by sort_seq
         @param server_id:
         @return: messages, 最后一条消息的start_sort_seq
         """
-        table_name = f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
-        sql = f'''
-select {MessageDB.columns}
-from {table_name} as msg
-join Name2Id on msg.real_sender_id = Name2Id.rowid
-where server_id = ?
-'''
-        for db in self.DB:
+        sql = self._build_sql(get_table_name(username), (('server_id', '='),), '')
+        for db in self.get_shards(username):
             cursor = db.cursor()
-            if not self.table_exists(cursor, table_name):
-                continue
             cursor.execute(sql, [server_id])
             result = cursor.fetchone()
             if result:
                 return result
 
-    def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
+    def _get_messages_by_server_ids(self, cursor, username, server_ids):
+        sql = self._build_sql(get_table_name(username), order_by='')
         results = []
-        # for db in self.DB:
-        #     cursor = db.cursor()
-        #     yield self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
-        lock = threading.Lock()  # 锁，用于确保线程安全地写入 results
+        # sqlite单条语句的参数个数有限制，分批查询
+        for start in range(0, len(server_ids), 900):
+            batch = server_ids[start:start + 900]
+            cursor.execute(f'{sql}\nwhere server_id in ({",".join("?" * len(batch))})', batch)
+            results.extend(cursor.fetchall())
+        return results
 
-        def task(db):
-            """
-            每个线程执行的任务，获取某个数据库实例中的查询结果。
-            """
-            cursor = db.cursor()
-            try:
-                data = self._get_messages_by_num(cursor, username, start_sort_seq, msg_num)
-                with lock:  # 确保对 results 的操作是线程安全的
-                    results.append(data)
-            finally:
-                cursor.close()
-
-        # 使用线程池
-        with ThreadPoolExecutor(max_workers=len(self.DB)) as executor:
-            executor.map(task, self.DB)
-        self.commit()
+    def get_messages_by_server_ids(self, username, server_ids):
+        """
+        批量按server_id获取消息，每个分库只查询一次
+        @param username:
+        @param server_ids:
+        @return: List[tuple]
+        """
+        server_ids = list(server_ids)
+        results = []
+        for r1 in self.map_shards(self._get_messages_by_server_ids, username, server_ids,
+                                  indexes=self.get_shard_indexes(username)):
+            results.extend(r1)
         return results
 
+    def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
+        return self.map_shards(self._get_messages_by_num, username, start_sort_seq, msg_num,
+                               indexes=self.get_shard_indexes(username))
+
+    def _iter_messages_by_num(self, cursor, username, start_sort_seq, msg_num, time_range=None):
+        where, params = time_range_filter(time_range)
+        sql = self._build_sql(get_table_name(username), (('sort_seq', '<'),) + where, 'sort_seq desc', True)
+        try:
+            cursor.execute(sql, [start_sort_seq, *params, msg_num])
+            # 逐行读取，堆归并用到哪一行才从数据库取哪一行
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def get_messages_by_cursor(self, username, message_cursor: MessageCursor = None, msg_num=20, time_range=None):
+        """
+        键集分页，从游标位置开始往前获取msg_num个消息
+        @param username:
+        @param message_cursor: 上一页返回的游标，None表示从最新的消息开始
+        @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息
+        @return: 本页消息（按sort_seq倒序）, 下一页的游标
+        """
+        message_cursor = message_cursor or MessageCursor()
+        marks = message_cursor.marks(len(self.DB))
+        shards = set(self.get_shard_indexes(username))
+        iterators = [
+            self._iter_messages_by_num(db.cursor(), username, mark, msg_num, time_range)
+            if mark is not None and index in shards else None
+            for index, (db, mark) in enumerate(zip(self.DB, marks))
+        ]
+        return message_cursor.next_page(iterators, msg_num, key=lambda row: row[3])
+
     def _get_messages_calendar(self, cursor, username):
         """
         获取某个人的聊天日历列表
         @param username_:
         @return:
         """
-        table_name = f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
-        if not self.table_exists(cursor, table_name):
-            return None
+        table_name = get_table_name(username)
         sql = f'''SELECT DISTINCT strftime('%Y-%m-%d',create_time,'unixepoch','localtime') AS date
             from {table_name} as msg
             ORDER BY date desc;
@@ -227,7 +405,7 @@ where server_id = ?
 
     def get_messages_calendar(self, username):
         res = []
-        for db in self.DB:
+        for db in self.get_shards(username):
             r1 = self._get_messages_calendar(db.cursor(), username)
             if r1:
                 res.extend(r1)
@@ -236,20 +414,9 @@ where server_id = ?
 
     def _get_messages_by_type(self, cursor, username: str, type_: MessageType,
                               time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        table_name = f'Msg_{hashlib.md5(username.encode("utf-8")).hexdigest()}'
-        if not self.table_exists(cursor, table_name):
-            return None
-        if time_range:
-            start_time, end_time = convert_to_timestamp(time_range)
-        local_type = get_local_type(type_)
-        sql = f'''
-select {MessageDB.columns}
-from {table_name} as msg
-join Name2Id on msg.real_sender_id = Name2Id.rowid
-where local_type=? {'and create_time>' + str(start_time) + ' AND create_time<' + str(end_time) if time_range else ''}
-order by sort_seq
-        '''
-        cursor.execute(sql, [local_type])
+        where, params = time_range_filter(time_range)
+        sql = self._build_sql(get_table_name(username), (('local_type', '='),) + where)
+        cursor.execute(sql, [get_local_type(type_)] + params)
         result = cursor.fetchall()
         if result:
             return result
@@ -258,23 +425,225 @@ order by sort_seq
 
     def get_messages_by_type(self, username: str, type_: MessageType,
                              time_range: Tuple[int | float | str | date, int | float | str | date] = None, ):
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            # 创建一个任务列表
-            futures = [
-                executor.submit(self._get_messages_by_type, db.cursor(), username, type_, time_range)
-                for db in self.DB
-            ]
-
-            # 等待所有任务完成，并获取结果
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                r1 = future.result()
-                if r1:
-                    # results.append(future.result())
-                    results.extend(r1)
-
+        results = []
+        for r1 in self.map_shards(self._get_messages_by_type, username, type_, time_range,
+                                  indexes=self.get_shard_indexes(username)):
+            if r1:
+                results.extend(r1)
         return results
 
+    def _get_type_counts(self, cursor, username, type_=None, time_range=None):
+        where, params = message_filter(type_, time_range)
+        sql = self.build_select(f'{get_table_name(username)} as msg', 'local_type,count(*)', where)
+        cursor.execute(f'{sql}\ngroup by local_type', params)
+        return cursor.fetchall()
+
+    def get_type_counts(self, username, type_: MessageType = None,
+                        time_range: Tuple[int | float | str | date, int | float | str | date] = None):
+        """
+        该联系人各类型消息的条数，用于估算解析耗时
+        @param username:
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: {local_type: 条数}
+        """
+        counts = {}
+        for rows in self.map_shards(self._get_type_counts, username, type_, time_range,
+                                    indexes=self.get_shard_indexes(username)):
+            for local_type, count in rows:
+                counts[local_type] = counts.get(local_type, 0) + count
+        return counts
+
+    def _count_messages(self, cursor, table_names, group_by=None, sender='', time_range=None):
+        where, params = message_filter(None, time_range)
+        columns = (f'{GROUP_BY_EXPRESSIONS[group_by]} as grp,count(*),'
+                   f'sum(real_sender_id=(select rowid from Name2Id where user_name=?))')
+        counts = {}
+        for table_name in table_names:
+            sql = self.build_select(f'{table_name} as msg', columns, where)
+            cursor.execute(f'{sql}\ngroup by grp', [sender] + params)
+            for key, total, sent in cursor.fetchall():
+                item = counts.setdefault(key, [0, 0])
+                item[0] += total
+                item[1] += sent or 0
+        return counts
+
+    def count_messages(self, username=None, group_by=None, sender='',
+                       time_range: Tuple[int | float | str | date, int | float | str | date] = None):
+        """
+        在每个分库中用group by统计消息条数再合并，不读取消息内容
+        @param username: None表示所有联系人
+        @param group_by: None、'hour'、'day'、'month'
+        @param sender: 同时统计该wxid发送的条数
+        @param time_range:
+        @return: {分组: [总条数, sender发送的条数]}，不分组时分组为''
+        """
+        if username is None:
+            shard_tables = {}
+            for table_name, indexes in self.table_index.items():
+                for index in indexes:
+                    shard_tables.setdefault(index, []).append(table_name)
+        else:
+            table_name = get_table_name(username)
+            shard_tables = {index: [table_name] for index in self.get_shard_indexes(username)}
+        # 每个分库要统计的表不同，不能直接用map_shards
+        futures = [
+            self.executor.submit(self._run_on_shard, index, self._count_messages,
+                                 (table_names, group_by, sender, time_range))
+            for index, table_names in shard_tables.items()
+        ]
+        counts = {}
+        for future in futures:
+            for key, (total, sent) in future.result().items():
+                item = counts.setdefault(key, [0, 0])
+                item[0] += total
+                item[1] += sent
+        return counts
+
+    def _get_name2id_usernames(self, cursor):
+        cursor.execute('SELECT user_name FROM Name2Id')
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_table_usernames(self, usernames=()) -> dict:
+        """
+        消息表对应的联系人
+        表名是用户名的md5，只能对已知的用户名（传入的联系人以及各分库Name2Id中的用户）计算md5去匹配，每个用户名只计算一次md5，
+        允许修改数据库文件时（见snapshot_writable）匹配结果保存在分库中，以后只有新出现的消息表才需要再匹配
+        @param usernames: 额外的候选用户名，如通讯录中的联系人
+        @return: {表名: username}，匹配不上的表不在结果中
+        """
+        unresolved = self.table_index.keys() - self.table_owners.keys()
+        if unresolved:
+            candidates = set(usernames)
+            for names in self.map_shards(self._get_name2id_usernames):
+                candidates.update(names)
+            found = {}
+            for username in candidates:
+                table_name = self._username_tables.get(username)
+                if table_name is None:
+                    table_name = self._username_tables[username] = get_table_name(username)
+                if table_name in unresolved:
+                    found[table_name] = username
+            if found:
+                self.table_owners.update(found)
+                if self.snapshot_writable():
+                    for index, db_path in enumerate(self.db_paths):
+                        save_table_owners(db_path, {table_name: username for table_name, username in found.items()
+                                                    if index in self.table_index[table_name]})
+        return dict(self.table_owners)
+
+    def get_orphan_tables(self, usernames=()) -> dict:
+        """
+        找不到对应联系人的消息表
+        @param usernames: 额外的候选用户名
+        @return: {表名: [分库下标]}
+        """
+        table_owners = self.get_table_usernames(usernames)
+        return {table_name: indexes for table_name, indexes in self.table_index.items()
+                if table_name not in table_owners}
+
+    def _get_table_sizes(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'Msg_%';")
+        sizes = []
+        for (table_name,) in cursor.fetchall():
+            cursor.execute(f'SELECT count(*) FROM {table_name}')
+            sizes.append((table_name, cursor.fetchone()[0]))
+        return sizes
+
+    def get_table_sizes(self, usernames=()) -> dict:
+        """
+        每个分库中各个会话的消息条数
+        @param usernames: 额外的候选用户名
+        @return: {分库文件名: [(表名, username, 消息条数)]}，按条数从多到少排列，找不到联系人的表username为None
+        """
+        table_owners = self.get_table_usernames(usernames)
+        report = {}
+        for db_path, sizes in zip(self.db_paths, self.map_shards(self._get_table_sizes)):
+            sizes.sort(key=lambda item: item[1], reverse=True)
+            report[os.path.basename(db_path)] = [(table_name, table_owners.get(table_name), num)
+                                                 for table_name, num in sizes]
+        return report
+
+    def _iter_all_messages(self, cursor, table_usernames, time_range=None):
+        where, params = time_range_filter(time_range)
+        iterators = []
+        for table_name, username in table_usernames:
+            table_cursor = cursor.connection.cursor()
+            table_cursor.execute(self._build_sql(table_name, where), params)
+            iterators.append(zip(itertools.repeat(username), table_cursor))
+        # 同一个分库中的所有表按sort_seq归并
+        return heapq.merge(*iterators, key=lambda item: item[1][3])
+
+    def iter_all_messages(self, table_usernames: dict,
+                          time_range: Tuple[int | float | str | date, int | float | str | date] = None):
+        """
+        所有会话的消息按sort_seq顺序流式返回，每个分库在单独的线程中读取
+        @param table_usernames: {表名: username}，只读取其中的表
+        @param time_range:
+        @return: Iterator[(username, row)]
+        """
+        shard_args = {}
+        for table_name, username in table_usernames.items():
+            for index in self.table_index.get(table_name, []):
+                shard_args.setdefault(index, ([], time_range))[0].append((table_name, username))
+        return heapq.merge(*self.stream_shards(self._iter_all_messages, shard_args), key=lambda item: item[1][3])
+
+    def _get_sort_seqs(self, cursor, username, type_=None, time_range=None):
+        where, params = message_filter(type_, time_range)
+        sql = self.build_select(f'{get_table_name(username)} as msg', 'sort_seq', where, 'sort_seq')
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_sort_seqs(self, username, type_: MessageType = None,
+                      time_range: Tuple[int | float | str | date, int | float | str | date] = None):
+        """
+        各分库中该联系人消息的sort_seq（升序），只读一个整数列，用于在不读取消息内容的情况下切分解析任务
+        @param username:
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: {分库下标: [sort_seq]}
+        """
+        indexes = self.get_shard_indexes(username)
+        return dict(zip(indexes, self.map_shards(self._get_sort_seqs, username, type_, time_range, indexes=indexes)))
+
+    def _get_frame_rows(self, cursor, username, type_=None, time_range=None):
+        where, params = message_filter(type_, time_range)
+        return fetch_frame_rows(cursor, get_table_name(username), where, params)
+
+    def get_frame_rows(self, username, type_: MessageType = None,
+                       time_range: Tuple[int | float | str | date, int | float | str | date] = None) -> list:
+        """
+        各分库中该联系人消息的整数列，用于构建MessageFrame
+        @param username:
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: [(array('q'), {real_sender_id: wxid})]，每个分库一项
+        """
+        return self.map_shards(self._get_frame_rows, username, type_, time_range,
+                               indexes=self.get_shard_indexes(username))
+
+    def _get_messages_by_seq_range(self, cursor, username, start_sort_seq, end_sort_seq, type_=None,
+                                   time_range=None):
+        where, params = message_filter(type_, time_range, start_sort_seq, end_sort_seq)
+        sql = self._build_sql(get_table_name(username), where)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def get_messages_by_seq_range(self, username, index, start_sort_seq, end_sort_seq=None, type_: MessageType = None,
+                                  time_range: Tuple[int | float | str | date, int | float | str | date] = None):
+        """
+        获取第index个分库中sort_seq在[start_sort_seq, end_sort_seq)之间的消息
+        @param username:
+        @param index: 分库下标
+        @param start_sort_seq:
+        @param end_sort_seq: None表示不限制上界
+        @param type_: None表示所有类型
+        @param time_range:
+        @return: List[tuple]
+        """
+        return self._run_on_shard(index, self._get_messages_by_seq_range,
+                                  (username, start_sort_seq, end_sort_seq, type_, time_range))
+
     def merge(self, db_file_name):
         def task_(db_path, cursor, db):
             """
@@ -315,8 +684,54 @@ order by sort_seq
         # with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
         #     executor.map(lambda args: task_(*args), tasks)
         self.commit()
+        self.provision_indexes()
+        self.build_table_index()  # 合并后可能新增了联系人的消息表
         print(len(tasks))
 
 
 if __name__ == '__main__':
-    pass
+    # 索引的基准测试：按server_id查引用消息、按类型取消息、按时间范围取消息，分别在建立索引前后计时
+    import random
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        os.makedirs(os.path.join(db_dir, 'message'))
+        db_path = os.path.join(db_dir, 'message', 'message_0.db')
+        table = get_table_name('wxid_benchmark')
+        with closing(sqlite3.connect(db_path)) as DB:
+            DB.execute('CREATE TABLE Name2Id(user_name TEXT)')
+            DB.execute(f'CREATE TABLE {table}(local_id INTEGER PRIMARY KEY, server_id, local_type, sort_seq, '
+                       f'real_sender_id, create_time, status, upload_status, server_seq, origin_source, source, '
+                       f'message_content, compress_content, packed_info_data)')
+            DB.executemany(f'INSERT INTO {table}(server_id, local_type, sort_seq, create_time, message_content) '
+                           f'VALUES (?,?,?,?,?)',
+                           [(random.getrandbits(62), random.choice((1, 1, 1, 3, 34, 47, 49)), i * 1000, 1600000000 + i,
+                             'x' * 20) for i in range(300000)])
+            DB.commit()
+        server_ids = [row[0] for row in sqlite3.connect(db_path).execute(
+            f'SELECT server_id FROM {table} ORDER BY random() LIMIT 200')]
+        queries = [
+            ('server_id', f'SELECT * FROM {table} WHERE server_id=?', [[server_id] for server_id in server_ids]),
+            ('local_type', f'SELECT * FROM {table} WHERE local_type=? ORDER BY sort_seq LIMIT 100', [[3], [34]] * 50),
+            ('create_time', f'SELECT * FROM {table} WHERE create_time>=? AND create_time<? ORDER BY create_time',
+             [[t, t + 3600] for t in random.sample(range(1600000000, 1600300000), 100)]),
+        ]
+
+        def run_queries(label):
+            message_db = MessageDB('message/message_0.db', is_series=True)
+            if label == '建立索引前':
+                message_db.immutable = True  # immutable时跳过建立索引
+            message_db.init_database(db_dir)
+            for name, sql, params in queries:
+                st = time.perf_counter()
+                for param in params:
+                    message_db.DB[0].execute(sql, param).fetchall()
+                print(f'{label} {name}：{time.perf_counter() - st:.3f}s（{len(params)}次）')
+            message_db.close()
+
+        run_queries('建立索引前')
+        st = time.perf_counter()
+        MessageDB('message/message_0.db', is_series=True).init_database(db_dir)
+        print(f'建立索引耗时：{time.perf_counter() - st:.3f}s')
+        run_queries('建立索引后')
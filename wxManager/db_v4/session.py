@@ -16,6 +16,8 @@ from wxManager.model.db_model import DataBaseBase
 
 
 class SessionDB(DataBaseBase):
+    read_only = True
+
     def get_session(self):
         if not self.open_flag:
             return []
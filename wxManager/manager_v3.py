@@ -9,8 +9,10 @@
 @Description : 
 """
 import concurrent
+import itertools
 import os
 import re
+import threading
 import traceback
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import date
@@ -26,7 +28,7 @@ from wxManager.db_v3.hard_link_image import HardLinkImage
 from wxManager.db_v3.hard_link_video import HardLinkVideo
 
 from wxManager.db_v3.misc import Misc
-from wxManager.db_v3.msg import Msg
+from wxManager.db_v3.msg import Msg, cursor_key
 from wxManager.db_v3.media_msg import MediaMsg
 from wxManager.db_v3.emotion import Emotion
 from wxManager.db_v3.open_im_contact import OpenIMContactDB
@@ -36,10 +38,12 @@ from wxManager.db_v3.public_msg import PublicMsg
 from wxManager.db_v3.micro_msg import MicroMsg
 from wxManager.db_v3.favorite import Favorite
 from wxManager.log import logger
+from wxManager.model import MessageCursor, MessageFrame
 from wxManager.model.contact import Contact, Me, ContactType, Person
 from wxManager.parser.file_parser import get_image_type
 from wxManager.parser.util.protocbuf.roomdata_pb2 import ChatRoomData
 from wxManager.parser.wechat_v3 import FACTORY_REGISTRY, parser_sub_type, Singleton
+from wxManager.planner import timed_create_batch
 
 type_name_dict = {
     (1, 0): MessageType.Text,
@@ -141,9 +145,77 @@ def decodeExtraBuf(extra_buf_content: bytes):
         }
 
 
-def parser_messages(messages, username, db_dir=''):
-    context = DataBaseV3()
-    context.init_database(db_dir)
+# 进程内共享的数据库上下文，key为db_dir，value为(创建进程的pid, DataBaseV3)
+_contexts = {}
+_contexts_lock = threading.RLock()
+
+
+def register_context(db_dir, context):
+    """
+    把已经初始化好的数据库对象登记为当前进程db_dir对应的上下文
+    @param db_dir:
+    @param context: DataBaseV3
+    @return:
+    """
+    with _contexts_lock:
+        _contexts[db_dir] = (os.getpid(), context)
+
+
+def unregister_context(db_dir, context):
+    """
+    数据库关闭时取消登记，只移除当前进程登记的这个对象
+    @param db_dir:
+    @param context: DataBaseV3
+    @return:
+    """
+    with _contexts_lock:
+        item = _contexts.get(db_dir)
+        if item and item[0] == os.getpid() and item[1] is context:
+            del _contexts[db_dir]
+
+
+def get_context(db_dir):
+    """
+    获取当前进程db_dir对应的数据库上下文，每个进程只初始化一次
+    fork出来的子进程不能复用父进程的sqlite连接，通过pid判断后重新打开
+    @param db_dir:
+    @return: DataBaseV3
+    """
+    item = _contexts.get(db_dir)
+    if item and item[0] == os.getpid():
+        return item[1]
+    with _contexts_lock:
+        item = _contexts.get(db_dir)
+        if item and item[0] == os.getpid():
+            return item[1]
+        context = DataBaseV3()
+        context.init_database(db_dir)
+        _contexts[db_dir] = (os.getpid(), context)
+        return context
+
+
+def init_worker(db_dir):
+    """
+    ProcessPoolExecutor的initializer，每个工作进程启动时打开一次数据库
+    @param db_dir:
+    @return:
+    """
+    get_context(db_dir)
+
+
+# 解析消息时每批预取引用消息的条数
+PREFETCH_BATCH_SIZE = 1000
+
+
+def parser_messages(messages, username, db_dir='', cost_stats=None):
+    """
+    @param messages: 数据库中查出的原始数据
+    @param username:
+    @param db_dir:
+    @param cost_stats: 传入字典时按(Type, SubType)累加解析的条数和耗时 {(Type, SubType): [条数, 总耗时秒]}
+    @return: Iterator[Message]
+    """
+    context = get_context(db_dir)
     if username.endswith('@chatroom'):
         contacts = context.get_chatroom_members(username)
     else:
@@ -153,30 +225,72 @@ def parser_messages(messages, username, db_dir=''):
         }
     # FACTORY_REGISTRY[-1].set_contacts(contacts)
     Singleton.set_contacts(contacts)
-    for message in messages:
-        type_ = message[2]
-        sub_type = parser_sub_type(message[7]) if username.endswith('@openim') else message[3]
-        msg_type = type_name_dict.get((type_, sub_type))
+    messages = iter(messages)
+    while batch := list(itertools.islice(messages, PREFETCH_BATCH_SIZE)):
+        # 先批量取出这一批消息引用的消息，避免解析引用消息时逐条查库
+        Singleton.prefetch_quote_messages(batch, username, context, batch=True)
+        yield from create_messages(batch, username, context, cost_stats)
+
+
+def create_messages(batch, username, context, cost_stats=None) -> list:
+    """
+    一批消息按(Type, SubType)分组，每组交给对应工厂的create_batch一起解析，再按原来的顺序（CreateTime）放回
+    引用消息最后解析，被引用的同一批消息这时都已经解析好了
+    @param batch: 数据库中查出的原始数据
+    @param username:
+    @param context:
+    @param cost_stats: 传入字典时按(Type, SubType)累加解析的条数和耗时
+    @return: List[Message]，和batch一一对应
+    """
+    is_openim = username.endswith('@openim')
+    groups = {}
+    for i, message in enumerate(batch):
+        sub_type = parser_sub_type(message[7]) if is_openim else message[3]
+        msg_type = type_name_dict.get((message[2], sub_type))
         if msg_type not in FACTORY_REGISTRY:
             msg_type = -1
-        yield FACTORY_REGISTRY[msg_type].create(message, username, context)
+        groups.setdefault((msg_type, (message[2], message[3])), []).append(i)
+    results = [None] * len(batch)
+    outer = Singleton.start_batch()
+    try:
+        for key in sorted(groups, key=lambda key: key[0] == MessageType.Quote):
+            indexes = groups[key]
+            msg_type, type_key = key
+            rows = [batch[i] for i in indexes]
+            if cost_stats is None:
+                messages = FACTORY_REGISTRY[msg_type].create_batch(rows, username, context)
+            else:
+                messages = timed_create_batch(FACTORY_REGISTRY[msg_type], rows, username, context, type_key,
+                                              cost_stats)
+            for i, message in zip(indexes, messages):
+                results[i] = message
+    finally:
+        Singleton.finish_batch(results, outer)
+    return results
+
 
+def split_list(lst, n):
+    k, m = divmod(len(lst), n)
+    return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
 
-def _process_messages_batch(messages_batch, username, db_dir) -> List:
+
+def _process_messages_batch(messages_batch, username, db_dir) -> Tuple[List, dict]:
     """Helper function to process a batch of messages."""
     processed = []
-    for message in parser_messages(messages_batch, username, db_dir):
+    cost_stats = {}
+    for message in parser_messages(messages_batch, username, db_dir, cost_stats):
         processed.append(message)
-    return processed
+    return processed, cost_stats
 
 
 class DataBaseV3(DataBaseInterface):
     # todo 把上面这一堆数据库功能整合到这一个class里，对外只暴漏一个接口
-    def __init__(self):
-        super().__init__()
+    worker_initializer = staticmethod(init_worker)
+    parse_cost_priors = {(1, 0): 15e-6, (3, 0): 30e-6, (10000, 0): 30e-6}
+
+    def __init__(self, worker_num=None, parallel=None, parse_batch_size=None):
+        super().__init__(worker_num, parallel, parse_batch_size)
         self.db_dir = None
-        self.chatroom_members_map = {}
-        self.contacts_map = {}
 
         self.misc_db = Misc('Misc.db')
         self.msg_db = Msg('Multi/MSG0.db', is_series=True)
@@ -212,6 +326,7 @@ class DataBaseV3(DataBaseInterface):
         flag &= self.audio2text_db.init_database(db_dir)
         if flag:
             self.audio2text_db.create()  # 初始化语音转文字数据库
+            register_context(db_dir, self)  # 解析消息时直接复用当前连接
         return flag
         # self.sns_db.init_database(db_dir)
 
@@ -220,6 +335,8 @@ class DataBaseV3(DataBaseInterface):
         # self.favorite_db.init_database(db_dir)
 
     def close(self):
+        unregister_context(self.db_dir, self)
+        self.shutdown_process_pool()
         self.misc_db.close()
         self.msg_db.close()
         self.public_msg_db.close()
@@ -245,8 +362,10 @@ class DataBaseV3(DataBaseInterface):
             self,
             username_: str,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            lazy=False
     ):
-        # todo 改成yield进行操作，多进程处理加快速度
+        # 需要逐条处理的场景请使用iter_messages
+        # 3.x的消息内容没有压缩，lazy参数仅为了和4.0接口一致，总是完整解析
         import time
         st = time.time()
         logger.info(f'开始获取聊天记录：{st}')
@@ -267,16 +386,10 @@ class DataBaseV3(DataBaseInterface):
         # logger.error(f'获取聊天记录耗时：{et - st:.2f}s/{len(result)}条消息')
         # return result
 
-        res = []
-
         # for messages in self.message_db.get_messages_by_username(username_, time_range):
         #     for message in self.parser_messages(messages, username_):
         #         res.append(message)
 
-        def split_list(lst, n):
-            k, m = divmod(len(lst), n)
-            return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
-
         # # # Step 1: Retrieve raw message batches
         if username_.startswith('gh_'):
             messages = self.public_msg_db.get_messages_by_username(username_, time_range)
@@ -285,34 +398,71 @@ class DataBaseV3(DataBaseInterface):
         else:
             messages = self.msg_db.get_messages_by_username(username_, time_range)
 
-        if len(messages) < 20000:
-            for message in parser_messages(messages, username_, self.db_dir):
-                res.append(message)
-        else:
-            raw_message_batches = split_list(messages, len(messages) // 10000 + 1)
-            #
-            # # Step 2: Use multiprocessing to process the message batches
-            # res = []
-            # for batch in raw_message_batches:
-            #     print(len(batch))
-
-            with ProcessPoolExecutor(max_workers=min(len(raw_message_batches), 16)) as executor:
-                # Submit tasks
-                future_to_batch = {
-                    executor.submit(_process_messages_batch, batch, username_, self.db_dir): batch
-                    for batch in raw_message_batches
-                }
-
-                # Collect results
-                for future in future_to_batch.keys():
-                    res.extend(future.result())
+        res = self._parse_messages(messages, username_)
 
         et = time.time()
         logger.info(f'获取聊天记录完成：{et}')
         logger.info(f'获取聊天记录耗时：{et - st:.2f}s/{len(res)}条消息')
-        res.sort()
         return res
 
+    def iter_messages(
+            self,
+            username_: str,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+            lazy=False,
+            start_sort_seq=None
+    ):
+        """
+        流式获取聊天记录，按时间顺序逐条返回解析好的消息
+        @param username_:
+        @param time_range:
+        @param batch_size: 每个分库一次从数据库读取的行数
+        @param lazy: 3.x忽略，总是完整解析
+        @param start_sort_seq: 只返回sort_seq（3.x中为CreateTime）大于等于它的消息
+        @return: Iterator[Message]
+        """
+        if username_.startswith('gh_'):
+            messages = self.public_msg_db.get_messages_by_username(username_, time_range)
+        elif username_.endswith('@openim'):
+            messages = self.open_msg_db.get_messages_by_username(username_, time_range)
+        else:
+            messages = self.msg_db.iter_messages_by_username(username_, time_range, batch_size, start_sort_seq)
+        if username_.startswith('gh_') or username_.endswith('@openim'):
+            # CreateTime只精确到秒，包含和start_sort_seq同一秒的消息，由调用方按server_id去掉已经处理过的
+            messages = sorted(messages, key=cursor_key)
+            if start_sort_seq is not None:
+                messages = [row for row in messages if row[5] >= start_sort_seq]
+        yield from parser_messages(messages, username_, self.db_dir)
+
+    def get_message_frame(
+            self,
+            username_: str,
+            type_: MessageType = None,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> MessageFrame:
+        if username_.startswith('gh_') or username_.endswith('@openim'):
+            # 公众号和OpenIM的消息库很小，直接解析消息再转换
+            if type_ is None:
+                messages = self.get_messages(username_, time_range)
+            else:
+                messages = self.get_messages_by_type(username_, type_, time_range)
+            return MessageFrame.from_messages(messages, username_)
+        frame = MessageFrame.from_shards(username_, self.msg_db.get_frame_rows(username_, type_, time_range), Me().wxid)
+        frame.display_names = [self.get_contact_by_username(wxid).remark if wxid else '' for wxid in frame.senders]
+        return frame
+
+    def _get_messages_by_cursor(self, username, message_cursor: MessageCursor, msg_num, time_range=None):
+        if username.startswith('gh') or username.endswith('@openim'):
+            # 公众号和OpenIM只有一个数据库，直接按一个分库处理
+            db = self.public_msg_db if username.startswith('gh') else self.open_msg_db
+            mark = message_cursor.marks(1)[0]
+            iterator = None
+            if mark is not None:
+                iterator = itertools.chain.from_iterable(db.get_messages_by_num(username, mark, msg_num, time_range))
+            return message_cursor.next_page([iterator], msg_num, key=cursor_key)
+        return self.msg_db.get_messages_by_cursor(username, message_cursor, msg_num, time_range)
+
     def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -321,20 +471,24 @@ class DataBaseV3(DataBaseInterface):
         @param msg_num:
         @return: messages, 最后一条消息的start_sort_seq
         """
-        if username.startswith('gh'):
-            messages = self.public_msg_db.get_messages_by_num(username, start_sort_seq, msg_num)
-        elif username.endswith('@openim'):
-            messages = self.open_msg_db.get_messages_by_num(username, start_sort_seq, msg_num)
-        else:
-            messages = self.msg_db.get_messages_by_num(username, start_sort_seq, msg_num)
-        result = []
-        for messages_ in messages:
-            for message in parser_messages(messages_, username, self.db_dir):
-                result.append(message)
-        result.sort(reverse=True)
-        res = result[:msg_num]
+        rows, _ = self._get_messages_by_cursor(username, MessageCursor(start_sort_seq), msg_num)
+        res = list(parser_messages(rows, username, self.db_dir))
         return res, res[-1].sort_seq if res else 0
 
+    def get_messages_by_cursor(self, username, cursor: str = None, msg_num=20, time_range=None):
+        """
+        键集分页获取聊天记录，从新到旧翻页，只解析本页返回的消息
+        @param username:
+        @param cursor: 上一页返回的游标，None表示从最新的消息开始
+        @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息，翻页时每一页都要传同样的值
+        @return: messages, 下一页的游标（没有更早的消息时为None）
+        """
+        rows, next_cursor = self._get_messages_by_cursor(username, MessageCursor.from_token(cursor), msg_num,
+                                                         time_range)
+        res = list(parser_messages(rows, username, self.db_dir))
+        return res, None if next_cursor.exhausted else next_cursor.to_token()
+
     def get_message_by_server_id(self, username, server_id):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -348,6 +502,16 @@ class DataBaseV3(DataBaseInterface):
             return next(messages_iter)
         return None
 
+    def get_messages_by_server_ids(self, username, server_ids) -> dict:
+        """
+        批量按server_id获取消息，每个分库只查询一次
+        @param username:
+        @param server_ids:
+        @return: {server_id: Message}
+        """
+        messages = self.msg_db.get_messages_by_server_ids(username, server_ids)
+        return {message.server_id: message for message in parser_messages(messages, username, self.db_dir)}
+
     def get_messages_all(self, time_range=None):
         return self.msg_db.get_messages_all(time_range)
 
@@ -360,11 +524,6 @@ class DataBaseV3(DataBaseInterface):
             type_: MessageType,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
     ):
-        def split_list(lst, n):
-            k, m = divmod(len(lst), n)
-            return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
-
-        res = []
         # # # Step 1: Retrieve raw message batches
         if username_.startswith('gh_'):
             messages = self.public_msg_db.get_messages_by_type(username_, type_, time_range)
@@ -373,25 +532,47 @@ class DataBaseV3(DataBaseInterface):
         else:
             messages = self.msg_db.get_messages_by_type(username_, type_, time_range)
 
-        if len(messages) < 20000:
-            for message in parser_messages(messages, username_, self.db_dir):
-                res.append(message)
+        return self._parse_messages(messages, username_)
+
+    def _parse_messages(self, messages, username_) -> list:
+        """
+        解析数据库中查出的聊天记录，按消息的类型分布估算耗时，值得并行时分批交给常驻进程池
+        @param messages: 原始数据
+        @param username_:
+        @return: 按sort_seq排序的消息
+        """
+        type_counts = {}
+        for message in messages:
+            key = (message[2], message[3])
+            type_counts[key] = type_counts.get(key, 0) + 1
+        plan = self.plan_parse(type_counts, username_)
+        res = []
+        if not plan.parallel:
+            cost_stats = {}
+            res.extend(parser_messages(messages, username_, self.db_dir, cost_stats))
+            self.parse_planner.record(cost_stats)
         else:
-            raw_message_batches = split_list(messages, len(messages) // 10000 + 1)
-            with ProcessPoolExecutor(max_workers=min(len(raw_message_batches), 16)) as executor:
-                # Submit tasks
-                future_to_batch = {
-                    executor.submit(_process_messages_batch, batch, username_, self.db_dir): batch
-                    for batch in raw_message_batches
-                }
-                # Collect results
-                for future in future_to_batch.keys():
-                    res.extend(future.result())
+            raw_message_batches = split_list(messages, plan.batch_num)
+            # Submit tasks
+            futures = [
+                self.process_pool.submit(_process_messages_batch, batch, username_, self.db_dir)
+                for batch in raw_message_batches
+            ]
+            # Collect results
+            for future in futures:
+                processed, cost_stats = future.result()
+                res.extend(processed)
+                self.parse_planner.record(cost_stats)
         res.sort()
         return res
 
     def get_emoji_url(self, md5: str, thumb: bool = False) -> str | bytes:
-        return self.emotion_db.get_emoji_URL(md5, thumb)
+        key = (md5, thumb)
+        url = self.emoji_urls.get(key)
+        if url is None:
+            url = self.emotion_db.get_emoji_URL(md5, thumb)
+            self.emoji_urls[key] = url
+        return url
 
     def get_emoji_path(self, md5: str, output_path, thumb: bool = False, ) -> str:
         """
@@ -682,7 +863,8 @@ class DataBaseV3(DataBaseInterface):
 
         def merge_task(db_instance, db_path):
             """执行单个数据库的合并任务"""
-            db_instance.merge(db_path)
+            with db_instance.writable():
+                db_instance.merge(db_path)
 
         # 使用 ThreadPoolExecutor 进行多线程合并
         with concurrent.futures.ThreadPoolExecutor() as executor:
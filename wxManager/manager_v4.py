@@ -9,15 +9,16 @@
 @Description : 
 """
 import concurrent
+import heapq
+import itertools
 import os
 import re
+import threading
 from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
 from datetime import date, datetime
 from multiprocessing import Pool, cpu_count
 from typing import Tuple, List, Any
 
-import zstandard as zstd
-
 from wxManager import MessageType
 from wxManager.db_v4.audio2text import Audio2TextDB
 from wxManager.db_v4.biz_message import BizMessageDB
@@ -26,54 +27,243 @@ from wxManager.db_v4.media import MediaDB
 from wxManager.db_v4 import ContactDB, HeadImageDB, SessionDB, MessageDB, HardLinkDB
 from wxManager.db_main import DataBaseInterface, Context
 from wxManager.model.contact import Contact, ContactType, Person
-from wxManager.model import Me
+from wxManager.model import Me, MessageCursor, MessageColumns, MessageFrame
 from wxManager.parser.util.protocbuf.roomdata_pb2 import ChatRoomData
-from wxManager.parser.wechat_v4 import FACTORY_REGISTRY, Singleton
+from wxManager.parser.wechat_v4 import FACTORY_REGISTRY, Singleton, create_lazy_messages
+from wxManager.parser.util.zstd_util import decompress_bytes, decompress_many, prefetched, load_dictionaries
+from wxManager.planner import timed_create_batch
 from wxManager.log import logger
-from wxManager.parser.util.protocbuf import contact_pb2
-from google.protobuf.json_format import MessageToDict
+from wxManager.parser.util.proto_util import parse_contact_info
 
 
 def decompress(data):
-    dctx = zstd.ZstdDecompressor()  # 创建解压对象
-    x = dctx.decompress(data)
-    return x.decode('utf-8')
-
-
-def parser_messages(messages, username, db_dir=''):
-    context = DataBaseV4()
-    context.init_database(db_dir)
-    if username.endswith('@chatroom'):
-        contacts = context.get_chatroom_members(username)
-    else:
-        contacts = {
-            Me().wxid: context.get_contact_by_username(Me().wxid),
-            username: context.get_contact_by_username(username)
-        }
+    return decompress_bytes(data).decode('utf-8')
+
+
+def year_time_range(year_, time_range=None):
+    """
+    只统计某一年时换成这一年的时间范围
+    @param year_: 'all'表示不限制
+    @param time_range:
+    @return:
+    """
+    if year_ == 'all' or year_ is None:
+        return time_range
+    year_ = int(year_)
+    return datetime(year_, 1, 1), datetime(year_ + 1, 1, 1)
+
+
+# 进程内共享的数据库上下文，key为db_dir，value为(创建进程的pid, DataBaseV4)
+_contexts = {}
+_contexts_lock = threading.RLock()
+
+
+def register_context(db_dir, context):
+    """
+    把已经初始化好的数据库对象登记为当前进程db_dir对应的上下文
+    @param db_dir:
+    @param context: DataBaseV4
+    @return:
+    """
+    with _contexts_lock:
+        _contexts[db_dir] = (os.getpid(), context)
+
+
+def unregister_context(db_dir, context):
+    """
+    数据库关闭时取消登记，只移除当前进程登记的这个对象
+    @param db_dir:
+    @param context: DataBaseV4
+    @return:
+    """
+    with _contexts_lock:
+        item = _contexts.get(db_dir)
+        if item and item[0] == os.getpid() and item[1] is context:
+            del _contexts[db_dir]
+
+
+def get_context(db_dir):
+    """
+    获取当前进程db_dir对应的数据库上下文，每个进程只初始化一次
+    fork出来的子进程不能复用父进程的sqlite连接，通过pid判断后重新打开
+    @param db_dir:
+    @return: DataBaseV4
+    """
+    item = _contexts.get(db_dir)
+    if item and item[0] == os.getpid():
+        return item[1]
+    with _contexts_lock:
+        item = _contexts.get(db_dir)
+        if item and item[0] == os.getpid():
+            return item[1]
+        context = DataBaseV4()
+        context.init_database(db_dir)
+        _contexts[db_dir] = (os.getpid(), context)
+        return context
+
+
+def init_worker(db_dir):
+    """
+    ProcessPoolExecutor的initializer，每个工作进程启动时打开一次数据库
+    @param db_dir:
+    @return:
+    """
+    get_context(db_dir)
+
+
+# 解析消息时每批预取引用消息的条数
+PREFETCH_BATCH_SIZE = 1000
+
+
+def parser_messages(messages, username, db_dir='', cost_stats=None, lazy=False):
+    """
+    @param messages: 数据库中查出的原始数据
+    @param username:
+    @param db_dir:
+    @param cost_stats: 传入字典时按local_type累加解析的条数和耗时 {local_type: [条数, 总耗时秒]}
+    @param lazy: 为True时返回只有元数据的LazyMessage，消息内容在第一次访问时才解压解析
+    @return: Iterator[Message]
+    """
+    context = get_context(db_dir)
     # FACTORY_REGISTRY[-1].set_contacts(contacts) # 不知道为什么用对象修改类属性每个实例对象的contacts不一样
-    Singleton.set_contacts(contacts)
-
-    for message in messages:
-        type_ = message[2]
-        if type_ not in FACTORY_REGISTRY:
-            type_ = -1
-        yield FACTORY_REGISTRY[type_].create(message, username, context)
+    Singleton.set_contacts(conversation_contacts(context, username))
 
+    if lazy:
+        # 不批量解压也不预取引用消息，访问到内容的消息再逐条解析
+        yield from create_lazy_messages(messages, username, context)
+        return
 
-def _process_messages_batch(messages_batch, username, db_dir) -> List:
-    """Helper function to process a batch of messages."""
-    processed = []
-    for message in parser_messages(messages_batch, username, db_dir):
-        processed.append(message)
-    return processed
+    messages = iter(messages)
+    while batch := list(itertools.islice(messages, PREFETCH_BATCH_SIZE)):
+        # 整批解压消息内容，预取引用消息和解析时都直接使用解压结果，解析完这一批就释放
+        with prefetched(decompress_many(message[12] for message in batch if isinstance(message[12], bytes))):
+            # 先批量取出这一批消息引用的消息，避免解析引用消息时逐条查库
+            Singleton.prefetch_quote_messages(batch, username, context, batch=True)
+            results = create_messages(batch, username, context, cost_stats)
+        yield from results
+
+
+def conversation_contacts(context, username) -> dict:
+    """
+    解析一个会话的消息时用到的联系人
+    @param context:
+    @param username:
+    @return: 群聊返回群成员（带群昵称），私聊返回自己和对方 {wxid: Person}
+    """
+    if username.endswith('@chatroom'):
+        return context.get_chatroom_members(username)
+    return {
+        Me().wxid: context.get_contact_by_username(Me().wxid),
+        username: context.get_contact_by_username(username)
+    }
+
+
+def parser_merged_messages(items, db_dir='', lazy=False):
+    """
+    解析多个会话按sort_seq交错在一起的消息
+    交错的消息中连续属于同一个会话的往往只有几条，按会话分段解析每段都要重新查联系人、解压、预取引用消息，
+    这里按PREFETCH_BATCH_SIZE条一个窗口整体解压，窗口内再按会话分组预取引用消息和解析，每个会话的联系人整个遍历只查一次
+    @param items: Iterator[(username, 数据库中查出的原始数据)]
+    @param db_dir:
+    @param lazy: 为True时返回LazyMessage
+    @return: Iterator[(username, Message)]，和items的顺序一致
+    """
+    context = get_context(db_dir)
+    contacts_cache = {}
+    items = iter(items)
+    while window := list(itertools.islice(items, PREFETCH_BATCH_SIZE)):
+        groups = {}
+        for i, (username, _) in enumerate(window):
+            groups.setdefault(username, []).append(i)
+        results = [None] * len(window)
+        blobs = () if lazy else (row[12] for _, row in window if isinstance(row[12], bytes))
+        with prefetched(decompress_many(blobs)):
+            for username, indexes in groups.items():
+                contacts = contacts_cache.get(username)
+                if contacts is None:
+                    contacts = contacts_cache[username] = conversation_contacts(context, username)
+                # 群昵称按会话不同，解析每个会话前都要换成这个会话的联系人
+                Singleton.set_contacts(contacts)
+                batch = [window[i][1] for i in indexes]
+                if lazy:
+                    messages = create_lazy_messages(batch, username, context)
+                else:
+                    Singleton.prefetch_quote_messages(batch, username, context, batch=True)
+                    messages = create_messages(batch, username, context)
+                for i, message in zip(indexes, messages):
+                    results[i] = message
+        for (username, _), message in zip(window, results):
+            yield username, message
+
+
+def create_messages(batch, username, context, cost_stats=None) -> list:
+    """
+    一批消息按local_type分组，每组交给对应工厂的create_batch一起解析，再按原来的顺序（sort_seq）放回
+    引用消息最后解析，被引用的同一批消息这时都已经解析好了
+    @param batch: 数据库中查出的原始数据
+    @param username:
+    @param context:
+    @param cost_stats: 传入字典时按local_type累加解析的条数和耗时
+    @return: List[Message]，和batch一一对应
+    """
+    groups = {}
+    for i, message in enumerate(batch):
+        groups.setdefault(message[2], []).append(i)
+    results = [None] * len(batch)
+    outer = Singleton.start_batch()
+    try:
+        for type_ in sorted(groups, key=lambda type_: type_ == MessageType.Quote):
+            indexes = groups[type_]
+            factory = FACTORY_REGISTRY.get(type_, FACTORY_REGISTRY[-1])
+            rows = [batch[i] for i in indexes]
+            if cost_stats is None:
+                messages = factory.create_batch(rows, username, context)
+            else:
+                messages = timed_create_batch(factory, rows, username, context, type_, cost_stats)
+            for i, message in zip(indexes, messages):
+                results[i] = message
+    finally:
+        Singleton.finish_batch(results, outer)
+    return results
+
+
+def split_work_units(sort_seqs: dict, batch_num) -> List[Tuple[int, int, int | None]]:
+    """
+    把每个分库的消息按sort_seq切成连续的区间，子进程按区间自己去分库里读取消息，不需要主进程传输原始数据
+    @param sort_seqs: {分库下标: 升序的sort_seq}
+    @param batch_num: 期望的任务数
+    @return: [(分库下标, 起始sort_seq, 结束sort_seq)]，区间左闭右开，结束为None表示不限制
+    """
+    total = sum(len(seqs) for seqs in sort_seqs.values())
+    batch_size = max(-(-total // max(batch_num, 1)), 1)
+    work_units = []
+    for index, seqs in sort_seqs.items():
+        for i in range(0, len(seqs), batch_size):
+            end = seqs[i + batch_size] if i + batch_size < len(seqs) else None
+            if seqs[i] != end:
+                work_units.append((index, seqs[i], end))
+    return work_units
+
+
+def _parse_work_unit(username, index, start_sort_seq, end_sort_seq, type_, time_range, db_dir) \
+        -> Tuple[MessageColumns, dict]:
+    """
+    在子进程中读取并解析一个分库区间内的消息，结果以列式返回，主进程迭代时才创建Message
+    @return: 解析结果, 各类型的解析耗时
+    """
+    context = get_context(db_dir)
+    message_db = context.biz_message_db if username.startswith('gh_') else context.message_db
+    messages = message_db.get_messages_by_seq_range(username, index, start_sort_seq, end_sort_seq, type_, time_range)
+    cost_stats = {}
+    return MessageColumns.from_messages(parser_messages(messages, username, db_dir, cost_stats)), cost_stats
 
 
 class DataBaseV4(DataBaseInterface):
-    def __init__(self):
-        super().__init__()
-        self.db_dir = ''
-        self.chatroom_members_map = {}
-        self.contacts_map = {}
+    worker_initializer = staticmethod(init_worker)
+    parse_cost_priors = {MessageType.Text: 15e-6, MessageType.Image: 30e-6, MessageType.System: 30e-6}
+
+    def __init__(self, worker_num=None, parallel=None, parse_batch_size=None):
+        super().__init__(worker_num, parallel, parse_batch_size)
 
         # V4
         self.contact_db = ContactDB('contact/contact.db')
@@ -90,6 +280,7 @@ class DataBaseV4(DataBaseInterface):
         Me().load_from_json(os.path.join(db_dir, 'info.json'))  # 加载自己的信息
         # print('初始化数据库', db_dir)
         self.db_dir = db_dir
+        load_dictionaries(db_dir)  # 快照中带有训练好的zstd字典时加载
         flag = True
         flag &= self.contact_db.init_database(db_dir)
         flag &= self.head_image_db.init_database(db_dir)
@@ -102,10 +293,12 @@ class DataBaseV4(DataBaseInterface):
         flag &= self.audio2text_db.init_database(db_dir)
         if flag:
             self.audio2text_db.create()  # 初始化语音转文字数据库
+            register_context(db_dir, self)  # 解析消息时直接复用当前连接
         return flag
 
     def close(self):
-        pass
+        unregister_context(self.db_dir, self)
+        self.shutdown_process_pool()
 
         # self.head_image_db.close()
         # self.contact_db.close()
@@ -121,58 +314,90 @@ class DataBaseV4(DataBaseInterface):
             self,
             username_: str,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            lazy=False
     ):
-        # todo 改成yield进行操作，多进程处理加快速度
+        # 需要逐条处理的场景请使用iter_messages
         import time
         st = time.time()
         logger.info(f'开始获取聊天记录：{st}')
-        res = []
-
-        # messages = self.message_db.get_messages_by_username(username_, time_range)*20
-        # # for messages in self.message_db.get_messages_by_username(username_, time_range):
-        # for messages_ in messages:
-        #     for message in parser_messages(messages_, username_, self.db_dir):
-        #         res.append(message)
-
-        def split_list(lst, n):
-            k, m = divmod(len(lst), n)
-            return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
-
-        #
-        # # # Step 1: Retrieve raw message batches
-        if username_.startswith('gh_'):
-            messages = self.biz_message_db.get_messages_by_username(username_, time_range)
-        else:
-            messages = self.message_db.get_messages_by_username(username_, time_range)
-
-        if len(messages) < 20000:
-            for message in parser_messages(messages, username_, self.db_dir):
-                res.append(message)
-        else:
-            raw_message_batches = split_list(messages, len(messages) // 10000 + 1)
-            #
-            # # Step 2: Use multiprocessing to process the message batches
-            # res = []
-            # for batch in raw_message_batches:
-            #     print(len(batch))
-
-            with ProcessPoolExecutor(max_workers=min(len(raw_message_batches), 16)) as executor:
-                # Submit tasks
-                future_to_batch = {
-                    executor.submit(_process_messages_batch, batch, username_, self.db_dir): batch
-                    for batch in raw_message_batches
-                }
-
-                # Collect results
-                for future in future_to_batch.keys():
-                    res.extend(future.result())
-
+        res = self._parse_messages(username_, None, time_range, lazy)
         et = time.time()
         logger.info(f'获取聊天记录完成：{et}')
         logger.info(f'获取聊天记录耗时：{et - st:.2f}s/{len(res)}条消息 {username_}')
+        return res
+
+    def _parse_messages(self, username_, type_: MessageType = None, time_range=None, lazy=False) -> list:
+        """
+        读取并解析聊天记录，按消息的类型分布估算耗时，值得并行时按分库的sort_seq区间分给子进程，子进程自己读取数据库并解析
+        @param username_:
+        @param type_: None表示所有类型
+        @param time_range:
+        @param lazy: 延迟解析，只填充元数据，总是在当前进程中完成
+        @return: 按sort_seq排序的消息
+        """
+        message_db = self.biz_message_db if username_.startswith('gh_') else self.message_db
+        if lazy:
+            plan = None
+        else:
+            plan = self.plan_parse(message_db.get_type_counts(username_, type_, time_range), username_)
+        res = []
+        cost_stats = {}
+        if plan is None or not plan.parallel:
+            if type_ is None:
+                messages = message_db.get_messages_by_username(username_, time_range)
+            else:
+                messages = message_db.get_messages_by_type(username_, type_, time_range)
+            res.extend(parser_messages(messages, username_, self.db_dir, None if lazy else cost_stats, lazy))
+            self.parse_planner.record(cost_stats)
+        else:
+            sort_seqs = message_db.get_sort_seqs(username_, type_, time_range)
+            work_units = split_work_units(sort_seqs, plan.batch_num)
+            futures = [
+                self.process_pool.submit(_parse_work_unit, username_, index, start_sort_seq, end_sort_seq, type_,
+                                         time_range, self.db_dir)
+                for index, start_sort_seq, end_sort_seq in work_units
+            ]
+            for future in futures:
+                columns, stats = future.result()
+                res.extend(columns)
+                self.parse_planner.record(stats)
         res.sort()
         return res
 
+    def iter_messages(
+            self,
+            username_: str,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+            lazy=False,
+            start_sort_seq=None
+    ):
+        """
+        流式获取聊天记录，按sort_seq顺序逐条返回解析好的消息
+        @param username_:
+        @param time_range:
+        @param batch_size: 每个分库一次从数据库读取的行数
+        @param lazy: 为True时返回LazyMessage，消息内容在第一次访问时才解压解析
+        @param start_sort_seq: 只返回sort_seq大于等于它的消息
+        @return: Iterator[Message]
+        """
+        if username_.startswith('gh_'):
+            messages = self.biz_message_db.iter_messages_by_username(username_, time_range, batch_size, start_sort_seq)
+        else:
+            messages = self.message_db.iter_messages_by_username(username_, time_range, batch_size, start_sort_seq)
+        yield from parser_messages(messages, username_, self.db_dir, lazy=lazy)
+
+    def get_message_frame(
+            self,
+            username_: str,
+            type_: MessageType = None,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> MessageFrame:
+        message_db = self.biz_message_db if username_.startswith('gh_') else self.message_db
+        frame = MessageFrame.from_shards(username_, message_db.get_frame_rows(username_, type_, time_range), Me().wxid)
+        frame.display_names = [self.get_contact_by_username(wxid).remark if wxid else '' for wxid in frame.senders]
+        return frame
+
     def get_messages_by_num(self, username, start_sort_seq, msg_num=20):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -181,18 +406,28 @@ class DataBaseV4(DataBaseInterface):
         @param msg_num:
         @return: messages, 最后一条消息的start_sort_seq
         """
-        result = []
         if username.startswith('gh_'):
-            messages = self.biz_message_db.get_messages_by_num(username, start_sort_seq, msg_num)
+            rows, _ = self.biz_message_db.get_messages_by_cursor(username, MessageCursor(start_sort_seq), msg_num)
         else:
-            messages = self.message_db.get_messages_by_num(username, start_sort_seq, msg_num)
-        for messages in messages:
-            for message in parser_messages(messages, username, self.db_dir):
-                result.append(message)
-        result.sort(reverse=True)
-        res = result[:msg_num]
+            rows, _ = self.message_db.get_messages_by_cursor(username, MessageCursor(start_sort_seq), msg_num)
+        res = list(parser_messages(rows, username, self.db_dir))
         return res, res[-1].sort_seq if res else 0
 
+    def get_messages_by_cursor(self, username, cursor: str = None, msg_num=20, time_range=None):
+        """
+        键集分页获取聊天记录，从新到旧翻页，只解析本页返回的消息
+        @param username:
+        @param cursor: 上一页返回的游标，None表示从最新的消息开始
+        @param msg_num:
+        @param time_range: 只返回这个时间范围内的消息，翻页时每一页都要传同样的值
+        @return: messages, 下一页的游标（没有更早的消息时为None）
+        """
+        message_cursor = MessageCursor.from_token(cursor)
+        message_db = self.biz_message_db if username.startswith('gh_') else self.message_db
+        rows, next_cursor = message_db.get_messages_by_cursor(username, message_cursor, msg_num, time_range)
+        res = list(parser_messages(rows, username, self.db_dir))
+        return res, None if next_cursor.exhausted else next_cursor.to_token()
+
     def get_message_by_server_id(self, username, server_id):
         """
         获取小于start_sort_seq的msg_num个消息
@@ -206,39 +441,82 @@ class DataBaseV4(DataBaseInterface):
             return next(messages_iter)
         return None
 
+    def get_messages_by_server_ids(self, username, server_ids) -> dict:
+        """
+        批量按server_id获取消息，每个分库只查询一次
+        @param username:
+        @param server_ids:
+        @return: {server_id: Message}
+        """
+        if username.startswith('gh_'):
+            messages = self.biz_message_db.get_messages_by_server_ids(username, server_ids)
+        else:
+            messages = self.message_db.get_messages_by_server_ids(username, server_ids)
+        return {message.server_id: message for message in parser_messages(messages, username, self.db_dir)}
+
     def get_messages_by_type(
             self,
             username_,
             type_: MessageType,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
     ):
-        def split_list(lst, n):
-            k, m = divmod(len(lst), n)
-            return [lst[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n)]
+        return self._parse_messages(username_, type_, time_range)
 
-        res = []
-        # # # Step 1: Retrieve raw message batches
-        if username_.startswith('gh_'):
-            messages = self.biz_message_db.get_messages_by_type(username_, time_range)
-        else:
-            messages = self.message_db.get_messages_by_type(username_, type_, time_range)
+    def _contact_usernames(self):
+        return [row[0] for row in self.contact_db.get_contacts()]
 
-        if len(messages) < 20000:
-            for message in parser_messages(messages, username_, self.db_dir):
-                res.append(message)
-        else:
-            raw_message_batches = split_list(messages, len(messages) // 10000 + 1)
-            with ProcessPoolExecutor(max_workers=min(len(raw_message_batches), 16)) as executor:
-                # Submit tasks
-                future_to_batch = {
-                    executor.submit(_process_messages_batch, batch, username_, self.db_dir): batch
-                    for batch in raw_message_batches
-                }
-                # Collect results
-                for future in future_to_batch.keys():
-                    res.extend(future.result())
-        res.sort()
-        return res
+    def get_message_table_usernames(self) -> dict:
+        """
+        所有消息表对应的联系人，第一次匹配后保存在分库中
+        @return: {表名: username}
+        """
+        usernames = self._contact_usernames()
+        table_usernames = {}
+        for message_db in (self.message_db, self.biz_message_db):
+            table_usernames.update(message_db.get_table_usernames(usernames))
+        return table_usernames
+
+    def get_orphan_message_tables(self) -> dict:
+        """
+        找不到对应联系人的消息表
+        @return: {分库文件名: [表名]}
+        """
+        usernames = self._contact_usernames()
+        orphans = {}
+        for message_db in (self.message_db, self.biz_message_db):
+            for table_name, indexes in message_db.get_orphan_tables(usernames).items():
+                for index in indexes:
+                    orphans.setdefault(os.path.basename(message_db.db_paths[index]), []).append(table_name)
+        return orphans
+
+    def get_message_table_sizes(self) -> dict:
+        """
+        每个分库中各个会话的消息条数
+        @return: {分库文件名: [(表名, username, 消息条数)]}，找不到联系人的表username为None
+        """
+        usernames = self._contact_usernames()
+        report = {}
+        for message_db in (self.message_db, self.biz_message_db):
+            report.update(message_db.get_table_sizes(usernames))
+        return report
+
+    def get_messages_all(self, time_range=None, lazy=False):
+        """
+        流式获取所有会话的聊天记录，所有分库同时在各自的线程中读取，按sort_seq顺序返回
+        一次遍历整个账号，不需要对每个联系人分别调用get_messages
+        @param time_range:
+        @param lazy: 为True时返回LazyMessage
+        @return: Iterator[(username, Message)]
+        """
+        streams = []
+        for message_db in (self.message_db, self.biz_message_db):
+            table_usernames = message_db.get_table_usernames(self._contact_usernames())
+            unknown_num = len(message_db.table_index) - len(table_usernames)
+            if unknown_num:
+                logger.warning(f'{unknown_num}个消息表找不到对应的联系人，已跳过')
+            streams.append(message_db.iter_all_messages(table_usernames, time_range))
+        rows = heapq.merge(*streams, key=lambda item: item[1][3])
+        yield from parser_merged_messages(rows, self.db_dir, lazy=lazy)
 
     def get_messages_calendar(self, username_: str):
         if username_.startswith('gh_'):
@@ -254,8 +532,97 @@ class DataBaseV4(DataBaseInterface):
     ) -> list:
         return []
 
+    def _count_messages(self, username_=None, group_by=None, time_range=None) -> dict:
+        """
+        在数据库中分组统计消息条数，不解析消息
+        @param username_: None表示所有联系人
+        @param group_by: None、'hour'、'day'、'month'
+        @param time_range:
+        @return: {分组: [总条数, 自己发送的条数]}
+        """
+        if username_ is None:
+            message_dbs = [self.message_db, self.biz_message_db]
+        elif username_.startswith('gh_'):
+            message_dbs = [self.biz_message_db]
+        else:
+            message_dbs = [self.message_db]
+        counts = {}
+        for message_db in message_dbs:
+            for key, (total, sent) in message_db.count_messages(username_, group_by, Me().wxid, time_range).items():
+                item = counts.setdefault(key, [0, 0])
+                item[0] += total
+                item[1] += sent
+        return counts
+
+    def get_messages_by_days(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ):
+        """
+        @return: [('2024-12-01', 条数)]，按日期升序
+        """
+        counts = self._count_messages(username_, 'day', time_range)
+        return sorted((key, total) for key, (total, _) in counts.items())
+
+    def get_messages_by_month(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ):
+        """
+        @return: [('2024-12', 条数)]，按月份升序
+        """
+        counts = self._count_messages(username_, 'month', time_range)
+        return sorted((key, total) for key, (total, _) in counts.items())
+
+    def get_messages_by_hour(self, username_, time_range=None, year_='all'):
+        """
+        @param username_:
+        @param time_range:
+        @param year_: 只统计某一年，'all'表示不限制
+        @return: [('08:00', 条数)]，按小时升序
+        """
+        counts = self._count_messages(username_, 'hour', year_time_range(year_, time_range))
+        return sorted((key, total) for key, (total, _) in counts.items())
+
+    def get_messages_number(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        return self._count_messages(username_, None, time_range).get('', [0, 0])[0]
+
+    def get_send_messages_number(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        return self._count_messages(username_, None, time_range).get('', [0, 0])[1]
+
+    def get_send_messages_number_sum(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        return self._count_messages(None, None, time_range).get('', [0, 0])[1]
+
+    def get_send_messages_number_by_hour(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> list:
+        """
+        @return: [('08:00', 自己发送的条数)]，按小时升序
+        """
+        counts = self._count_messages(None, 'hour', time_range)
+        return sorted((key, sent) for key, (_, sent) in counts.items() if sent)
+
     def get_emoji_url(self, md5: str, thumb: bool = False) -> str | bytes:
-        return self.emotion_db.get_emoji_url(md5, thumb)
+        key = (md5, thumb)
+        url = self.emoji_urls.get(key)
+        if url is None:
+            url = self.emotion_db.get_emoji_url(md5, thumb)
+            self.emoji_urls[key] = url
+        return url
 
     # 图片、视频、文件
     def get_file(self, md5: bytes | str) -> str:
@@ -307,25 +674,18 @@ class DataBaseV4(DataBaseInterface):
         label_list = []
         region = ('', '', '')
         if not (wxid.endswith('@openim') or wxid.endswith('@chatroom')):
-            try:
-                # 创建顶级消息对象
-                message = contact_pb2.ContactInfo()
-                # 解析二进制数据
-                message.ParseFromString(contact_info_list[10])
-                # 转换为 JSON 格式
-                detail = MessageToDict(message)
-                gender_code = detail.get('gender', 0)
-                if gender_code == 1:
+            detail = parse_contact_info(contact_info_list[10])
+            if detail is not None:
+                if detail.gender == 1:
                     gender = '男'
-                elif gender_code == 2:
+                elif detail.gender == 2:
                     gender = '女'
-                label_list = detail.get('labelList', '').strip(',').split(',')
-                signature = detail.get('signature', '')
-                region = (detail.get('country', ''), detail.get('province', ''), detail.get('city', ''))
-                label_list = self.contact_db.get_labels(detail.get('labelList')).split(',')
-            except:
-                pass
-                # logger.error(f'{wxid} {contact_info_list[5]}联系人解析失败\n{contact_info_list[10]}')
+                signature = detail.signature
+                region = (detail.country, detail.province, detail.city)
+                try:
+                    label_list = self.contact_db.get_labels(detail.label_list).split(',')
+                except:
+                    label_list = detail.label_list.strip(',').split(',')
         contact = Contact(
             wxid=contact_info_list[0],
             remark=remark,
@@ -468,7 +828,8 @@ class DataBaseV4(DataBaseInterface):
 
         def merge_task(db_instance, db_path):
             """执行单个数据库的合并任务"""
-            db_instance.merge(db_path)
+            with db_instance.writable():
+                db_instance.merge(db_path)
 
         # 使用 ThreadPoolExecutor 进行多线程合并
         with concurrent.futures.ThreadPoolExecutor() as executor:
@@ -482,3 +843,40 @@ class DataBaseV4(DataBaseInterface):
                     print(f"成功合并数据库: {path}")
                 except Exception as e:
                     print(f"合并 {path} 失败: {e}")
+        # 合并后可能新增了消息表，更新消息表对应的联系人
+        self.get_message_table_usernames()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # 用法：python -m wxManager.manager_v4 <解密后的数据库文件夹> <wxid>
+    # 同一个会话的消息，对比逐条create和按类型分组create_batch的解析耗时
+    db_dir, wxid = sys.argv[1], sys.argv[2]
+    database = DataBaseV4(parallel=False)
+    database.init_database(db_dir)
+    context = get_context(db_dir)
+    rows = list(database.message_db.iter_messages_by_username(wxid))
+
+    def create_one_by_one():
+        # 分组批量解析之前的做法
+        results = []
+        for start in range(0, len(rows), PREFETCH_BATCH_SIZE):
+            batch = rows[start:start + PREFETCH_BATCH_SIZE]
+            with prefetched(decompress_many(message[12] for message in batch if isinstance(message[12], bytes))):
+                Singleton.prefetch_quote_messages(batch, wxid, context)
+                for message in batch:
+                    results.append(
+                        FACTORY_REGISTRY.get(message[2], FACTORY_REGISTRY[-1]).create(message, wxid, context))
+        return results
+
+    list(parser_messages(rows[:PREFETCH_BATCH_SIZE], wxid, db_dir))  # 预热联系人等缓存
+    for name, func in (('逐条create', create_one_by_one),
+                       ('分组create_batch', lambda: list(parser_messages(rows, wxid, db_dir)))):
+        Singleton.reset_messages()
+        Singleton.quoted_messages.clear()
+        st = time.perf_counter()
+        func()
+        print(f'{name}：{len(rows)}条消息 {time.perf_counter() - st:.2f}s')
+    database.close()
@@ -10,8 +10,10 @@
 """
 
 from .message import Message, MessageType, TextMessage, ImageMessage, FileMessage, VideoMessage, AudioMessage, \
-    EmojiMessage, QuoteMessage, MergedMessage, LinkMessage, PositionMessage
-from .db_model import DataBaseBase
+    EmojiMessage, QuoteMessage, MergedMessage, LinkMessage, PositionMessage, LazyMessage
+from .db_model import DataBaseBase, MessageCursor
+from .columns import MessageColumns
+from .frame import MessageFrame
 from .contact import Person, Contact, OpenIMContact, Me
 
 if __name__ == '__main__':
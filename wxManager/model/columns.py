@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/4 21:36
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-columns.py
+@Description : 按列存储的一批消息，子进程解析完以这种格式传回主进程，主进程用到时才还原成Message
+"""
+from array import array
+from collections.abc import Sequence
+from operator import itemgetter
+from typing import Iterable, Iterator, List
+
+from wxManager.model import message as message_module
+from wxManager.model.message import Message, field_names, message_values
+
+# Message基类的字段，顺序和dataclass定义一致，str_time由timestamp得到，只有_str_time需要保存
+FIELDS = field_names(Message)
+INT_FIELDS = ('local_id', 'server_id', 'sort_seq', 'timestamp', 'type', 'status')
+STR_FIELDS = ('talker_id', 'sender_id', 'display_name', 'avatar_src', 'xml_content', '_str_time')
+
+_get_fields = itemgetter(*FIELDS)
+
+
+def compact_array(values) -> array:
+    """按取值范围选择最小的整数类型，id、时间戳、类型等列通常用不满8字节"""
+    values = list(values)
+    low, high = (min(values), max(values)) if values else (0, 0)
+    for typecode in ('b', 'h', 'i', 'q'):
+        bits = array(typecode).itemsize * 8 - 1
+        if -(1 << bits) <= low and high < (1 << bits):
+            return array(typecode, values)
+    raise OverflowError(f'{low}~{high}超出64位整数范围')
+
+
+class MessageColumns(Sequence):
+    """
+    一批消息的列式表示
+    整数字段存成array，字符串字段存成字符串表的下标（同一个群里昵称、头像、talker_id大量重复，只存一次），
+    各个消息类型特有的字段按类型记录字段名，值按行存成tuple
+    pickle的体积和耗时都远小于同样数量的Message对象，下标访问或迭代时才创建Message
+    """
+
+    def __init__(self):
+        self.kinds = []  # [(类名, 特有字段名)]
+        self.kind = array('H')  # 每条消息在kinds中的下标
+        self.columns = {}  # 字段名 -> 整数列为array，字符串列为字符串表下标的array
+        self.strings = []  # 字符串表
+        self.extras = []  # 每条消息特有字段的值
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Message]) -> 'MessageColumns':
+        self = cls()
+        kind_index = {}
+        rows = []
+        for message in messages:
+            attrs = message_values(message)
+            key = (type(message), tuple(attrs))
+            kind = kind_index.get(key)
+            if kind is None:
+                extra_names = tuple(name for name in attrs if name not in FIELDS)
+                # dataclass按定义顺序赋值，基类字段总在最前面，可以直接按位置切分
+                in_order = key[1][:len(FIELDS)] == FIELDS
+                kind = kind_index[key] = (len(self.kinds), in_order, extra_names)
+                self.kinds.append((type(message).__name__, extra_names))
+            index, in_order, extra_names = kind
+            self.kind.append(index)
+            if in_order:
+                values = tuple(attrs.values())
+                rows.append(values[:len(FIELDS)])
+                self.extras.append(values[len(FIELDS):])
+            else:
+                rows.append(_get_fields(attrs))
+                self.extras.append(tuple(attrs[name] for name in extra_names))
+        values = list(zip(*rows)) or [()] * len(FIELDS)
+        string_index = {}
+        for name, column in zip(FIELDS, values):
+            if name in STR_FIELDS:
+                self.columns[name] = compact_array([string_index.setdefault(v, len(string_index)) for v in column])
+            elif name == 'is_sender':
+                self.columns[name] = array('b', [1 if v else 0 for v in column])
+            else:
+                try:
+                    self.columns[name] = compact_array(column)
+                except (TypeError, OverflowError):
+                    self.columns[name] = list(column)  # 出现None等非整数时原样保存
+        self.strings = list(string_index)
+        return self
+
+    def __len__(self):
+        return len(self.kind)
+
+    def _decoded_columns(self, start=0, stop=None):
+        strings = self.strings
+        columns = []
+        for name in FIELDS:
+            column = self.columns[name][start:stop]
+            if name in STR_FIELDS:
+                columns.append([strings[i] for i in column])
+            elif name == 'is_sender':
+                columns.append([v == 1 for v in column])
+            else:
+                columns.append(column.tolist() if isinstance(column, array) else column)
+        return columns
+
+    def _iter_range(self, start, stop) -> Iterator[Message]:
+        classes = [(getattr(message_module, class_name), extra_names) for class_name, extra_names in self.kinds]
+        rows = zip(self.kind[start:stop], self.extras[start:stop], *self._decoded_columns(start, stop))
+        for kind, extras, *values in rows:
+            message_class, extra_names = classes[kind]
+            message = message_class.__new__(message_class)
+            for name, value in zip(FIELDS, values):
+                setattr(message, name, value)
+            for name, value in zip(extra_names, extras):
+                setattr(message, name, value)
+            yield message
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return list(self._iter_range(start, stop))
+            return [self[j] for j in range(start, stop, step)]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return next(self._iter_range(i, i + 1))
+
+    def __iter__(self) -> Iterator[Message]:
+        return self._iter_range(0, len(self))
+
+    def sort_seqs(self) -> List[int]:
+        return list(self.columns['sort_seq'])
+
+
+if __name__ == '__main__':
+    import pickle
+    import time
+
+    from wxManager.model.message import TextMessage, MessageType
+
+    members = [(f'wxid_{i}', f'member{i}', f'https://wx.qlogo.cn/mmhead/{i}/0') for i in range(50)]
+    messages = [
+        TextMessage(local_id=i, server_id=1000000 + i, sort_seq=i, timestamp=1700000000 + i,
+                    str_time='2023-11-15 06:13:20', type=MessageType.Text, talker_id='123@chatroom',
+                    is_sender=False, sender_id=members[i % 50][0], display_name=members[i % 50][1],
+                    avatar_src=members[i % 50][2], status=2, xml_content='', content=f'message {i}')
+        for i in range(100000)
+    ]
+    st = time.perf_counter()
+    data = pickle.dumps(messages)
+    pickle.loads(data)
+    print(f'Message对象：{len(data) / 1024 / 1024:.1f}MiB，序列化+反序列化{time.perf_counter() - st:.3f}s')
+    columns = MessageColumns.from_messages(messages)
+    st = time.perf_counter()
+    data = pickle.dumps(columns)
+    columns = pickle.loads(data)
+    print(f'列式：{len(data) / 1024 / 1024:.1f}MiB，序列化+反序列化{time.perf_counter() - st:.3f}s')
+    st = time.perf_counter()
+    restored = list(columns)
+    print(f'还原成Message：{time.perf_counter() - st:.3f}s')
+    assert restored == messages
@@ -8,12 +8,37 @@
 @File        : MemoTrace-db_model.py 
 @Description : 
 """
+import base64
+import heapq
+import itertools
+import json
 import os
+import queue
 import sqlite3
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from wxManager.log import logger
 
 
 class DataBaseBase:
+    # 每个连接缓存的预编译语句数量，参数化的sql只需要解析一次
+    cached_statements = 256
+
+    # 只读连接配置，解密后的数据库基本只读，子类设置read_only = True开启
+    read_only = False
+    immutable = False  # 数据库文件在打开期间不会被任何程序修改时才能开启，sqlite将不再加锁和检查变更
+    allow_snapshot_writes = False  # 只读模式下默认不保存消息表反查索引到解密后的数据库文件，设为True才会保存
+    mmap_size = 256 * 1024 * 1024
+    cache_size = -64 * 1024  # 负数表示单位为KiB
+
     def __init__(self, db_file_name, is_series=False):
         self.DB = None
         self.cursor = None
@@ -21,6 +46,11 @@ class DataBaseBase:
         self.db_file_name = db_file_name
         self.is_series = is_series  # 是否是一系列数据库，例如MSG0、MSG1、MSG2······
         self.db_dir = ''
+        self.db_paths = []
+        self._executor = None  # 分库并发查询的常驻线程池
+        self._local = threading.local()  # 每个线程自己的分库连接
+        self._pool = []  # 所有线程打开过的连接，关闭时统一释放
+        self._pool_lock = threading.Lock()
 
     def init_database(self, db_dir=''):
         self.db_dir = db_dir
@@ -39,14 +69,16 @@ class DataBaseBase:
                 db_path = os.path.join(db_dir, new_file_name)
                 if os.path.exists(db_path):
                     self.db_file_name.append(os.path.basename(new_file_name))
+                    self.db_paths.append(db_path)
                     # print('初始化数据库：', db_path)
-                    DB = sqlite3.connect(db_path, check_same_thread=False)
+                    DB = self.connect(db_path)
                     cursor = DB.cursor()
                     self.DB.append(DB)
                     self.cursor.append(cursor)
                     self.open_flag = True
         else:
-            self.DB = sqlite3.connect(db_path, check_same_thread=False)
+            self.db_paths = [db_path]
+            self.DB = self.connect(db_path)
             # '''创建游标'''
             self.cursor = self.DB.cursor()
             self.open_flag = True
@@ -57,6 +89,231 @@ class DataBaseBase:
     def self_init(self):
         pass
 
+    def index_definitions(self, table_names) -> List[Tuple[str, str, Tuple[str, ...]]]:
+        """
+        子类返回需要自动创建的索引
+        @param table_names: 数据库中所有的表名
+        @return: [(索引名, 表名, 列)]
+        """
+        return []
+
+    def provision_indexes(self):
+        """
+        首次打开数据库时为常用查询建立索引，建好的索引记录在wxManager_meta表中，以后打开直接跳过
+        只读模式下查询连接不能写，索引通过单独的可写连接创建；immutable时sqlite不再检查变更，文件不可写时也无法创建，这两种情况跳过
+        @return:
+        """
+        if self.immutable:
+            return
+        for db_path in self.db_paths:
+            if not os.access(db_path, os.W_OK):
+                continue
+            st = time.time()
+            created = []
+            try:
+                with closing(sqlite3.connect(db_path)) as DB:
+                    DB.execute('CREATE TABLE IF NOT EXISTS wxManager_meta(key TEXT PRIMARY KEY, value TEXT)')
+                    done = {row[0] for row in DB.execute('SELECT key FROM wxManager_meta')}
+                    table_names = [row[0] for row in DB.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+                    for index_name, table_name, columns in self.index_definitions(table_names):
+                        if index_name in done:
+                            continue
+                        if not self._has_index(DB, table_name, columns):
+                            DB.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}"({",".join(columns)})')
+                            created.append(index_name)
+                        DB.execute('INSERT OR REPLACE INTO wxManager_meta(key, value) VALUES (?, ?)',
+                                   [index_name, str(int(time.time()))])
+                    DB.commit()
+            except sqlite3.Error:
+                logger.error(f'创建索引失败：{db_path}\n{traceback.format_exc()}')
+                continue
+            if created:
+                logger.debug(f'创建索引{len(created)}个，耗时{time.time() - st:.2f}s：{db_path}')
+
+    def snapshot_writable(self) -> bool:
+        """
+        是否允许修改数据库文件：immutable时不允许，只读模式下需要设置allow_snapshot_writes = True
+        """
+        return not self.immutable and (not self.read_only or self.allow_snapshot_writes)
+
+    @staticmethod
+    def _has_index(DB, table_name, columns) -> bool:
+        """已有索引的前几列和columns一致时就不再重复创建"""
+        for index in DB.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+            index_columns = tuple(row[2] for row in DB.execute(f'PRAGMA index_info("{index[1]}")').fetchall())
+            if index_columns[:len(columns)] == tuple(columns):
+                return True
+        return False
+
+    def connect(self, db_path, read_only=None) -> sqlite3.Connection:
+        """
+        打开数据库连接，只读模式下以mode=ro打开并加大页缓存、开启mmap
+        @param db_path:
+        @param read_only: None表示使用类的配置
+        @return:
+        """
+        read_only = self.read_only if read_only is None else read_only
+        if not read_only:
+            return sqlite3.connect(db_path, check_same_thread=False, cached_statements=self.cached_statements)
+        uri = f'{Path(db_path).resolve().as_uri()}?mode=ro{"&immutable=1" if self.immutable else ""}'
+        DB = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=self.cached_statements)
+        DB.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        DB.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        DB.execute('PRAGMA temp_store=MEMORY')
+        DB.execute('PRAGMA query_only=1')
+        return DB
+
+    def _reconnect(self, read_only):
+        if self.is_series:
+            for DB in self.DB:
+                DB.close()
+            self.DB = [self.connect(db_path, read_only) for db_path in self.db_paths]
+            self.cursor = [DB.cursor() for DB in self.DB]
+        else:
+            self.DB.close()
+            self.DB = self.connect(self.db_paths[0], read_only)
+            self.cursor = self.DB.cursor()
+
+    def get_connection(self, index=0) -> sqlite3.Connection:
+        """
+        获取当前线程第index个分库的连接，每个线程第一次使用时单独打开，不和其他线程共用同一个连接
+        @param index: 分库下标
+        @return:
+        """
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        DB = connections.get(index)
+        if DB is None:
+            DB = self.connect(self.db_paths[index])
+            connections[index] = DB
+            with self._pool_lock:
+                self._pool.append(DB)
+        return DB
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._pool_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(len(self.db_paths), 1),
+                        thread_name_prefix=self.__class__.__name__
+                    )
+        return self._executor
+
+    def _run_on_shard(self, index, func, args):
+        cursor = self.get_connection(index).cursor()
+        try:
+            return func(cursor, *args)
+        finally:
+            cursor.close()
+
+    def map_shards(self, func, *args, indexes=None) -> list:
+        """
+        在常驻线程池中并发地对每个分库执行func(cursor, *args)，每个工作线程使用自己的连接
+        @param func:
+        @param args:
+        @param indexes: 需要查询的分库下标，None表示全部分库
+        @return: 每个分库的结果，顺序和indexes一致
+        """
+        if indexes is None:
+            indexes = range(len(self.db_paths))
+        futures = [self.executor.submit(self._run_on_shard, index, func, args) for index in indexes]
+        return [future.result() for future in futures]
+
+    # stream_shards中每个分库一次放入队列的行数和队列中最多积压的块数
+    stream_chunk_size = 500
+    stream_queue_size = 8
+
+    def _produce_shard(self, index, func, args, rows_queue: queue.Queue, stop: threading.Event):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    rows_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            # 单独的连接，流式读取期间不占用map_shards的线程池，也不和其他线程共用
+            with closing(self.connect(self.db_paths[index])) as DB:
+                cursor = DB.cursor()
+                rows = func(cursor, *args)
+                while chunk := list(itertools.islice(rows, self.stream_chunk_size)):
+                    if not put(chunk):
+                        return
+                put(None)
+        except BaseException as e:
+            put(e)
+
+    def _stream_shard(self, index, func, args):
+        rows_queue = queue.Queue(self.stream_queue_size)
+        stop = threading.Event()
+        # 第一次取数据时才启动读取线程，没有被迭代过的迭代器不会留下线程
+        threading.Thread(
+            target=self._produce_shard, args=(index, func, args, rows_queue, stop),
+            name=f'{self.__class__.__name__}-stream-{index}', daemon=True
+        ).start()
+        try:
+            while (chunk := rows_queue.get()) is not None:
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield from chunk
+        finally:
+            stop.set()
+
+    def stream_shards(self, func, shard_args: dict) -> List[Iterator]:
+        """
+        每个分库在单独的线程中执行生成器func(cursor, *args)，读出的行经有界队列交给调用方，
+        读取数据库和调用方处理数据同时进行，调用方停止迭代后线程随之退出
+        @param func: 生成器函数，返回一个分库中的所有行
+        @param shard_args: {分库下标: args}，每个分库的参数可以不同
+        @return: 每个分库的迭代器，顺序和shard_args一致
+        """
+        return [self._stream_shard(index, func, args) for index, args in shard_args.items()]
+
+    @contextmanager
+    def writable(self):
+        """
+        只读模式下临时以可写方式重新打开数据库，用于合并等写操作，结束后恢复只读连接
+        with db.writable():
+            db.merge(db_path)
+        """
+        if not self.read_only or not self.open_flag:
+            yield self
+            return
+        self._reconnect(False)
+        try:
+            yield self
+        finally:
+            self._reconnect(True)
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def build_select(table, columns, where=(), order_by='', limit=False, join='') -> str:
+        """
+        生成参数化的查询语句，所有条件的值都用?占位，同一种查询只会生成同一条sql，可以命中连接的语句缓存
+        @param table: 表名（可带别名）
+        @param columns: 查询的列
+        @param where: 条件的(列名, 运算符)，如(('local_type', '='), ('create_time', '>'))，用and连接
+        @param order_by: 排序
+        @param limit: 是否带limit ?
+        @param join: join子句
+        @return: sql
+        """
+        sql = [f'select {columns}', f'from {table}']
+        if join:
+            sql.append(join)
+        if where:
+            sql.append('where ' + ' and '.join(f'{column}{op}?' for column, op in where))
+        if order_by:
+            sql.append(f'order by {order_by}')
+        if limit:
+            sql.append('limit ?')
+        return '\n'.join(sql)
+
     def commit(self):
         if self.is_series:
             for db in self.DB:
@@ -68,6 +325,14 @@ class DataBaseBase:
         self.cursor.execute(sql, args)
 
     def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for DB in pool:
+            DB.close()
+        self._local = threading.local()
         if self.open_flag:
             try:
                 self.open_flag = False
@@ -89,5 +354,113 @@ class DataBaseBase:
         self.close()
 
 
+# 游标起点，比任何sort_seq都大
+MAX_SORT_SEQ = (1 << 63) - 1
+
+
+@dataclass
+class MessageCursor:
+    """
+    分库消息的键集分页游标，从新到旧翻页
+    sort_seq: 上一页最后一条消息的排序键，4.0为sort_seq，3.x为[CreateTime, localId]
+    shard_marks: 每个分库下一次查询的上界（不包含），None表示该分库已经读完
+    """
+    sort_seq: int | list = MAX_SORT_SEQ
+    shard_marks: List[Optional[int | list]] = field(default_factory=list)
+
+    def marks(self, shard_num) -> List[Optional[int]]:
+        """
+        获取每个分库的查询上界，分库数量变化（如合并了新数据库）后退回到全局的sort_seq
+        @param shard_num: 分库数量
+        @return:
+        """
+        if len(self.shard_marks) != shard_num:
+            return [self.sort_seq] * shard_num
+        return list(self.shard_marks)
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.shard_marks) and all(mark is None for mark in self.shard_marks)
+
+    def to_token(self) -> str:
+        data = json.dumps([self.sort_seq, self.shard_marks], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def from_token(cls, token: Optional[str]) -> 'MessageCursor':
+        if not token:
+            return cls()
+        sort_seq, shard_marks = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return cls(sort_seq, shard_marks)
+
+    def next_page(
+            self,
+            shard_iterators: List[Optional[Iterator[tuple]]],
+            msg_num: int,
+            key: Callable[[tuple], int | tuple]
+    ) -> Tuple[List[tuple], 'MessageCursor']:
+        """
+        对各个分库按sort_seq倒序返回的结果做堆归并，只取出一页
+        每个分库的查询需带上limit msg_num，迭代器只会被读取到需要的位置
+        @param shard_iterators: 每个分库的迭代器，和shard_marks一一对应，已读完的分库传None
+        @param msg_num: 每页消息数
+        @param key: 从一行数据中取出排序键（sort_seq或(CreateTime, localId)）
+        @return: 本页数据, 下一页的游标
+        """
+        marks = self.marks(len(shard_iterators))
+        pulled = [0] * len(shard_iterators)
+        finished = [False] * len(shard_iterators)
+
+        def tagged(index, iterator):
+            for row in iterator:
+                pulled[index] += 1
+                yield key(row), index, row
+            finished[index] = True
+
+        merged = heapq.merge(
+            *[tagged(index, iterator) for index, iterator in enumerate(shard_iterators) if iterator is not None],
+            key=lambda item: item[0], reverse=True
+        )
+        rows = []
+        consumed = [0] * len(shard_iterators)
+        for sort_seq, index, row in merged:
+            rows.append(row)
+            consumed[index] += 1
+            marks[index] = sort_seq
+            if len(rows) >= msg_num:
+                break
+        for index, iterator in enumerate(shard_iterators):
+            if iterator is None:
+                marks[index] = None
+            elif finished[index] and consumed[index] == pulled[index] and pulled[index] < msg_num:
+                # 该分库剩下的数据已经全部返回
+                marks[index] = None
+        next_sort_seq = key(rows[-1]) if rows else self.sort_seq
+        return rows, MessageCursor(next_sort_seq, marks)
+
+
 if __name__ == '__main__':
-    pass
+    # 语句缓存的基准测试：拼接时间范围时每个查询都是新的sql，需要重新解析
+    import random
+
+    conn = sqlite3.connect(':memory:', cached_statements=DataBaseBase.cached_statements)
+    tables = [f'Msg_{i}' for i in range(200)]
+    for table in tables:
+        conn.execute(f'create table {table}(local_id INTEGER PRIMARY KEY, local_type, create_time)')
+        conn.executemany(f'insert into {table}(local_type, create_time) values (?,?)',
+                         [(1, 1700000000 + i) for i in range(50)])
+    ranges = [(1700000000 + random.randint(0, 20), 1700000000 + random.randint(30, 50)) for _ in range(50)]
+
+    st = time.perf_counter()
+    for table in tables:
+        for start, end in ranges:
+            conn.execute(f'select * from {table} where create_time>{start} and create_time<{end} '
+                         f'order by local_id').fetchall()
+    print(f'拼接sql：{time.perf_counter() - st:.3f}s')
+
+    st = time.perf_counter()
+    for table in tables:
+        sql = DataBaseBase.build_select(table, '*', (('create_time', '>'), ('create_time', '<')), 'local_id')
+        for start, end in ranges:
+            conn.execute(sql, [start, end]).fetchall()
+    print(f'参数化sql：{time.perf_counter() - st:.3f}s')
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/12 22:05
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-frame.py
+@Description : 按列存储的会话消息元数据（numpy数组），用于在不创建Message对象的情况下做条数、时间分布、发送者等统计
+"""
+import bisect
+import time
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from wxManager.model.message import Message
+
+# 数据库按这个顺序返回每条消息的整数列，sender为发送者在该分库中的编号
+FRAME_COLUMNS = ('local_id', 'server_id', 'type', 'sort_seq', 'timestamp', 'sender')
+
+
+class MessageFrame:
+    """
+    一个会话的消息按列存储（struct of arrays）：
+    local_id、server_id、type、sort_seq、timestamp为int64数组，is_sender为bool数组，
+    sender为发送者在senders中的下标（int32），senders、display_names是发送者的字符串表
+    每条消息只占几十个字节，几千万条消息的按天、按小时、按发送者统计都在numpy中完成
+    type和4.0的local_type编码一致（3.x为Type | SubType << 32），绝大多数和MessageType相同
+    """
+
+    def __init__(self, talker_id='', local_id=None, server_id=None, type=None, sort_seq=None, timestamp=None,
+                 is_sender=None, sender=None, senders: List[str] = None, display_names: List[str] = None):
+        def int64(values):
+            return np.zeros(0, np.int64) if values is None else np.asarray(values, np.int64)
+
+        self.talker_id = talker_id
+        self.local_id = int64(local_id)
+        self.server_id = int64(server_id)
+        self.type = int64(type)
+        self.sort_seq = int64(sort_seq)
+        self.timestamp = int64(timestamp)
+        self.is_sender = np.zeros(0, np.bool_) if is_sender is None else np.asarray(is_sender, np.bool_)
+        self.sender = np.zeros(0, np.int32) if sender is None else np.asarray(sender, np.int32)
+        self.senders = senders or []
+        self.display_names = display_names or list(self.senders)
+        self._local_time = None
+        self._max_time = None
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[Message], talker_id='') -> 'MessageFrame':
+        """
+        @param messages: 已经解析好的消息（比如导出时读出来的聊天记录）
+        @param talker_id:
+        @return: 和messages顺序一致的frame
+        """
+        messages = messages if isinstance(messages, list) else list(messages)
+        sender_index = {}
+        display_names = []
+        sender = []
+        for message in messages:
+            index = sender_index.get(message.sender_id)
+            if index is None:
+                index = sender_index[message.sender_id] = len(display_names)
+                display_names.append(message.display_name)
+            sender.append(index)
+        num = len(messages)
+        return cls(
+            talker_id or (messages[0].talker_id if messages else ''),
+            local_id=np.fromiter((m.local_id for m in messages), np.int64, num),
+            server_id=np.fromiter((m.server_id for m in messages), np.int64, num),
+            type=np.fromiter((m.type for m in messages), np.int64, num),
+            sort_seq=np.fromiter((m.sort_seq for m in messages), np.int64, num),
+            timestamp=np.fromiter((m.timestamp for m in messages), np.int64, num),
+            is_sender=np.fromiter((bool(m.is_sender) for m in messages), np.bool_, num),
+            sender=np.array(sender, np.int32),
+            senders=list(sender_index),
+            display_names=display_names,
+        )
+
+    @classmethod
+    def from_shards(cls, talker_id, shards: Iterable[Tuple[array, Dict[int, str]]], my_wxid='') -> 'MessageFrame':
+        """
+        合并各分库查出来的整数列，按sort_seq排序
+        @param talker_id:
+        @param shards: [(按FRAME_COLUMNS顺序逐行展开的array('q'), {发送者编号: wxid})]
+        @param my_wxid: 自己的wxid，发送者是自己的消息is_sender为True
+        @return:
+        """
+        columns = []
+        sender_index = {}
+        for rows, sender_names in shards:
+            values = np.frombuffer(rows, np.int64).reshape(-1, len(FRAME_COLUMNS))
+            # 各分库的发送者编号不同，换成合并后的字符串表下标，Name2Id中没有的发送者记为空字符串
+            codes, inverse = np.unique(values[:, 5], return_inverse=True)
+            lookup = np.array([sender_index.setdefault(sender_names.get(code, ''), len(sender_index))
+                               for code in codes.tolist()], np.int32)
+            columns.append((values, lookup[inverse.reshape(-1)]))
+        senders = list(sender_index)
+        if not columns:
+            return cls(talker_id, senders=senders)
+        values = np.concatenate([values for values, _ in columns])
+        sender = np.concatenate([mapped for _, mapped in columns])
+        order = np.argsort(values[:, 3], kind='stable')
+        values = values[order]
+        sender = sender[order]
+        me = sender_index.get(my_wxid, -1)
+        return cls(talker_id, local_id=values[:, 0], server_id=values[:, 1], type=values[:, 2],
+                   sort_seq=values[:, 3], timestamp=values[:, 4], is_sender=sender == me, sender=sender,
+                   senders=senders)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __repr__(self):
+        return f'MessageFrame({self.talker_id!r}, {len(self)}条消息, {len(self.senders)}个发送者)'
+
+    def take(self, index) -> 'MessageFrame':
+        """
+        按下标数组或bool掩码取出一部分消息，字符串表共用
+        如frame.take(frame.type == MessageType.Text)、frame.take(frame.is_sender)
+        """
+        frame = MessageFrame(self.talker_id, self.local_id[index], self.server_id[index], self.type[index],
+                             self.sort_seq[index], self.timestamp[index], self.is_sender[index], self.sender[index],
+                             self.senders, self.display_names)
+        if self._local_time is not None:
+            frame._local_time = self._local_time[index]
+        return frame
+
+    def local_time(self) -> np.ndarray:
+        """
+        本地时区的秒级时间（时间戳加上当时的UTC偏移），按天、小时分组都用它，和数据库里strftime(..., 'localtime')一致
+        UTC偏移按小时取一次，夏令时切换也能算对
+        """
+        if self._local_time is None:
+            if not len(self):
+                self._local_time = self.timestamp.copy()
+            else:
+                hours = self.timestamp // 3600
+                first = int(hours.min())
+                offsets = np.array([time.localtime(hour * 3600).tm_gmtoff
+                                    for hour in range(first, int(hours.max()) + 1)], np.int64)
+                self._local_time = self.timestamp + offsets[hours - first]
+        return self._local_time
+
+    @staticmethod
+    def _counts(keys, labels) -> List[Tuple[str, int]]:
+        values, counts = np.unique(keys, return_counts=True)
+        return list(zip(labels(values), counts.tolist()))
+
+    def count_by_day(self) -> List[Tuple[str, int]]:
+        """
+        @return: [('2024-12-01', 条数)]，按日期升序，和DataBaseInterface.get_messages_by_days的格式一致
+        """
+        days = self.local_time() // 86400
+        return self._counts(days, lambda values: np.datetime_as_string(values.astype('datetime64[D]')).tolist())
+
+    def count_by_month(self) -> List[Tuple[str, int]]:
+        """
+        @return: [('2024-12', 条数)]，按月份升序
+        """
+        months = (self.local_time() // 86400).astype('datetime64[D]').astype('datetime64[M]')
+        return self._counts(months, lambda values: np.datetime_as_string(values).tolist())
+
+    def count_by_hour(self) -> List[Tuple[str, int]]:
+        """
+        @return: [('08:00', 条数)]，按小时升序，没有消息的小时不返回
+        """
+        counts = np.bincount(self.local_time() % 86400 // 3600, minlength=24)
+        return [(f'{hour:02d}:00', count) for hour, count in enumerate(counts.tolist()) if count]
+
+    def count_by_sender(self) -> List[Tuple[str, int]]:
+        """
+        @return: [(发送者wxid, 条数)]，按条数降序
+        """
+        counts = np.bincount(self.sender, minlength=len(self.senders))
+        order = np.argsort(-counts, kind='stable').tolist()
+        counts = counts.tolist()
+        return [(self.senders[i], counts[i]) for i in order if counts[i]]
+
+    def count_by_type(self) -> Dict[int, int]:
+        """
+        @return: {type: 条数}
+        """
+        values, counts = np.unique(self.type, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def send_count(self) -> int:
+        return int(np.count_nonzero(self.is_sender))
+
+    # 下面几个函数给按时间切分对话（json导出训练数据集）用，逐组而不是逐条消息地循环
+
+    def next_index(self, mask) -> np.ndarray:
+        """
+        @param mask: 长度为len(frame)的bool数组
+        @return: 长度为len(frame)+1的数组，第i项为>=i的第一个mask为True的下标，没有时为len(frame)
+        """
+        num = len(self)
+        index = np.where(np.append(mask, True), np.arange(num + 1), num)
+        return np.minimum.accumulate(index[::-1])[::-1]
+
+    def next_gap(self, max_diff_seconds) -> np.ndarray:
+        """
+        @param max_diff_seconds:
+        @return: 同next_index，第i项为>=i的第一条和上一条消息间隔超过max_diff_seconds的消息下标
+        """
+        gap = np.zeros(len(self), np.bool_)
+        gap[1:] = np.diff(self.timestamp) > max_diff_seconds
+        return self.next_index(gap)
+
+    def first_time_at_least(self, start, threshold) -> int:
+        """
+        @return: 从start开始第一条timestamp>=threshold的消息下标，没有时为len(frame)
+        """
+        if self._max_time is None:
+            # 逐组调用，用list和bisect比每次调用numpy快
+            self._max_time = np.maximum.accumulate(self.timestamp).tolist()
+        num = len(self)
+        if start == 0 or self._max_time[start - 1] < threshold:
+            # start之前没有达到threshold的消息时，在时间的前缀最大值上二分即可
+            return bisect.bisect_left(self._max_time, threshold, start)
+        # 时间不是单调的（修改过系统时间），逐段查找
+        step = 256
+        while start < num:
+            hit = np.flatnonzero(self.timestamp[start:start + step] >= threshold)
+            if len(hit):
+                return start + int(hit[0])
+            start += step
+            step *= 2
+        return num
+
+
+if __name__ == '__main__':
+    import sys
+    from wxManager.model.message import TextMessage, MessageType
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.integers(1, 600, num)) + 1600000000
+    members = [f'wxid_{i:08d}' for i in range(200)]
+    member_ids = rng.integers(0, 200, num)
+    messages = [
+        TextMessage(local_id=i, server_id=i, sort_seq=int(ts) * 1000, timestamp=int(ts), str_time='',
+                    type=MessageType.Text, talker_id='123@chatroom', is_sender=member == 0,
+                    sender_id=members[member], display_name=members[member], avatar_src='', status=2,
+                    xml_content='', content='')
+        for i, (ts, member) in enumerate(zip(timestamps.tolist(), member_ids.tolist()))
+    ]
+
+    st = time.perf_counter()
+    days, hours, senders = {}, {}, {}
+    send_count = 0
+    for message in messages:
+        days[message.str_time[:10]] = days.get(message.str_time[:10], 0) + 1
+        hour = message.str_time[11:13] + ':00'
+        hours[hour] = hours.get(hour, 0) + 1
+        senders[message.sender_id] = senders.get(message.sender_id, 0) + 1
+        send_count += message.is_sender
+    old_seconds = time.perf_counter() - st
+
+    st = time.perf_counter()
+    frame = MessageFrame.from_messages(messages)
+    build_seconds = time.perf_counter() - st
+    st = time.perf_counter()
+    result = frame.count_by_day(), frame.count_by_hour(), frame.count_by_sender(), frame.send_count()
+    new_seconds = time.perf_counter() - st
+    assert result[0] == sorted(days.items())
+    assert result[1] == sorted(hours.items())
+    assert dict(result[2]) == senders and result[3] == send_count
+    print(f'{num}条消息 按天/小时/发送者统计 遍历Message：{old_seconds:.2f}s  '
+          f'MessageFrame：{new_seconds:.3f}s（从Message构建{build_seconds:.2f}s）')
+    size = sum(getattr(frame, name).nbytes for name in ('local_id', 'server_id', 'type', 'sort_seq', 'timestamp',
+                                                        'is_sender', 'sender'))
+    print(f'MessageFrame数组共{size / 1024 / 1024:.1f}MiB，平均每条{size / num:.0f}字节')
@@ -8,7 +8,10 @@
 @File        : MemoTrace-message.py 
 @Description : 
 """
-from dataclasses import dataclass
+import sys
+import time
+from dataclasses import dataclass, field, fields, InitVar
+from functools import cache, lru_cache
 from typing import List
 from datetime import datetime
 
@@ -79,13 +82,28 @@ class MessageType:
         return type_name_map.get(type_, '未知类型')
 
 
-@dataclass
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+@lru_cache(maxsize=4096)
+def format_time(timestamp) -> str:
+    """
+    消息的格式化时间，和数据库里strftime('%Y-%m-%d %H:%M:%S', ..., 'localtime')的结果一致
+    创建消息时要和数据库的StrTime比较，读取str_time时又要生成一次，同一秒的消息很多，按时间戳缓存结果
+    @param timestamp: 秒级时间戳
+    @return: 2024-12-01 12:00:00，时间戳为0时返回空字符串
+    """
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else ''
+
+
+@dataclass(slots=True)
 class Message:
     local_id: int  # 消息ID
     server_id: int  # 消息的唯一ID
     sort_seq: int  # 排序用的id
     timestamp: int  # 发送秒级时间戳
-    str_time: str  # 格式化时间 2024-12-01 12:00:00
+    str_time: InitVar[str]  # 格式化时间 2024-12-01 12:00:00，和timestamp一致时不保存，读取时由timestamp得到
     type: MessageType  # 消息类型（文本、图片、视频等）
     talker_id: str  # 聊天对象的wxid，好友的wxid或者群聊的wxid
     is_sender: bool  # 自己是否是发送者
@@ -94,6 +112,17 @@ class Message:
     avatar_src: str  # 消息发送者头像
     status: int  # 消息状态
     xml_content: str  # xml数据
+    _str_time: str = field(default=None, init=False, repr=False, compare=False)  # 和timestamp对不上的原始时间文本
+
+    def __post_init__(self, str_time):
+        # 同一个会话里talker_id、发送者的wxid、昵称、头像大量重复，所有消息共用同一个字符串对象
+        self.talker_id = _intern(self.talker_id)
+        self.sender_id = _intern(self.sender_id)
+        self.display_name = _intern(self.display_name)
+        self.avatar_src = _intern(self.avatar_src)
+        # 数据库查出的时间和timestamp一致，不用每条消息保存一个字符串；合并转发的聊天记录里的原始时间文本等原样保存
+        if str_time and str_time != format_time(self.timestamp):
+            self._str_time = str_time
 
     def is_chatroom(self) -> bool:
         return self.talker_id.endswith('@chatroom')
@@ -128,7 +157,20 @@ class Message:
         return self.sort_seq < other.sort_seq
 
 
-@dataclass
+def _get_str_time(message: Message) -> str:
+    str_time = message._str_time
+    return format_time(message.timestamp) if str_time is None else str_time
+
+
+def _set_str_time(message: Message, value):
+    message._str_time = value or None
+
+
+# 类定义里直接写str_time属性会被dataclass当成InitVar的默认值，类创建之后再加上
+Message.str_time = property(_get_str_time, _set_str_time)
+
+
+@dataclass(slots=True)
 class TextMessage(Message):
     # 文本消息
     content: str
@@ -137,18 +179,19 @@ class TextMessage(Message):
         return self.content
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        # slots=True会重新创建类，3.11中无参数的super()指向的是原来的类，消息类里都写明类名
+        data = super(TextMessage, self).to_json()
         data['text'] = self.content
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class QuoteMessage(TextMessage):
     # 引用消息
     quote_message: Message
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(QuoteMessage, self).to_json()
         data.update(
             {
                 "text": self.content,
@@ -171,7 +214,7 @@ class QuoteMessage(TextMessage):
             return f'{self.content}\n引用：{self.quote_message.display_name}: {self.quote_message.to_text()}'
 
 
-@dataclass
+@dataclass(slots=True)
 class FileMessage(Message):
     # 文件消息
     path: str
@@ -181,7 +224,7 @@ class FileMessage(Message):
     file_type: str
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(FileMessage, self).to_json()
         data.update(
             {
                 'path': self.path,
@@ -227,13 +270,13 @@ class FileMessage(Message):
         return f'【文件】{self.file_name} {self.get_file_size()} {self.path} {self.file_type} {self.md5}'
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageMessage(FileMessage):
     # 图片消息
     thumb_path: str
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(ImageMessage, self).to_json()
         data['path'] = self.path
         data['thumb_path'] = self.thumb_path
         return data
@@ -242,7 +285,7 @@ class ImageMessage(FileMessage):
         return f'【图片】'
 
 
-@dataclass
+@dataclass(slots=True)
 class EmojiMessage(ImageMessage):
     # 表情包
     url: str
@@ -250,7 +293,7 @@ class EmojiMessage(ImageMessage):
     description: str
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(EmojiMessage, self).to_json()
         data.update(
             {
                 'path': self.url,
@@ -263,7 +306,7 @@ class EmojiMessage(ImageMessage):
         return f'【表情包】 {self.description}'
 
 
-@dataclass
+@dataclass(slots=True)
 class VideoMessage(FileMessage):
     # 视频消息
     thumb_path: str
@@ -274,7 +317,7 @@ class VideoMessage(FileMessage):
         return '【视频】'
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(VideoMessage, self).to_json()
         data.update(
             {
                 'path': self.path,
@@ -285,7 +328,7 @@ class VideoMessage(FileMessage):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class AudioMessage(FileMessage):
     # 语音消息
     duration: int
@@ -306,7 +349,7 @@ class AudioMessage(FileMessage):
         return self.file_name
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(AudioMessage, self).to_json()
         data.update(
             {
                 'path': self.path,
@@ -321,7 +364,7 @@ class AudioMessage(FileMessage):
         return f'【语音】{self.audio_text}'
 
 
-@dataclass
+@dataclass(slots=True)
 class LinkMessage(Message):
     # 链接消息
     href: str  # 跳转链接
@@ -342,7 +385,7 @@ class LinkMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(LinkMessage, self).to_json()
         data.update(
             {
                 'url': self.href,
@@ -356,7 +399,7 @@ class LinkMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class WeChatVideoMessage(Message):
     # 视频号消息
     url: str  # 下载地址
@@ -378,7 +421,7 @@ class WeChatVideoMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(WeChatVideoMessage, self).to_json()
         data.update(
             {
                 'url': self.url,
@@ -392,7 +435,7 @@ class WeChatVideoMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class MergedMessage(Message):
     # 合并转发的聊天记录
     title: str
@@ -407,7 +450,7 @@ class MergedMessage(Message):
         return res
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(MergedMessage, self).to_json()
         data.update(
             {
                 'title': self.title,
@@ -418,7 +461,7 @@ class MergedMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class VoipMessage(Message):
     # 音视频通话
     invite_type: int  # -1，1:语音通话，0:视频通话
@@ -429,7 +472,7 @@ class VoipMessage(Message):
         return f'【音视频通话】\n{self.display_content}'
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(VoipMessage, self).to_json()
         data.update(
             {
                 'invite_type': self.invite_type,
@@ -440,7 +483,7 @@ class VoipMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class PositionMessage(Message):
     # 位置分享
     x: float  # 经度
@@ -457,7 +500,7 @@ class PositionMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(PositionMessage, self).to_json()
         data.update(
             {
                 'x': self.x,  # 经度
@@ -470,7 +513,7 @@ class PositionMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class BusinessCardMessage(Message):
     # 名片消息
     is_open_im: bool  # 是否是企业微信
@@ -511,7 +554,7 @@ class BusinessCardMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(BusinessCardMessage, self).to_json()
         data.update(
             {
                 'is_open_im': self.is_open_im,
@@ -530,7 +573,7 @@ class BusinessCardMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class TransferMessage(Message):
     # 转账
     fee_desc: str  # 金额
@@ -556,7 +599,7 @@ class TransferMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(TransferMessage, self).to_json()
         data.update(
             {
                 'text': self.display_content(),  # 显示文本
@@ -568,7 +611,7 @@ class TransferMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class RedEnvelopeMessage(Message):
     # 红包
     icon_url: str  # 红包logo
@@ -579,7 +622,7 @@ class RedEnvelopeMessage(Message):
         return f'''【红包】: {self.title}'''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(RedEnvelopeMessage, self).to_json()
         data.update(
             {
                 'text': self.title,  # 显示文本
@@ -589,7 +632,7 @@ class RedEnvelopeMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class FavNoteMessage(Message):
     # 收藏笔记
     title: str
@@ -603,7 +646,7 @@ class FavNoteMessage(Message):
 '''
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(FavNoteMessage, self).to_json()
         data.update(
             {
                 'text': self.title,  # 显示文本
@@ -614,7 +657,7 @@ class FavNoteMessage(Message):
         return data
 
 
-@dataclass
+@dataclass(slots=True)
 class PatMessage(Message):
     # 拍一拍
     title: str
@@ -627,7 +670,7 @@ class PatMessage(Message):
         return self.title
 
     def to_json(self) -> dict:
-        data = super().to_json()
+        data = super(PatMessage, self).to_json()
         data.update(
             {
                 'type': MessageType.System,
@@ -637,17 +680,141 @@ class PatMessage(Message):
         return data
 
 
+
+@cache
+def field_names(message_class) -> tuple:
+    """
+    消息类的所有字段名，顺序和dataclass定义一致（Message基类的字段在前）
+    """
+    return tuple(f.name for f in fields(message_class))
+
+
+def message_values(message: Message) -> dict:
+    """
+    消息的所有字段值，消息对象用了__slots__，没有__dict__，需要字段字典时用它代替vars(message)
+    str_time只有和timestamp对不上时才有值，保存在_str_time中
+    @param message:
+    @return: {字段名: 值}
+    """
+    if isinstance(message, LazyMessage):
+        message = message.load()
+    return {name: getattr(message, name) for name in field_names(type(message))}
+
+
+class LazyMessage(Message):
+    """
+    延迟解析的消息：创建时只有Message基类中除xml_content以外的元数据（时间、发送者、类型等），
+    第一次访问其他字段（content、xml_content、链接/引用等解析结果）或调用to_text、to_json时才解压、解析，
+    解析后的具体消息（TextMessage、LinkMessage等）保存在_message中，读取其他字段时转给它，
+    要修改具体类型的字段（导出时改path等）时对load()的返回值赋值
+    只做统计（条数、时间分布、发送者）时可以完全跳过解压和xml解析
+    """
+    __slots__ = ('_loader', '_message')
+
+    def __init__(self, loader, *, local_id, server_id, sort_seq, timestamp, type, talker_id, is_sender, sender_id,
+                 display_name, avatar_src, status, str_time=''):
+        """
+        @param loader: 无参函数，返回解析好的完整消息
+        其余参数为Message基类中除xml_content以外的元数据字段
+        """
+        self.local_id = local_id
+        self.server_id = server_id
+        self.sort_seq = sort_seq
+        self.timestamp = timestamp
+        self.type = type
+        self.talker_id = talker_id
+        self.is_sender = is_sender
+        self.sender_id = sender_id
+        self.display_name = display_name
+        self.avatar_src = avatar_src
+        self.status = status
+        self._str_time = None
+        self._loader = loader
+        self._message = None
+        self.__post_init__(str_time)
+
+    def load(self) -> Message:
+        message = self._message
+        if message is None:
+            message = self._loader()
+            for name in field_names(Message):
+                setattr(self, name, getattr(message, name))
+            self._message = message
+            self._loader = None
+        return message
+
+    def __getattr__(self, name):
+        # 只有实例和类上都找不到的属性（以及还没赋值的xml_content）才会走到这里
+        if name.startswith('__') or name in ('_loader', '_message'):
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+        return getattr(self.load(), name)
+
+    def to_json(self) -> dict:
+        return self.load().to_json()
+
+    def to_text(self):
+        return self.load().to_text()
+
+    def __eq__(self, other):
+        if isinstance(other, LazyMessage):
+            other = other.load()
+        return self.load() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.load())
+
+    def __reduce_ex__(self, protocol):
+        # 加载函数不能序列化，保存解析后的具体消息，反序列化得到的也是具体的消息类型
+        return _loaded_message, (self.load(),)
+
+
+def _loaded_message(message):
+    return message
+
+
 if __name__ == '__main__':
-    msg = TextMessage(
-        local_id=1,
-        server_id=101,
-        timestamp=1678901234,
-        type="text",
-        talker_id="wxid_12345",
-        is_sender=True,
-        sender_id="wxid_67890",
-        display_name="John Doe",
-        status=3,
-        content="Hello, world!"
-    )
-    print(msg.status)  # 输出：3
+    import gc
+    import tracemalloc
+    from dataclasses import make_dataclass
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    # 改之前的做法：普通dataclass，每个对象一个__dict__，str_time单独保存，字符串不共享
+    OldTextMessage = make_dataclass('OldTextMessage', [
+        ('local_id', int), ('server_id', int), ('sort_seq', int), ('timestamp', int), ('str_time', str),
+        ('type', int), ('talker_id', str), ('is_sender', bool), ('sender_id', str), ('display_name', str),
+        ('avatar_src', str), ('status', int), ('xml_content', str), ('content', str)
+    ])
+
+
+    def build(new):
+        messages = []
+        for i in range(num):
+            # 和从数据库读出来的一样，每一行的wxid、时间都是新的字符串对象，昵称、头像来自缓存的联系人
+            member = i % 200
+            timestamp = 1700000000 + i * 7
+            kwargs = dict(local_id=i, server_id=8000000000000000000 + i, sort_seq=timestamp * 1000,
+                          timestamp=timestamp, str_time=format_time(timestamp), type=MessageType.Text,
+                          talker_id=''.join(['123456@', 'chatroom']), is_sender=member == 0,
+                          sender_id=f'wxid_{member:08d}', display_name=names[member], avatar_src=avatars[member],
+                          status=2, xml_content='', content=f'第{i}条消息')
+            messages.append(TextMessage(**kwargs) if new else OldTextMessage(**kwargs))
+        return messages
+
+
+    names = [f'群成员{i}' for i in range(200)]
+    avatars = [f'https://wx.qlogo.cn/mmhead/ver_1/{i:032d}/132' for i in range(200)]
+    for new in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        st = time.perf_counter()
+        messages = build(new)
+        seconds = time.perf_counter() - st
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        name = '__slots__+共享字符串' if new else '普通dataclass'
+        print(f'{name:<16}{num}条消息：{size / 1024 / 1024:.1f}MiB，平均每条{size / num:.0f}字节，创建耗时{seconds:.2f}s')
+        if new:
+            assert messages[1].str_time == format_time(1700000007) and messages[1]._str_time is None
+        del messages
@@ -13,10 +13,9 @@ import re
 import traceback
 
 import xmltodict
-from google.protobuf.json_format import MessageToDict
 
 from wxManager.log import logger
-from wxManager.parser.util.protocbuf import emoji_desc_pb2
+from wxManager.parser.util.proto_util import get_emoji_desc
 
 
 def parser_emoji(xml_content):
@@ -54,15 +53,7 @@ def parser_emoji(xml_content):
         desc = ''
         if desc_bs64:
             # 逆天微信，竟然把protobuf数据用base64编码后放入xml里
-            desc_bytes_proto = base64.b64decode(desc_bs64)
-            message = emoji_desc_pb2.EmojiDescData()
-            # 解析二进制数据
-            message.ParseFromString(desc_bytes_proto)
-            dict_output = MessageToDict(message)
-            for item in dict_output.get('descItem', []):
-                desc = item.get('desc', '')
-                if desc:
-                    break
+            desc = get_emoji_desc(base64.b64decode(desc_bs64))
         result = {
             'md5': md5,
             'url': emoji_dic.get('@cdnurl', ''),
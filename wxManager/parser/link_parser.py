@@ -12,13 +12,13 @@ import html
 import re
 import traceback
 from datetime import datetime, timedelta
-import xml.etree.ElementTree as ET
 from typing import List
 
 import xmltodict
 
 from wxManager.log import logger
 from wxManager.model import *
+from wxManager.parser.xml_parser import parse_xml
 
 
 def parser_link(xml_content):
@@ -32,23 +32,21 @@ def parser_link(xml_content):
         'sourcedisplayname': '',
         'sourceusername': ''
     }
-    xml_content = xml_content.strip()
     try:
-        xml_dict = xmltodict.parse(xml_content)
-        dic = xml_dict.get('msg', {})
-        cover_url = dic.get('appmsg', {}).get('thumburl', '')
+        doc = parse_xml(xml_content)
+        cover_url = doc.text('appmsg/thumburl')
         if not cover_url:
-            cover_url = dic.get('appmsg', {}).get('songalbumurl', '')
+            cover_url = doc.text('appmsg/songalbumurl')
 
         result = {
-            'title': dic.get('appmsg', {}).get('title', ''),
-            'desc': dic.get('appmsg', {}).get('des', ''),
-            'url': dic.get('appmsg', {}).get('url', ''),
+            'title': doc.text('appmsg/title'),
+            'desc': doc.text('appmsg/des'),
+            'url': doc.text('appmsg/url'),
             'cover_url': cover_url,
-            'sourcedisplayname': dic.get('appmsg', {}).get('sourcedisplayname', ''),
-            'appname': dic.get('appinfo', {}).get('appname', ''),
-            'appid': dic.get('appmsg', {}).get('@appid', ''),
-            'sourceusername': dic.get('appmsg', {}).get('sourceusername', ''),
+            'sourcedisplayname': doc.text('appmsg/sourcedisplayname'),
+            'appname': doc.text('appinfo/appname'),
+            'appid': doc.attr('appmsg', 'appid'),
+            'sourceusername': doc.text('appmsg/sourceusername'),
         }
     except:
         logger.error(traceback.format_exc())
@@ -66,17 +64,17 @@ def parser_voip(xml_content):
         return result
     try:
         xml_content = xml_content.strip()
-        xml_dict = xmltodict.parse(f'<voipdata>{xml_content}</voipdata>')
-        dic = xml_dict.get('voipdata', {})
-        type_ = dic.get('voipmsg', {}).get('@type')
+        # 通话消息有多个根节点，套一层再解析
+        doc = parse_xml(f'<voipdata>{xml_content}</voipdata>')
+        type_ = doc.attr('voipmsg', 'type', None)
         duration = 0
         if type_ == 'VoIPBubbleMsg':
             invite_type = -1
-            display_content = dic.get('voipmsg', {}).get('VoIPBubbleMsg', {}).get('msg', '')
+            display_content = doc.text('voipmsg/VoIPBubbleMsg/msg')
         else:
-            invite_type = dic.get('voipinvitemsg', {}).get('invite_type', '0')
-            duration = dic.get('voiplocalinfo', {}).get('duration', '0')
-            display_content = dic.get('voiplocalinfo', {}).get('diaplay_content', '')
+            invite_type = doc.text('voipinvitemsg/invite_type', '0')
+            duration = doc.text('voiplocalinfo/duration', '0')
+            display_content = doc.text('voiplocalinfo/diaplay_content')
         result = {
             'invite_type': int(invite_type),
             'duration': duration,
@@ -95,16 +93,11 @@ def parser_applet(xml_content):
         'url': '',
         'app_icon': ''
     }
-    xml_content = xml_content.strip()
     try:
-        xml_dict = xmltodict.parse(xml_content)
-        dic = xml_dict.get('msg', {})
-        weappinfo = dic.get('appmsg', {}).get('weappinfo', {})
-        cover_url = weappinfo.get('weapppagethumbrawurl', '')
+        doc = parse_xml(xml_content)
+        cover_url = doc.text('appmsg/weappinfo/weapppagethumbrawurl')
         if not cover_url:
-            cover_url = weappinfo.get('weapppagethumbrawurl', '')
-        if not cover_url:
-            page_path = weappinfo.get('pagepath', '')
+            page_path = doc.text('appmsg/weappinfo/pagepath') or ''
             # 按 '&' 分割字符串
             parts = page_path.split('&')
 
@@ -115,12 +108,12 @@ def parser_applet(xml_content):
                     cover_url = part.split('=')[1]
 
         result = {
-            'title': dic.get('appmsg', {}).get('title', ''),
-            'desc': dic.get('appmsg', {}).get('des', ''),
-            'url': dic.get('appmsg', {}).get('url', ''),
-            'appname': dic.get('appmsg', {}).get('sourcedisplayname', ''),
-            'appid': weappinfo.get('@appid', ''),
-            'app_icon': weappinfo.get('weappiconurl', ''),
+            'title': doc.text('appmsg/title'),
+            'desc': doc.text('appmsg/des'),
+            'url': doc.text('appmsg/url'),
+            'appname': doc.text('appmsg/sourcedisplayname'),
+            'appid': doc.attr('appmsg/weappinfo', 'appid'),
+            'app_icon': doc.text('appmsg/weappinfo/weappiconurl'),
             'cover_url': cover_url,
         }
     except:
@@ -133,22 +126,15 @@ def parser_music(xml_content):
     if not xml_content:
         return {"type": 3, "title": "发生错误", "is_error": True}
     try:
-        root = ET.XML(xml_content)
-        appmsg = root.find("appmsg")
-        msg_type = int(appmsg.find("type").text)
-        title = appmsg.find("title").text
+        doc = parse_xml(xml_content)
+        msg_type = int(doc.text('appmsg/type', None))
+        title = doc.text('appmsg/title', None)
         if len(title) >= 39:
             title = title[:38] + "..."
-        artist = appmsg.find("des").text
-        link_url = appmsg.find("url").text  # 链接地址
-        try:
-            songalbumurl = appmsg.find('songalbumurl').text  # 封面地址
-        except:
-            songalbumurl = ''
-        try:
-            website_name = root.find('appinfo').find('appname').text
-        except:
-            website_name = 'QQ音乐'
+        artist = doc.text('appmsg/des', None)
+        link_url = doc.text('appmsg/url', None)  # 链接地址
+        songalbumurl = doc.text('appmsg/songalbumurl')  # 封面地址
+        website_name = doc.text('appinfo/appname', 'QQ音乐')
         return {
             "type": msg_type,
             "title": title,
@@ -180,20 +166,20 @@ def parser_business(xml_content):
     }
     xml_content = xml_content.strip()
     try:
-        data = xmltodict.parse(xml_content.replace('&', '&amp;'))
-        if data and data.get('msg'):
-            data = data['msg']
-            result['bigheadimgurl'] = data.get('@bigheadimgurl')
-            result['smallheadimgurl'] = data.get('@smallheadimgurl')
-            result['username'] = data.get('@username')
-            result['nickname'] = data.get('@nickname')
-            result['alias'] = data.get('@alias')
-            result['province'] = data.get('@province')
-            result['city'] = data.get('@city')
-            result['sign'] = data.get('@sign')
-            result['sex'] = int(data.get('@sex', ''))
-            result['openimdesc'] = data.get('@openimdesc')
-            result['openimdescicon'] = data.get('@openimdescicon')
+        doc = parse_xml(xml_content.replace('&', '&amp;'))
+        if doc.tag == 'msg':
+            data = doc.attrib
+            result['bigheadimgurl'] = data.get('bigheadimgurl')
+            result['smallheadimgurl'] = data.get('smallheadimgurl')
+            result['username'] = data.get('username')
+            result['nickname'] = data.get('nickname')
+            result['alias'] = data.get('alias')
+            result['province'] = data.get('province')
+            result['city'] = data.get('city')
+            result['sign'] = data.get('sign')
+            result['sex'] = int(data.get('sex', ''))
+            result['openimdesc'] = data.get('openimdesc')
+            result['openimdescicon'] = data.get('openimdescicon')
         return result
     except:
         logger.error(f'名片解析错误\n{traceback.format_exc()}\n{xml_content}')
@@ -579,20 +565,21 @@ def parser_wechat_video(xml_content):
         'cover': '',  # 封面url
         'duration': 0
     }
-    xml_content = xml_content.strip()
     try:
-        dic_data = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {}).get('finderFeed', {})
-        sourcedisplayname = dic_data.get('nickname', '')
-        weappiconurl = dic_data.get('avatar', '')
-        authIconUrl = dic_data.get('authIconUrl', '')
-        title = dic_data.get('desc', '')
-        media_count = dic_data.get('mediaCount', '0')
+        feed = parse_xml(xml_content).find('appmsg/finderFeed')
+        if feed is None:
+            raise ValueError('没有finderFeed节点')
+        sourcedisplayname = feed.text('nickname')
+        weappiconurl = feed.text('avatar')
+        authIconUrl = feed.text('authIconUrl')
+        title = feed.text('desc')
+        media_count = feed.text('mediaCount', '0')
         if media_count > '1':
-            cover = dic_data.get('mediaList', {}).get('media', [])[0].get('thumbUrl', '')
+            cover = feed.text('mediaList/media/thumbUrl')
             duration = 0
         else:
-            cover = dic_data.get('mediaList', {}).get('media', {}).get('coverUrl', '')
-            duration = dic_data.get('mediaList', {}).get('media', {}).get('videoPlayDuration', 0)
+            cover = feed.text('mediaList/media/coverUrl')
+            duration = feed.text('mediaList/media/videoPlayDuration', 0)
         result = {
             'title': title,
             'url': '',
@@ -617,14 +604,14 @@ def parser_position(xml_content):
         'scale': '0',  # 缩放率
     }
     try:
-        data = xmltodict.parse(xml_content)
-        if data and data.get('msg'):
-            data = data['msg']
-            result['x'] = data['location']['@x']
-            result['y'] = data['location']['@y']
-            result['label'] = data['location'].get('@label')
-            result['poiname'] = data['location'].get('@poiname')
-            result['scale'] = data['location'].get('@scale')
+        doc = parse_xml(xml_content)
+        if doc.tag == 'msg':
+            location = doc.find('location').attrib
+            result['x'] = location['x']
+            result['y'] = location['y']
+            result['label'] = location.get('label')
+            result['poiname'] = location.get('poiname')
+            result['scale'] = location.get('scale')
     except:
         logger.error(f'位置分享解析错误\n{traceback.format_exc()} \n{xml_content}')
         result.update(
@@ -657,11 +644,10 @@ def parser_reply(xml_content):
         }
     xml_content = xml_content.replace("&#01;", "").replace('&#20;', '')
     try:
-        data = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {})
-        refermsg_type = int(data.get('refermsg', {}).get('type', '1'))
-        title = data.get('title', '')
-        displayname = data.get('refermsg', {}).get('displayname', '')
-        svrid = data.get('refermsg', {}).get('svrid', 0)
+        doc = parse_xml(xml_content)
+        refermsg_type = int(doc.text('appmsg/refermsg/type', '1'))
+        title = doc.text('appmsg/title')
+        svrid = doc.text('appmsg/refermsg/svrid', 0)
         return {
             "text": title,
             'svrid': svrid,
@@ -780,12 +766,12 @@ def parser_transfer(xml_content):
         'receiver_username': ''
     }
     try:
-        data = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {})
+        doc = parse_xml(xml_content)
         result = {
-            'pay_subtype': int(data.get('wcpayinfo', {}).get('paysubtype', '-1')),
-            'pay_memo': data.get('wcpayinfo', {}).get('pay_memo', ''),
-            'fee_desc': data.get('wcpayinfo', {}).get('feedesc', ''),
-            'receiver_username': data.get('wcpayinfo', {}).get('receiver_username', ''),
+            'pay_subtype': int(doc.text('appmsg/wcpayinfo/paysubtype', '-1')),
+            'pay_memo': doc.text('appmsg/wcpayinfo/pay_memo'),
+            'fee_desc': doc.text('appmsg/wcpayinfo/feedesc'),
+            'receiver_username': doc.text('appmsg/wcpayinfo/receiver_username'),
         }
     except:
         logger.error(f'转账解析错误\n{traceback.format_exc()}')
@@ -806,11 +792,11 @@ def parser_red_envelop(xml_content):
         'inner_type': 0
     }
     try:
-        data = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {})
+        doc = parse_xml(xml_content)
         result = {
-            'icon_url': data.get('wcpayinfo', {}).get('iconurl', ''),
-            'title': data.get('wcpayinfo', {}).get('receivertitle', ''),
-            'inner_type': int(data.get('wcpayinfo', {}).get('innertype', '0')),
+            'icon_url': doc.text('appmsg/wcpayinfo/iconurl'),
+            'title': doc.text('appmsg/wcpayinfo/receivertitle'),
+            'inner_type': int(doc.text('appmsg/wcpayinfo/innertype', '0')),
         }
     except:
         logger.error(f'红包解析错误\n{traceback.format_exc()}')
@@ -833,19 +819,16 @@ def parser_file(xml_content):
         'app_name': ''
     }
     try:
-        data0 = xmltodict.parse(xml_content).get('msg', {})
-        data = data0.get('appmsg', {})
-        totallen = data.get('appattach', {}).get('totallen')
-        if isinstance(totallen, list):
-            totallen = totallen[0]
+        doc = parse_xml(xml_content)
+        totallen = doc.text('appmsg/appattach/totallen', None)  # 有多个totallen时取第一个
         if not totallen:
             totallen = '0'
         result = {
-            'file_name': data.get('title', ''),
+            'file_name': doc.text('appmsg/title'),
             'file_size': int(totallen),
-            'md5': data.get('md5', ''),
-            'file_type': data.get('appattach', {}).get('fileext', ''),
-            'app_name': data.get('appinfo', {}).get('appname', ''),
+            'md5': doc.text('appmsg/md5'),
+            'file_type': doc.text('appmsg/appattach/fileext'),
+            'app_name': doc.text('appmsg/appinfo/appname'),
         }
     except:
         logger.error(f'文件解析错误\n{traceback.format_exc()}\n{xml_content}')
@@ -887,14 +870,13 @@ def parser_pat(xml_content):
         'template': ''
     }
     try:
-        data = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {})
-        patinfo = data.get('patinfo', {})
+        doc = parse_xml(xml_content)
         result = {
-            'title': data.get('title', ''),
-            'from_username': patinfo.get('fromusername', ''),
-            'patted_username': patinfo.get('pattedusername', ''),
-            'chat_username': patinfo.get('chatusername', ''),
-            'template': patinfo.get('template', ''),
+            'title': doc.text('appmsg/title'),
+            'from_username': doc.text('appmsg/patinfo/fromusername'),
+            'patted_username': doc.text('appmsg/patinfo/pattedusername'),
+            'chat_username': doc.text('appmsg/patinfo/chatusername'),
+            'template': doc.text('appmsg/patinfo/template'),
         }
     except:
         logger.error(f'拍一拍解析错误\n{traceback.format_exc()}\n{xml_content}')
@@ -907,20 +889,15 @@ if __name__ == '__main__':
 
 
 def wx_sport(xml):
-    dic_data = {}
-    more = ''
     try:
-        dic_data = xmltodict.parse(xml).get('msg', {}).get('appmsg', {})
-        hardwareinfo = dic_data.get('hardwareinfo', {})
-        rankinfo = hardwareinfo.get('messagenodeinfo', {}).get('rankinfo', {})
-        rank = rankinfo.get('rank', {}).get('rankdisplay', '')
-        score = rankinfo.get('score', {}).get('scoredisplay', '')
-        rankinfolist = hardwareinfo.get('rankview', {}).get('rankinfolist', {}).get('rankinfo', [])
+        doc = parse_xml(xml)
+        rank = doc.text('appmsg/hardwareinfo/messagenodeinfo/rankinfo/rank/rankdisplay')
+        score = doc.text('appmsg/hardwareinfo/messagenodeinfo/rankinfo/score/scoredisplay')
         rank_list = []
-        for rank_info in rankinfolist:
-            username = rank_info.get('username', '')
-            rank1 = rank_info.get('rank', {}).get('rankdisplay', '')
-            score1 = rank_info.get('score', {}).get('scoredisplay', '')
+        for rank_info in doc.findall('appmsg/hardwareinfo/rankview/rankinfolist/rankinfo'):
+            username = rank_info.text('username')
+            rank1 = rank_info.text('rank/rankdisplay')
+            score1 = rank_info.text('score/scoredisplay')
             rank_list.append(
                 {
                     'rank': rank1,
@@ -932,11 +909,11 @@ def wx_sport(xml):
             'rank': rank,
             'score': score,
             'rank_list': rank_list,
-            'data': f'{dic_data}'
+            'data': xml
         }
     except:
         logger.error(traceback.format_exc())
-        logger.error(dic_data)
+        logger.error(xml)
         return []
 
 
@@ -1149,29 +1126,24 @@ def wx_pdd_data(bytesExtra, compress_content_):
 
 
 def wx_collection_data(xml):
-    dic_data = {}
     summary = ''
     more = ''
     try:
-        dic_data = xmltodict.parse(xml).get('msg', {}).get('appmsg', {})
-        # logger.error(dic_data)
-        mmreader = dic_data.get('mmreader', {})
-        template_header = mmreader.get('template_header', {})
-        template_detail = mmreader.get('template_detail', {})
-        title = template_header.get('title', '')
-        display_name = template_header.get('display_name', '')
+        doc = parse_xml(xml)
+        title = doc.text('appmsg/mmreader/template_header/title')
+        display_name = doc.text('appmsg/mmreader/template_header/display_name')
         if not title:
-            title = dic_data.get('title', '')
+            title = doc.text('appmsg/title')
         if not display_name:
-            display_name = dic_data.get('title')
-        template_id = dic_data.get('template_id', '')
-        line_content = template_detail.get('line_content', {})
-        money = line_content.get('topline', {}).get('value', {}).get('word', '').strip('￥')
-        lines = line_content.get('lines', {}).get('line')
-        if isinstance(lines, List):
+            display_name = doc.text('appmsg/title', None)
+        template_id = doc.text('appmsg/template_id')
+        line_content = 'appmsg/mmreader/template_detail/line_content/'
+        money = (doc.text(line_content + 'topline/value/word') or '').strip('￥')
+        lines = doc.findall(line_content + 'lines/line')
+        if len(lines) > 1:
             for line in lines:
-                key = line.get('key').get('word')
-                value = line.get('value').get('word')
+                key = line.text('key/word')
+                value = line.text('value/word') or ''
                 if key == '汇总':
                     summary += value
                 elif key == '备注':
@@ -1183,41 +1155,37 @@ def wx_collection_data(xml):
             'template_id': template_id,
             'money': money,
             'summary': summary,
-            'data': f'{dic_data}',
+            'data': xml,
             'more': more
         }
 
     except:
         logger.error(traceback.format_exc())
-        logger.error(dic_data)
+        logger.error(xml)
         return {}
 
 
 def wx_pay_data(xml):
-    dic_data = {}
     more = ''
     try:
-        dic_data = xmltodict.parse(xml).get('msg', {}).get('appmsg', {})
-        # logger.error(dic_data)
-        mmreader = dic_data.get('mmreader', {})
-        template_header = mmreader.get('template_header', {})
-        template_detail = mmreader.get('template_detail', {})
-        title = template_header.get('title', '')
-        display_name = template_header.get('display_name', '')
+        doc = parse_xml(xml)
+        title = doc.text('appmsg/mmreader/template_header/title')
+        display_name = doc.text('appmsg/mmreader/template_header/display_name')
         if not title:
-            title = dic_data.get('title', '')
+            title = doc.text('appmsg/title')
         if not display_name:
-            display_name = dic_data.get('title')
-        template_id = dic_data.get('template_id', '')
-        line_content = template_detail.get('line_content', {})
-        money = line_content.get('topline', {}).get('value', {}).get('word', '').strip('￥')
-        lines = line_content.get('lines', {}).get('line')
+            display_name = doc.text('appmsg/title', None)
+        template_id = doc.text('appmsg/template_id')
+        line_content = 'appmsg/mmreader/template_detail/line_content/'
+        money = (doc.text(line_content + 'topline/value/word') or '').strip('￥')
+        lines = doc.findall(line_content + 'lines/line')
         payment_type = ''
         acquiring_institution = ''
-        if isinstance(lines, List):
+        # 只有一行明细时是个体商户的收款
+        if len(lines) > 1:
             for line in lines:
-                key = line.get('key').get('word')
-                value = line.get('value').get('word')
+                key = line.text('key/word')
+                value = line.text('value/word') or ''
                 if key == '付款方式' or key == '支付方式' or key == '收款账户' or key == '退款方式':
                     payment_type = value
                 elif key == '收单机构' or key == '收款方':
@@ -1229,7 +1197,7 @@ def wx_pay_data(xml):
                 elif key == '备注' or key == '退款原因':
                     more += value
         else:
-            payment_type = line_content.get('topline', {}).get('key', {}).get('word', '')
+            payment_type = doc.text(line_content + 'topline/key/word')
             acquiring_institution = '个体商户'
         return {
             'title': title,
@@ -1238,10 +1206,10 @@ def wx_pay_data(xml):
             'money': money,
             'payment_type': payment_type,
             'acquiring_institution': acquiring_institution,
-            'data': f'{dic_data}',
+            'data': xml,
             'more': more
         }
     except:
         logger.error(traceback.format_exc())
-        logger.error(dic_data)
+        logger.error(xml)
         return {}
@@ -9,9 +9,41 @@
 @Description : 
 """
 
+import os
 import re
 
 
+class DirListing:
+    """
+    批量判断文件是否存在，同一个目录查得多了就把目录下的文件名一次列出来，比逐个os.path.exists少很多系统调用
+    只在解析一批消息时临时使用，不能长期保存，否则之后才下载的文件会判断不到
+    """
+
+    def __init__(self, list_after=8):
+        """
+        @param list_after: 同一个目录查询超过这么多次后才列出整个目录，只查几个文件时列目录反而更慢
+        """
+        self.list_after = list_after
+        self._names = {}  # 目录 -> 目录下的文件名
+        self._lookups = {}  # 目录 -> 还没列目录时的查询次数
+
+    def exists(self, path) -> bool:
+        directory, name = os.path.split(path)
+        names = self._names.get(directory)
+        if names is None:
+            lookups = self._lookups.get(directory, 0) + 1
+            self._lookups[directory] = lookups
+            if lookups <= self.list_after:
+                return os.path.exists(path)
+            try:
+                # Windows不区分大小写，统一转换后再比较
+                names = {os.path.normcase(file) for file in os.listdir(directory or '.')}
+            except OSError:
+                names = set()
+            self._names[directory] = names
+        return os.path.normcase(name) in names
+
+
 def remove_privacy_info(text):
     # 正则表达式模式
     patterns = {
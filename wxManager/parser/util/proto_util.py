@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/10 21:15
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-proto_util.py
+@Description : 消息packed_info_data、联系人ContactInfo等protobuf字段的读取，直接访问_pb2对象的属性，不再转成dict
+"""
+from google.protobuf.message import DecodeError
+
+from wxManager.parser.util.protocbuf import contact_pb2, emoji_desc_pb2, file_info_pb2, packed_info_data_pb2, \
+    packed_info_data_img_pb2, packed_info_data_img2_pb2, packed_info_data_merged_pb2
+from wxManager.parser.util.protocbuf.msg_pb2 import MessageBytesExtra
+
+
+def parse_proto(message_class, data):
+    """
+    @param message_class: _pb2中的消息类
+    @param data: protobuf二进制数据
+    @return: 解析后的对象，数据为空或者和schema不匹配时返回None
+    """
+    if not data:
+        return None
+    try:
+        return message_class.FromString(data)
+    except (DecodeError, TypeError):
+        return None
+
+
+def get_image_filename(packed_info_data) -> str:
+    """
+    图片的文件名，先按4.0.3正式版的格式解析，没有再按测试版的格式解析
+    @param packed_info_data: 消息的packed_info_data
+    @return:
+    """
+    proto = parse_proto(packed_info_data_img2_pb2.PackedInfoDataImg2, packed_info_data)
+    if proto is not None:
+        filename = proto.imageInfo.filename.strip().strip('"').strip()
+        if filename:
+            return filename
+    proto = parse_proto(packed_info_data_img_pb2.PackedInfoDataImg, packed_info_data)
+    if proto is not None:
+        return proto.filename.strip().strip('"').strip()
+    return ''
+
+
+def get_video_filename(packed_info_data) -> str:
+    proto = parse_proto(packed_info_data_img2_pb2.PackedInfoDataImg2, packed_info_data)
+    if proto is None:
+        return ''
+    return proto.videoInfo.filename.strip().strip('"').strip()
+
+
+def get_file_filename(packed_info_data) -> str:
+    proto = parse_proto(packed_info_data_img2_pb2.PackedInfoDataImg2, packed_info_data)
+    if proto is None:
+        return ''
+    return proto.fileInfo.fileInfo.filename.strip()
+
+
+def get_audio_text(packed_info_data) -> str:
+    """
+    语音转文字的结果
+    """
+    proto = parse_proto(packed_info_data_pb2.PackedInfoData, packed_info_data)
+    if proto is None:
+        return ''
+    return proto.info.audioTxt
+
+
+def get_merged_dir(packed_info_data) -> str:
+    """
+    合并转发的聊天记录中图片、视频等文件所在的目录
+    """
+    proto = parse_proto(packed_info_data_merged_pb2.PackedInfoData, packed_info_data)
+    if proto is None:
+        return ''
+    return proto.info.dir
+
+
+def get_file_dir(extra_buffer) -> str:
+    """
+    hardlink数据库extra_buffer中记录的第三级目录
+    """
+    proto = parse_proto(file_info_pb2.FileInfoData, extra_buffer)
+    if proto is None:
+        return ''
+    return proto.dir3
+
+
+def get_emoji_desc(data) -> str:
+    """
+    表情包描述，取第一个不为空的语言
+    """
+    proto = parse_proto(emoji_desc_pb2.EmojiDescData, data)
+    if proto is None:
+        return ''
+    for item in proto.descItem:
+        if item.desc:
+            return item.desc
+    return ''
+
+
+def get_bytes_extra_sender(bytes_extra) -> str:
+    """
+    3.x群聊消息BytesExtra中记录的发送者wxid
+    """
+    proto = parse_proto(MessageBytesExtra, bytes_extra)
+    if proto is None:
+        return ''
+    wxid = ''
+    for item in proto.message2:
+        if item.field1 == 1:
+            wxid = item.field2
+    # todo 解析还是有问题，会出现这种带:的东西
+    if ':' in wxid:  # wxid_ewi8gfgpp0eu22:25319:1
+        wxid = wxid.split(':')[0]
+    return wxid
+
+
+def parse_contact_info(data) -> contact_pb2.ContactInfo | None:
+    return parse_proto(contact_pb2.ContactInfo, data)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from google.protobuf.json_format import MessageToDict
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    image = packed_info_data_img2_pb2.PackedInfoDataImg2(field1=1, field2=2)
+    image.imageInfo.height = 1080
+    image.imageInfo.width = 1920
+    image.imageInfo.filename = '0123456789abcdef0123456789abcdef'
+    image_data = image.SerializeToString()
+    old_image_data = packed_info_data_img_pb2.PackedInfoDataImg(field1=1, field2=2,
+                                                                filename='fedcba9876543210').SerializeToString()
+    contact = contact_pb2.ContactInfo(gender=1, signature='自助者天助', country='CN', province='Shaanxi', city="Xi'an",
+                                      label_list='1,2,3')
+    contact_data = contact.SerializeToString()
+
+    def image_filename_by_dict(data):
+        # 改之前的做法：两种schema各转一次dict
+        filename = ''
+        try:
+            proto = packed_info_data_img2_pb2.PackedInfoDataImg2()
+            proto.ParseFromString(data)
+            filename = MessageToDict(proto).get('imageInfo', {}).get('filename', '').strip().strip('"').strip()
+        except DecodeError:
+            pass
+        if not filename:
+            proto = packed_info_data_img_pb2.PackedInfoDataImg()
+            proto.ParseFromString(data)
+            filename = MessageToDict(proto).get('filename', '').strip().strip('"').strip()
+        return filename
+
+    for name, data in (('图片(4.0.3)', image_data), ('图片(测试版)', old_image_data)):
+        assert image_filename_by_dict(data) == get_image_filename(data)
+        st = time.perf_counter()
+        for _ in range(num):
+            image_filename_by_dict(data)
+        old_seconds = time.perf_counter() - st
+        st = time.perf_counter()
+        for _ in range(num):
+            get_image_filename(data)
+        print(f'{name} {num}条 MessageToDict：{old_seconds:.2f}s  直接读取字段：{time.perf_counter() - st:.2f}s')
+
+    st = time.perf_counter()
+    for _ in range(num):
+        proto = contact_pb2.ContactInfo()
+        proto.ParseFromString(contact_data)
+        detail = MessageToDict(proto)
+        detail.get('gender', 0), detail.get('signature', ''), detail.get('labelList', '')
+    old_seconds = time.perf_counter() - st
+    st = time.perf_counter()
+    for _ in range(num):
+        proto = parse_contact_info(contact_data)
+        proto.gender, proto.signature, proto.label_list
+    print(f'联系人 {num}个 MessageToDict：{old_seconds:.2f}s  直接读取字段：{time.perf_counter() - st:.2f}s')
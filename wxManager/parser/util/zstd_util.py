@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/8 14:05
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-zstd_util.py
+@Description : 微信4.0消息内容（message_content）的zstd解压，每个线程复用解压对象，支持训练好的字典
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable
+
+import zstandard as zstd
+
+from wxManager.log import logger
+
+# 训练好的zstd字典，key为字典id，压缩帧头里记录了用到的字典id
+_dictionaries = {}
+_local = threading.local()
+
+# 数据库目录下存放字典的位置：zstd_dict目录中的所有文件，以及任意位置的*.zdict文件
+DICTIONARY_DIR = 'zstd_dict'
+DICTIONARY_SUFFIX = '.zdict'
+
+
+def register_dictionary(data: bytes) -> int:
+    """
+    注册一个zstd字典，之后遇到使用该字典压缩的数据会自动用它解压
+    @param data: 字典文件的内容
+    @return: 字典id
+    """
+    dictionary = zstd.ZstdCompressionDict(data)
+    dict_id = dictionary.dict_id()
+    _dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def load_dictionaries(db_dir) -> int:
+    """
+    加载数据库目录中的zstd字典，没有字典时什么都不做
+    @param db_dir:
+    @return: 加载的字典个数
+    """
+    paths = []
+    dict_dir = os.path.join(db_dir, DICTIONARY_DIR)
+    if os.path.isdir(dict_dir):
+        paths.extend(os.path.join(dict_dir, name) for name in os.listdir(dict_dir))
+    for root, _, files in os.walk(db_dir):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(DICTIONARY_SUFFIX))
+    num = 0
+    for path in sorted(set(paths)):
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, 'rb') as f:
+                register_dictionary(f.read())
+            num += 1
+        except (OSError, zstd.ZstdError):
+            logger.error(f'zstd字典加载失败：{path}')
+    return num
+
+
+def get_decompressor(dict_id=0) -> zstd.ZstdDecompressor:
+    """
+    当前线程的解压对象，每个线程每个字典只创建一次
+    ZstdDecompressor不是线程安全的，不能跨线程共用
+    @param dict_id: 0表示不使用字典
+    @return:
+    """
+    decompressors = getattr(_local, 'decompressors', None)
+    if decompressors is None:
+        decompressors = _local.decompressors = {}
+    dctx = decompressors.get(dict_id)
+    if dctx is None:
+        if dict_id:
+            dctx = zstd.ZstdDecompressor(dict_data=_dictionaries[dict_id])
+        else:
+            dctx = zstd.ZstdDecompressor()
+        decompressors[dict_id] = dctx
+    return dctx
+
+
+def decompress_bytes(data: bytes) -> bytes:
+    """
+    解压一段zstd数据，使用了字典时自动选择已注册的字典，失败时抛出zstd.ZstdError
+    """
+    try:
+        return get_decompressor().decompress(data)
+    except zstd.ZstdError:
+        if not _dictionaries:
+            raise
+        dict_id = zstd.get_frame_parameters(data).dict_id
+        if dict_id not in _dictionaries:
+            raise
+        return get_decompressor(dict_id).decompress(data)
+
+
+def _decode(data: bytes) -> str:
+    try:
+        return decompress_bytes(data).strip(b'\x00').strip().decode('utf-8').strip()
+    except:
+        return ''
+
+
+def decompress_text(data: bytes) -> str:
+    """
+    解压并解码成字符串，失败返回空字符串
+    在prefetched(...)的范围内，已经用decompress_many解压过的数据直接返回结果
+    """
+    for texts in reversed(getattr(_local, 'prefetched', ())):
+        text = texts.get(data)
+        if text is not None:
+            return text
+    return _decode(data)
+
+
+def decompress_many(blobs: Iterable[bytes]) -> Dict[bytes, str]:
+    """
+    批量解压一批消息的内容，不修改线程状态，配合prefetched使用
+    一条消息的内容会在预取引用消息、解析公共属性等多个地方用到，批量解压后每条只解压一次
+    @param blobs:
+    @return: {压缩数据: 字符串}
+    """
+    texts = {}
+    for data in blobs:
+        if data not in texts:
+            texts[data] = _decode(data)
+    return texts
+
+
+@contextmanager
+def prefetched(texts: Dict[bytes, str]):
+    """
+    在with范围内decompress_text优先使用texts中的结果
+    可以嵌套（如解析一批消息时又去解析被引用的消息），退出时只移除自己的结果，外层的结果不受影响
+    with prefetched(decompress_many(blobs)):
+        ...
+    @param texts: decompress_many的返回值
+    """
+    stack = getattr(_local, 'prefetched', None)
+    if stack is None:
+        stack = _local.prefetched = []
+    stack.append(texts)
+    try:
+        yield texts
+    finally:
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is texts:
+                del stack[i]
+                break
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import time
+
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(0)
+    words = ['hello', 'world', '微信', '消息', '<msg>', '</msg>', '<appmsg>', '<title>', '<refermsg>', 'svrid']
+    cctx = zstd.ZstdCompressor()
+    blobs = [cctx.compress(' '.join(random.choices(words, k=random.randint(5, 200))).encode('utf-8'))
+             for _ in range(num)]
+
+    st = time.perf_counter()
+    expected = [zstd.ZstdDecompressor().decompress(data).strip(b'\x00').strip().decode('utf-8').strip()
+                for data in blobs]
+    print(f'{num}条，每条新建ZstdDecompressor：{time.perf_counter() - st:.2f}s')
+    st = time.perf_counter()
+    result = [decompress_text(data) for data in blobs]
+    print(f'{num}条，复用线程内的解压对象：{time.perf_counter() - st:.2f}s')
+    assert result == expected
+    st = time.perf_counter()
+    for i in range(0, num, 1000):
+        with prefetched(decompress_many(blobs[i:i + 1000])):
+            for data in blobs[i:i + 1000]:
+                decompress_text(data)
+                decompress_text(data)  # 引用消息预取和解析各用一次
+    print(f'{num}条，按批decompress_many后读取两次：{time.perf_counter() - st:.2f}s')
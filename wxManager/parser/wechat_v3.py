@@ -10,20 +10,22 @@
 """
 import hashlib
 import os
+import threading
 from abc import ABC, abstractmethod
 import lz4.block
-import xmltodict
 
 from wxManager.model.message import BusinessCardMessage, VoipMessage, MergedMessage, WeChatVideoMessage, \
     PositionMessage, TransferMessage, RedEnvelopeMessage, FavNoteMessage, PatMessage
 from wxManager.parser.link_parser import parser_link, parser_applet, parser_business, parser_voip, \
     parser_merged_messages, parser_wechat_video, parser_position, parser_reply, parser_transfer, parser_red_envelop, \
     parser_file, parser_favorite_note, parser_pat, parser_music
-from wxManager.parser.util.protocbuf.msg_pb2 import MessageBytesExtra
-from wxManager.parser.wechat_v4 import LimitedDict
+from wxManager.parser.util.proto_util import get_bytes_extra_sender
+from wxManager.parser.wechat_v4 import REFER_SVRID_PATTERN
+from wxManager.parser.xml_parser import parse_xml
 from .audio_parser import parser_audio
 from .emoji_parser import parser_emoji
 from .file_parser import parse_video
+from wxManager.cache import LRUCache
 from wxManager.log import logger
 from wxManager.model import Message, TextMessage, ImageMessage, VideoMessage, EmojiMessage, LinkMessage, FileMessage, \
     AudioMessage, QuoteMessage, MessageType
@@ -60,6 +62,10 @@ def decompress(data):
     return decoded_string
 
 
+# 按类型分组批量解析时，当前线程这一批已经解析的消息 {server_id: Message}
+_batch = threading.local()
+
+
 # 定义抽象工厂基类
 class MessageFactory(ABC):
     @abstractmethod
@@ -73,12 +79,24 @@ class MessageFactory(ABC):
         """
         pass
 
+    def create_batch(self, messages, username: str, database_manager: DataBaseInterface) -> list:
+        """
+        创建一组同类型的Message实例，联系人查询等可以共用的工作一组只做一次
+        默认逐条调用create，有可以合并的查询的类型重写这个方法
+        @param messages: 从数据库获得的元组数据，类型都交给这个工厂
+        @param username: 聊天对象的wxid
+        @param database_manager: 数据库管理接口
+        @return: 和messages一一对应的Message
+        """
+        return [self.create(message, username, database_manager) for message in messages]
+
 
 # 单例基类
 class Singleton:
     _instances = {}
-    contacts = {}
-    messages = LimitedDict(100)
+    contacts = LRUCache('v3.contacts', maxsize=10000)
+    messages = LRUCache('v3.messages', maxsize=100)  # 最近解析的消息
+    quoted_messages = LRUCache('v3.quoted_messages', maxsize=5000)  # 批量预取的被引用消息
 
     def __new__(cls, *args, **kwargs):
         if cls not in cls._instances:
@@ -106,6 +124,20 @@ class Singleton:
             cls.contacts[wxid] = contact
             return contact
 
+    def common_attributes(self, messages, username, manager):
+        """
+        一组消息的公共属性，每个发送者只查一次联系人
+        :return: [(is_sender, wxid, xml_content, contact)]
+        """
+        senders = {}
+        results = []
+        for message in messages:
+            is_sender, wxid, xml_content = self.common_attribute(message, username, manager)
+            if wxid not in senders:
+                senders[wxid] = self.contacts[wxid]
+            results.append((is_sender, wxid, xml_content, senders[wxid]))
+        return results
+
     def common_attribute(self, message, username, manager):
         """
 
@@ -120,15 +152,7 @@ class Singleton:
             wxid = Me().wxid
         else:
             if username.endswith('@chatroom'):
-                msgbytes = MessageBytesExtra()
-                msgbytes.ParseFromString(message[10])
-                for tmp in msgbytes.message2:
-                    if tmp.field1 != 1:
-                        continue
-                    wxid = tmp.field2
-                # todo 解析还是有问题，会出现这种带:的东西
-                if ':' in wxid:  # wxid_ewi8gfgpp0eu22:25319:1
-                    wxid = wxid.split(':')[0]
+                wxid = get_bytes_extra_sender(message[10])
             else:
                 wxid = username
         if wxid not in self.contacts:
@@ -144,14 +168,19 @@ class Singleton:
     def get_message_by_server_id(cls, server_id, username, manager):
         if server_id and isinstance(server_id, str):
             server_id = int(server_id)
+        batch_messages = getattr(_batch, 'messages', None)
+        if batch_messages and server_id in batch_messages:
+            return batch_messages[server_id]
         if server_id in cls.messages:
             return cls.messages.get(server_id)
+        if server_id in cls.quoted_messages:
+            msg = cls.quoted_messages.get(server_id)  # 已经批量预取过，None表示数据库中没有这条消息
         else:
-            msg = manager.get_message_by_server_id(username, server_id)  # todo 非常耗时
+            msg = manager.get_message_by_server_id(username, server_id)
             if msg:
                 cls.add_message(msg)
-            else:
-                msg = TextMessage(
+        if not msg:
+            msg = TextMessage(
                     local_id=0,
                     server_id=0,
                     sort_seq=0,
@@ -167,16 +196,83 @@ class Singleton:
                     xml_content='',
                     content='无效的消息'
                 )
-            return msg
+        return msg
+
+    @classmethod
+    def prefetch_quote_messages(cls, messages, username, manager, batch=False):
+        """
+        找出一批消息里引用的所有消息，按server_id批量查询并解析，之后解析引用消息时直接命中缓存
+        @param messages: 数据库中查出的原始数据
+        @param username:
+        @param manager:
+        @param batch: 这一批是否按类型分组批量解析，分组解析时同一批中前面的消息都能直接取到
+        @return:
+        """
+        server_ids = set()
+        # 同一批中刚解析过的消息还在缓存里，不用再查
+        window = len(messages) if batch else cls.messages.maxsize
+        positions = {message[9]: i for i, message in enumerate(messages)}
+        for i, message in enumerate(messages):
+            content = cls.get_quote_content(message, username)
+            match = REFER_SVRID_PATTERN.search(content) if content else None
+            if match:
+                server_id = int(match.group(1))
+                if 0 < i - positions.get(server_id, i) < window:
+                    continue
+                if server_id in cls.messages or server_id in cls.quoted_messages:
+                    continue
+                server_ids.add(server_id)
+        if not server_ids:
+            return
+        quoted_messages = manager.get_messages_by_server_ids(username, server_ids)
+        for server_id in server_ids:
+            cls.quoted_messages[server_id] = quoted_messages.get(server_id)
+
+    @staticmethod
+    def get_quote_content(message, username):
+        """引用消息的xml，不是引用消息返回空字符串"""
+        if message[2] != 49:
+            return ''
+        if username.endswith('@openim'):
+            return message[7]
+        if message[3] != 57:
+            return ''
+        return decompress(message[11])
 
     @classmethod
     def reset_messages(cls):
-        cls.messages = {}
+        cls.messages.clear()
 
     @classmethod
     def add_message(cls, message: Message):
         if message:
-            cls.messages[message.server_id] = message
+            batch_messages = getattr(_batch, 'messages', None)
+            if batch_messages is not None:
+                batch_messages[message.server_id] = message
+            else:
+                cls.messages[message.server_id] = message
+
+    @classmethod
+    def start_batch(cls):
+        """
+        开始分组批量解析一批消息，之后解析的消息先记在当前线程，不进缓存
+        @return: 外层正在解析的批次，finish_batch时恢复（解析引用消息时可能嵌套查库解析）
+        """
+        outer = getattr(_batch, 'messages', None)
+        _batch.messages = {}
+        return outer
+
+    @classmethod
+    def finish_batch(cls, messages, outer=None):
+        """
+        @param messages: 这一批的解析结果，按原来的顺序
+        @param outer: start_batch的返回值
+        @return:
+        """
+        _batch.messages = outer
+        # 和逐条解析一样，最后解析的消息留给下一批的引用消息使用
+        for message in messages[-cls.messages.maxsize:]:
+            cls.add_message(message)
 
 
 class UnknownMessageFactory(MessageFactory, Singleton):
@@ -201,30 +297,37 @@ class UnknownMessageFactory(MessageFactory, Singleton):
 
 class TextMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, xml_content = self.common_attribute(message, username, manager)
-        sub_type = parser_sub_type(message[7]) if username.endswith('@openim') else message[3]
-        if sub_type == 1:
-            content = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {}).get('title', '')
-        else:
-            content = message[7]
-        msg = TextMessage(
-            local_id=message[0],
-            server_id=message[9],
-            sort_seq=message[5],
-            timestamp=message[5],
-            str_time=message[8],
-            type=MessageType.Text,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=wxid,
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[6],
-            xml_content='',
-            content=content
-        )
-        self.add_message(msg)
-        return msg
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        is_openim = username.endswith('@openim')
+        for message, (is_sender, wxid, xml_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            sub_type = parser_sub_type(message[7]) if is_openim else message[3]
+            if sub_type == 1:
+                content = parse_xml(xml_content).text('appmsg/title')
+            else:
+                content = message[7]
+            msg = TextMessage(
+                local_id=message[0],
+                server_id=message[9],
+                sort_seq=message[5],
+                timestamp=message[5],
+                str_time=message[8],
+                type=MessageType.Text,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=wxid,
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[6],
+                xml_content='',
+                content=content
+            )
+            self.add_message(msg)
+            results.append(msg)
+        return results
 
 
 class ImageMessageFactory(MessageFactory, Singleton):
@@ -265,37 +368,47 @@ class ImageMessageFactory(MessageFactory, Singleton):
 
 class AudioMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, xml_content = self.common_attribute(message, username, manager)
-        msg = AudioMessage(
-            local_id=message[0],
-            server_id=message[9],
-            sort_seq=message[5],
-            timestamp=message[5],
-            str_time=message[8],
-            type=MessageType.Audio,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=wxid,
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[6],
-            xml_content=xml_content,
-            md5='',
-            path='',
-            file_size=0,
-            file_name='',
-            file_type='mp3',
-            audio_text='',
-            duration=0
-        )
-        msg.set_file_name()
-        audio_dic = parser_audio(msg.xml_content)
-        msg.duration = audio_dic.get('audio_length', 0)
-        msg.audio_text = audio_dic.get('audio_text', '')
-        if not msg.audio_text:
-            msg.audio_text = manager.get_audio_text(msg.server_id)
-        self.add_message(msg)
-        return msg
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        for message, (is_sender, wxid, xml_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            msg = AudioMessage(
+                local_id=message[0],
+                server_id=message[9],
+                sort_seq=message[5],
+                timestamp=message[5],
+                str_time=message[8],
+                type=MessageType.Audio,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=wxid,
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[6],
+                xml_content=xml_content,
+                md5='',
+                path='',
+                file_size=0,
+                file_name='',
+                file_type='mp3',
+                audio_text='',
+                duration=0
+            )
+            msg.set_file_name()
+            audio_dic = parser_audio(msg.xml_content)
+            msg.duration = audio_dic.get('audio_length', 0)
+            msg.audio_text = audio_dic.get('audio_text', '')
+            results.append(msg)
+        # 消息里没有转文字结果的，一起到语音转文字的数据库里查
+        server_ids = [msg.server_id for msg in results if not msg.audio_text]
+        audio_texts = manager.audio2text_db.get_audio_texts(server_ids) if server_ids else {}
+        for msg in results:
+            if not msg.audio_text:
+                msg.audio_text = audio_texts.get(msg.server_id, '')
+            self.add_message(msg)
+        return results
 
 
 class VideoMessageFactory(MessageFactory, Singleton):
@@ -387,10 +500,9 @@ def parser_sub_type(xml_content):
     """
     sub_type = 0
     try:
-        data = xmltodict.parse(xml_content)
-        if data and data.get('msg'):
-            data = data['msg']['appmsg']
-            sub_type = int(data['type'])
+        doc = parse_xml(xml_content)
+        if doc.tag == 'msg':
+            sub_type = int(doc.text('appmsg/type', None))
     except:
         sub_type = 0
     return sub_type
@@ -703,7 +815,7 @@ class SystemMessageFactory(MessageFactory, Singleton):
         sub_type = parser_sub_type(message[7]) if username.endswith('@openim') else message[3]
         if sub_type == 17:
             xml_content = decompress(message[11])
-            content = xmltodict.parse(xml_content).get('msg', {}).get('appmsg', {}).get('title', '')
+            content = parse_xml(xml_content).text('appmsg/title')
         else:
             content = message[7]
         msg = TextMessage(
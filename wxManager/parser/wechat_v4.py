@@ -11,24 +11,27 @@
 import hashlib
 import html
 import os.path
-from collections import OrderedDict
+import re
+import threading
 
 from abc import ABC, abstractmethod
+from functools import partial
 
-import xmltodict
-import zstandard as zstd
-from google.protobuf.json_format import MessageToDict
 
 from wxManager.model.message import VoipMessage, BusinessCardMessage, MergedMessage, WeChatVideoMessage, \
     PositionMessage, TransferMessage, RedEnvelopeMessage, FavNoteMessage, PatMessage
 from wxManager.parser.link_parser import parser_link, parser_voip, parser_applet, parser_business, \
     parser_merged_messages, parser_wechat_video, parser_position, parser_reply, parser_transfer, parser_red_envelop, \
     parser_file, parser_favorite_note, parser_pat
-from wxManager.parser.util.protocbuf import packed_info_data_pb2, packed_info_data_merged_pb2, packed_info_data_img_pb2, \
-    packed_info_data_img2_pb2
+from wxManager.parser.util.common import DirListing
+from wxManager.parser.util.proto_util import get_image_filename, get_video_filename, get_file_filename, \
+    get_audio_text, get_merged_dir
+from wxManager.parser.util.zstd_util import decompress_text
+from wxManager.parser.xml_parser import parse_xml
 from .audio_parser import parser_audio
 from .emoji_parser import parser_emoji
 from .file_parser import parse_video
+from wxManager.cache import LRUCache
 from wxManager.log import logger
 from wxManager.model import *
 from wxManager.model import Me
@@ -37,48 +40,40 @@ from ..db_main import DataBaseInterface
 '''
 local_id,server_id,local_type,sort_seq,sender_username,
 create_time,StrTime,status,upload_status,server_seq,origin_source,
-source,message_content,compress_content"
+source,message_content,compress_content,packed_info_data"
+公众号消息（biz_message）没有packed_info_data
 '''
 
 
 def decompress(data):
-    try:
-        dctx = zstd.ZstdDecompressor()  # 创建解压对象
-        x = dctx.decompress(data).strip(b'\x00').strip()
-        return x.decode('utf-8').strip()
-    except:
-        return ''
+    # 复用线程内的解压对象，同一批中已经批量解压过的直接取结果
+    return decompress_text(data)
 
 
-class LimitedDict:
-    # 数据缓存，最多存储k条数据，超出自动删除
-    def __init__(self, k):
-        self.k = k
-        self.messages = OrderedDict()
+def get_packed_info_data(message) -> bytes:
+    """
+    消息的packed_info_data，公众号消息的查询结果没有这一列时返回b''
+    @param message: 从数据库获得的元组数据
+    @return:
+    """
+    return message[14] if len(message) > 14 else b''
 
-    def __setitem__(self, key, value):
-        if key in self.messages:
-            # 如果键已存在，先删除再插入
-            del self.messages[key]
-        elif len(self.messages) >= self.k:
-            # 超过限制，删除最早插入的项
-            self.messages.popitem(last=False)
-        self.messages[key] = value
 
-    def __getitem__(self, key):
-        return self.messages[key]
+# 按类型分组批量解析时，当前线程这一批已经解析的消息 {server_id: Message}
+_batch = threading.local()
 
-    def __delitem__(self, key):
-        del self.messages[key]
+# 引用消息xml中被引用消息的server_id
+REFER_SVRID_PATTERN = re.compile(r'<refermsg>.*?<svrid>\s*(\d+)\s*</svrid>', re.S)
 
-    def __contains__(self, key):
-        return key in self.messages
-
-    def __repr__(self):
-        return repr(self.messages)
-
-    def get(self, key):
-        return self.messages.get(key)
+# 工厂解析后消息的type和数据库中local_type不一致的类型，延迟解析时元数据要和完整解析的结果一样
+LAZY_TYPE_MAP = {
+    MessageType.LinkMessage2: MessageType.LinkMessage,
+    MessageType.LinkMessage4: MessageType.LinkMessage,
+    MessageType.LinkMessage5: MessageType.LinkMessage,
+    MessageType.LinkMessage6: MessageType.LinkMessage,
+    MessageType.Applet2: MessageType.Applet,
+    MessageType.OpenIMBCard: MessageType.BusinessCard,
+}
 
 
 # 定义抽象工厂基类
@@ -94,12 +89,24 @@ class MessageFactory(ABC):
         """
         pass
 
+    def create_batch(self, messages, username: str, database_manager: DataBaseInterface) -> list:
+        """
+        创建一组同类型的Message实例，联系人、文件路径查询等可以共用的工作一组只做一次
+        默认逐条调用create，有可以合并的查询的类型重写这个方法
+        @param messages: 从数据库获得的元组数据，类型都交给这个工厂
+        @param username: 聊天对象的wxid
+        @param database_manager: 数据库管理接口
+        @return: 和messages一一对应的Message
+        """
+        return [self.create(message, username, database_manager) for message in messages]
+
 
 # 单例基类
 class Singleton:
     _instances = {}
-    contacts = {}
-    messages = LimitedDict(100)
+    contacts = LRUCache('v4.contacts', maxsize=10000)
+    messages = LRUCache('v4.messages', maxsize=100)  # 最近解析的消息
+    quoted_messages = LRUCache('v4.quoted_messages', maxsize=5000)  # 批量预取的被引用消息
 
     def __new__(cls, *args, **kwargs):
         if cls not in cls._instances:
@@ -149,14 +156,19 @@ class Singleton:
             return msg
         if server_id and isinstance(server_id, str):
             server_id = int(server_id)
+        batch_messages = getattr(_batch, 'messages', None)
+        if batch_messages and server_id in batch_messages:
+            return batch_messages[server_id]
         if server_id in cls.messages:
             return cls.messages.get(server_id)
+        if server_id in cls.quoted_messages:
+            msg = cls.quoted_messages.get(server_id)  # 已经批量预取过，None表示数据库中没有这条消息
         else:
-            msg = manager.get_message_by_server_id(username, server_id)  # todo 非常耗时
+            msg = manager.get_message_by_server_id(username, server_id)
             if msg:
                 cls.add_message(msg)
-            else:
-                msg = TextMessage(
+        if not msg:
+            msg = TextMessage(
                     local_id=0,
                     server_id=0,
                     sort_seq=0,
@@ -172,16 +184,95 @@ class Singleton:
                     xml_content='',
                     content='无效的消息'
                 )
-            return msg
+        return msg
+
+    @classmethod
+    def prefetch_quote_messages(cls, messages, username, manager, batch=False):
+        """
+        找出一批消息里引用的所有消息，按server_id批量查询并解析，之后解析引用消息时直接命中缓存
+        @param messages: 数据库中查出的原始数据
+        @param username:
+        @param manager:
+        @param batch: 这一批是否按类型分组批量解析，分组解析时同一批中前面的消息都能直接取到
+        @return:
+        """
+        server_ids = set()
+        # 同一批中刚解析过的消息还在缓存里，不用再查
+        window = len(messages) if batch else cls.messages.maxsize
+        positions = {message[1]: i for i, message in enumerate(messages)}
+        for i, message in enumerate(messages):
+            content = cls.get_quote_content(message, username)
+            match = REFER_SVRID_PATTERN.search(content) if content else None
+            if match:
+                server_id = int(match.group(1))
+                if 0 < i - positions.get(server_id, i) < window:
+                    continue
+                if server_id in cls.messages or server_id in cls.quoted_messages:
+                    continue
+                server_ids.add(server_id)
+        if not server_ids:
+            return
+        quoted_messages = manager.get_messages_by_server_ids(username, server_ids)
+        for server_id in server_ids:
+            cls.quoted_messages[server_id] = quoted_messages.get(server_id)
+
+    @staticmethod
+    def get_quote_content(message, username):
+        """引用消息的xml，不是引用消息返回空字符串"""
+        if message[2] != MessageType.Quote:
+            return ''
+        if isinstance(message[12], bytes):
+            return decompress(message[12])
+        return message[12]
 
     @classmethod
     def reset_messages(cls):
-        cls.messages = {}
+        cls.messages.clear()
 
     @classmethod
     def add_message(cls, message: Message):
         if message:
-            cls.messages[message.server_id] = message
+            batch_messages = getattr(_batch, 'messages', None)
+            if batch_messages is not None:
+                batch_messages[message.server_id] = message
+            else:
+                cls.messages[message.server_id] = message
+
+    @classmethod
+    def start_batch(cls):
+        """
+        开始分组批量解析一批消息，之后解析的消息先记在当前线程，不进缓存
+        @return: 外层正在解析的批次，finish_batch时恢复（解析引用消息时可能嵌套查库解析）
+        """
+        outer = getattr(_batch, 'messages', None)
+        _batch.messages = {}
+        return outer
+
+    @classmethod
+    def finish_batch(cls, messages, outer=None):
+        """
+        @param messages: 这一批的解析结果，按sort_seq排好序
+        @param outer: start_batch的返回值
+        @return:
+        """
+        _batch.messages = outer
+        # 和逐条解析一样，最后解析的消息留给下一批的引用消息使用
+        for message in messages[-cls.messages.maxsize:]:
+            cls.add_message(message)
+
+    def common_attributes(self, messages, username, manager):
+        """
+        一组消息的公共属性，每个发送者只查一次联系人
+        @return: [(is_sender, wxid, message_content, contact)]
+        """
+        senders = {}
+        results = []
+        for message in messages:
+            is_sender, wxid, message_content = self.common_attribute(message, username, manager)
+            if wxid not in senders:
+                senders[wxid] = self.contacts[wxid]
+            results.append((is_sender, wxid, message_content, senders[wxid]))
+        return results
 
     def common_attribute(self, message, username, manager):
         is_sender = message[4] == Me().wxid
@@ -228,189 +319,184 @@ class UnknownMessageFactory(MessageFactory, Singleton):
 
 class TextMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, message_content = self.common_attribute(message, username, manager)
-        msg = TextMessage(
-            local_id=message[0],
-            server_id=message[1],
-            sort_seq=message[3],
-            timestamp=message[5],
-            str_time=message[6],
-            type=MessageType.Text,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=message[4],
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[7],
-            xml_content='',
-            content=message_content
-        )
-        self.add_message(msg)
-        return msg
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        for message, (is_sender, wxid, message_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            msg = TextMessage(
+                local_id=message[0],
+                server_id=message[1],
+                sort_seq=message[3],
+                timestamp=message[5],
+                str_time=message[6],
+                type=MessageType.Text,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=message[4],
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[7],
+                xml_content='',
+                content=message_content
+            )
+            self.add_message(msg)
+            results.append(msg)
+        return results
 
 
 class ImageMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, message_content = self.common_attribute(message, username, manager)
-        filename = ''
-        try:
-            # 2025年3月微信4.0.3正式版修改了img命名方式才有了这个东西
-            packed_info_data_proto = packed_info_data_img2_pb2.PackedInfoDataImg2()
-            packed_info_data_proto.ParseFromString(message[14])
-            # 转换为 JSON 格式
-            packed_info_data = MessageToDict(packed_info_data_proto)
-            image_info = packed_info_data.get('imageInfo', {})
-            width = image_info.get('width', 0)
-            height = image_info.get('height', 0)
-            filename = image_info.get('filename', '').strip().strip('"').strip()
-        except:
-            pass
-        if not filename:
-            try:
-                # 2025年3月微信测试版修改了img命名方式才有了这个东西
-                packed_info_data_proto = packed_info_data_img_pb2.PackedInfoDataImg()
-                packed_info_data_proto.ParseFromString(message[14])
-                # 转换为 JSON 格式
-                packed_info_data = MessageToDict(packed_info_data_proto)
-                filename = packed_info_data.get('filename', '').strip().strip('"').strip()
-            except:
-                pass
-        msg = ImageMessage(
-            local_id=message[0],
-            server_id=message[1],
-            sort_seq=message[3],
-            timestamp=message[5],
-            str_time=message[6],
-            type=MessageType.Image,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=message[4],
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[7],
-            xml_content=message_content,
-            md5='',
-            path='',
-            thumb_path='',
-            file_size=0,
-            file_name=filename,
-            file_type='png'
-        )
-        path = manager.get_image(content=message_content, bytesExtra=msg, up_dir='',
-                                 thumb=False, talker_username=username)
-        msg.path = path
-        msg.thumb_path = manager.get_image(content=message_content, bytesExtra=msg, up_dir='',
-                                           thumb=True, talker_username=username)
-        self.add_message(msg)
-        return msg
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        for message, (is_sender, wxid, message_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            # 2025年3月微信4.0.3正式版（测试版格式不同）修改了img命名方式，文件名记录在packed_info_data中
+            filename = get_image_filename(get_packed_info_data(message))
+            msg = ImageMessage(
+                local_id=message[0],
+                server_id=message[1],
+                sort_seq=message[3],
+                timestamp=message[5],
+                str_time=message[6],
+                type=MessageType.Image,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=message[4],
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[7],
+                xml_content=message_content,
+                md5='',
+                path='',
+                thumb_path='',
+                file_size=0,
+                file_name=filename,
+                file_type='png'
+            )
+            results.append(msg)
+        # 整组一起找图片文件，每个目录只列一次，md5只查一次库
+        for msg, (path, thumb_path) in zip(results, manager.hardlink_db.get_images(results, username)):
+            msg.path = path
+            msg.thumb_path = thumb_path
+            self.add_message(msg)
+        return results
 
 
 class AudioMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, message_content = self.common_attribute(message, username, manager)
-        audio_dic = parser_audio(message_content)
-        audio_length = audio_dic.get('audio_length', 0)
-        audio_text = audio_dic.get('audio_text', '')
-        if not audio_text:
-            packed_info_data_proto = packed_info_data_pb2.PackedInfoData()
-            packed_info_data_proto.ParseFromString(message[14])
-            # 转换为 JSON 格式
-            packed_info_data = MessageToDict(packed_info_data_proto)
-            audio_text = packed_info_data.get('info', {}).get('audioTxt', '')
-        if not audio_text:
-            audio_text = manager.get_audio_text(message[1])
-        msg = AudioMessage(
-            local_id=message[0],
-            server_id=message[1],
-            sort_seq=message[3],
-            timestamp=message[5],
-            str_time=message[6],
-            type=MessageType.Audio,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=message[4],
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[7],
-            xml_content=message_content,
-            md5='',
-            path='',
-            file_size=0,
-            file_name='',
-            file_type='mp3',
-            audio_text=audio_text,
-            duration=audio_length
-        )
-        msg.set_file_name()
-        self.add_message(msg)
-        return msg
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        for message, (is_sender, wxid, message_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            audio_dic = parser_audio(message_content)
+            audio_length = audio_dic.get('audio_length', 0)
+            audio_text = audio_dic.get('audio_text', '')
+            if not audio_text:
+                audio_text = get_audio_text(get_packed_info_data(message))
+            msg = AudioMessage(
+                local_id=message[0],
+                server_id=message[1],
+                sort_seq=message[3],
+                timestamp=message[5],
+                str_time=message[6],
+                type=MessageType.Audio,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=message[4],
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[7],
+                xml_content=message_content,
+                md5='',
+                path='',
+                file_size=0,
+                file_name='',
+                file_type='mp3',
+                audio_text=audio_text,
+                duration=audio_length
+            )
+            msg.set_file_name()
+            results.append(msg)
+        # 消息里没有转文字结果的，一起到语音转文字的数据库里查
+        server_ids = [msg.server_id for msg in results if not msg.audio_text]
+        audio_texts = manager.audio2text_db.get_audio_texts(server_ids) if server_ids else {}
+        for msg in results:
+            if not msg.audio_text:
+                msg.audio_text = audio_texts.get(msg.server_id, '')
+            self.add_message(msg)
+        return results
 
 
 class VideoMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, message_content = self.common_attribute(message, username, manager)
-        filename = ''
-        try:
-            # 2025年3月微信4.0.3正式版修改了img命名方式才有了这个东西
-            packed_info_data_proto = packed_info_data_img2_pb2.PackedInfoDataImg2()
-            packed_info_data_proto.ParseFromString(message[14])
-            # 转换为 JSON 格式
-            packed_info_data = MessageToDict(packed_info_data_proto)
-            image_info = packed_info_data.get('videoInfo', {})
-            width = image_info.get('width', 0)
-            height = image_info.get('height', 0)
-            filename = image_info.get('filename', '').strip().strip('"').strip()
-        except:
-            pass
-        msg = VideoMessage(
-            local_id=message[0],
-            server_id=message[1],
-            sort_seq=message[3],
-            timestamp=message[5],
-            str_time=message[6],
-            type=MessageType.Video,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=message[4],
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[7],
-            xml_content=message_content,
-            md5='',
-            path='',
-            file_size=0,
-            file_name=filename,
-            file_type='mp4',
-            thumb_path='',
-            duration=0,
-            raw_md5=''
-        )
-        video_dic = parse_video(message_content)
-        msg.duration = video_dic.get('length', 0)
-        msg.file_size = video_dic.get('size', 0)
-        msg.md5 = video_dic.get('md5', '')
-        msg.raw_md5 = video_dic.get('rawmd5', '')
-        month = msg.str_time[:7]  # 2025-01
-        if filename:
-            # 微信4.0.3正式版增加
-            video_dir = os.path.join('msg', 'video', month)
-            video_path = os.path.join(video_dir, f'{filename}_raw.mp4')
-            if os.path.exists(os.path.join(Me().wx_dir, video_path)):
-                msg.path = video_path
-                msg.thumb_path = os.path.join(video_dir, f'{filename}.jpg')
-            else:
-                msg.path = os.path.join(video_dir, f'{filename}.mp4')
-                msg.thumb_path = os.path.join(video_dir, f'{filename}.jpg')
-        else:
-            msg.path = manager.hardlink_db.get_video(msg.raw_md5, False)
-            msg.thumb_path = manager.hardlink_db.get_video(msg.raw_md5, True)
-            if not msg.path:
-                msg.path = manager.hardlink_db.get_video(msg.md5, False)
-                msg.thumb_path = manager.hardlink_db.get_video(msg.md5, True)
-            # logger.error(f'{msg.path} {msg.thumb_path}')
+        return self.create_batch([message], username, manager)[0]
 
-        self.add_message(msg)
-        return msg
+    def create_batch(self, messages, username, manager):
+        results = []
+        listing = DirListing()
+        for message, (is_sender, wxid, message_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            # 2025年3月微信4.0.3正式版修改了img命名方式才有了这个东西
+            filename = get_video_filename(get_packed_info_data(message))
+            msg = VideoMessage(
+                local_id=message[0],
+                server_id=message[1],
+                sort_seq=message[3],
+                timestamp=message[5],
+                str_time=message[6],
+                type=MessageType.Video,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=message[4],
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[7],
+                xml_content=message_content,
+                md5='',
+                path='',
+                file_size=0,
+                file_name=filename,
+                file_type='mp4',
+                thumb_path='',
+                duration=0,
+                raw_md5=''
+            )
+            video_dic = parse_video(message_content)
+            msg.duration = video_dic.get('length', 0)
+            msg.file_size = video_dic.get('size', 0)
+            msg.md5 = video_dic.get('md5', '')
+            msg.raw_md5 = video_dic.get('rawmd5', '')
+            month = msg.str_time[:7]  # 2025-01
+            if filename:
+                # 微信4.0.3正式版增加
+                video_dir = os.path.join('msg', 'video', month)
+                video_path = os.path.join(video_dir, f'{filename}_raw.mp4')
+                if listing.exists(os.path.join(Me().wx_dir, video_path)):
+                    msg.path = video_path
+                    msg.thumb_path = os.path.join(video_dir, f'{filename}.jpg')
+                else:
+                    msg.path = os.path.join(video_dir, f'{filename}.mp4')
+                    msg.thumb_path = os.path.join(video_dir, f'{filename}.jpg')
+            results.append(msg)
+        # 没有文件名的按md5到hardlink里找，整组只查一次库
+        unnamed = [msg for msg in results if not msg.file_name]
+        if unnamed:
+            videos = manager.hardlink_db.get_videos(
+                [msg.raw_md5 for msg in unnamed] + [msg.md5 for msg in unnamed]
+            )
+            for msg in unnamed:
+                msg.path, msg.thumb_path = videos.get(msg.raw_md5, ('', ''))
+                if not msg.path:
+                    msg.path, msg.thumb_path = videos.get(msg.md5, ('', ''))
+        for msg in results:
+            self.add_message(msg)
+        return results
 
 
 class EmojiMessageFactory(MessageFactory, Singleton):
@@ -620,11 +706,7 @@ class MergedMessageFactory(MessageFactory, Singleton):
             messages=info.get('messages', []),
             level=0
         )
-        packed_info_data_proto = packed_info_data_merged_pb2.PackedInfoData()
-        packed_info_data_proto.ParseFromString(message[14])
-        # 转换为 JSON 格式
-        packed_info_data = MessageToDict(packed_info_data_proto)
-        dir0 = packed_info_data.get('info', {}).get('dir', '')
+        dir0 = get_merged_dir(get_packed_info_data(message))
         month = msg.str_time[:7]  # 2025-03
         rec_dir = os.path.join(Me().wx_dir, 'msg', 'attach', hashlib.md5(username.encode("utf-8")).hexdigest(), month,
                                'Rec')
@@ -792,8 +874,8 @@ class SystemMessageFactory(MessageFactory, Singleton):
         if isinstance(message[12], bytes):
             message_content = decompress(message[12])
             try:
-                dic = xmltodict.parse(message_content)
-                message_content = dic.get('sysmsg', {}).get('revokemsg', {}).get('content', '')
+                doc = parse_xml(message_content)
+                message_content = doc.text('revokemsg/content') if doc.tag == 'sysmsg' else ''
             except:
                 pass
             # logger.error(message_content)
@@ -875,53 +957,55 @@ class RedEnvelopeMessageFactory(MessageFactory, Singleton):
 
 class FileMessageFactory(MessageFactory, Singleton):
     def create(self, message, username, manager):
-        is_sender, wxid, message_content = self.common_attribute(message, username, manager)
-        info = parser_file(message_content)
-        md5 = info.get('md5', '')
-        filename = info.get('filename', '')
-        if not filename:
-            try:
+        return self.create_batch([message], username, manager)[0]
+
+    def create_batch(self, messages, username, manager):
+        results = []
+        md5s = {}  # 需要按md5查找路径的消息下标 -> md5
+        for message, (is_sender, wxid, message_content, contact) in zip(
+                messages, self.common_attributes(messages, username, manager)):
+            info = parser_file(message_content)
+            md5 = info.get('md5', '')
+            filename = info.get('filename', '')
+            if not filename:
                 # 2025年3月微信4.0.3正式版修改了img命名方式才有了这个东西
-                packed_info_data_proto = packed_info_data_img2_pb2.PackedInfoDataImg2()
-                packed_info_data_proto.ParseFromString(message[14])
-                # 转换为 JSON 格式
-                packed_info_data = MessageToDict(packed_info_data_proto)
-                image_info = packed_info_data.get('fileInfo', {})
-                file_info = image_info.get('fileInfo', {})
-                filename = file_info.get('filename', '').strip()
-            except:
-                pass
-        msg = FileMessage(
-            local_id=message[0],
-            server_id=message[1],
-            sort_seq=message[3],
-            timestamp=message[5],
-            str_time=message[6],
-            type=MessageType.File,
-            talker_id=username,
-            is_sender=is_sender,
-            sender_id=message[4],
-            display_name=self.contacts[wxid].remark,
-            avatar_src=self.contacts[wxid].small_head_img_url,
-            status=message[7],
-            xml_content=message_content,
-            path='',
-            md5=md5,
-            file_type=info.get('file_type', ''),
-            file_name=info.get('file_name', ''),
-            file_size=info.get('file_size', 0)
-        )
-        # file_path = manager.get_file(md5)
-        if filename:
-            month = msg.str_time[:7]  # 2025-01
-            # 微信4.0.3正式版增加
-            video_dir = os.path.join('msg', 'file', month)
-            file_path = os.path.join(video_dir, f'{filename}')
-            msg.path = file_path
-        else:
-            msg.path = manager.get_file(md5)
-        self.add_message(msg)
-        return msg
+                filename = get_file_filename(get_packed_info_data(message))
+            msg = FileMessage(
+                local_id=message[0],
+                server_id=message[1],
+                sort_seq=message[3],
+                timestamp=message[5],
+                str_time=message[6],
+                type=MessageType.File,
+                talker_id=username,
+                is_sender=is_sender,
+                sender_id=message[4],
+                display_name=contact.remark,
+                avatar_src=contact.small_head_img_url,
+                status=message[7],
+                xml_content=message_content,
+                path='',
+                md5=md5,
+                file_type=info.get('file_type', ''),
+                file_name=info.get('file_name', ''),
+                file_size=info.get('file_size', 0)
+            )
+            if filename:
+                month = msg.str_time[:7]  # 2025-01
+                # 微信4.0.3正式版增加
+                video_dir = os.path.join('msg', 'file', month)
+                file_path = os.path.join(video_dir, f'{filename}')
+                msg.path = file_path
+            else:
+                md5s[len(results)] = md5
+            results.append(msg)
+        if md5s:
+            files = manager.hardlink_db.get_files(md5s.values())
+            for i, md5 in md5s.items():
+                results[i].path = files.get(md5, '')
+        for msg in results:
+            self.add_message(msg)
+        return results
 
 
 class FavNoteMessageFactory(MessageFactory, Singleton):
@@ -1011,5 +1095,45 @@ FACTORY_REGISTRY = {
     MessageType.Pat: PatMessageFactory(),
 }
 
+
+def _load_lazy_message(factory, message, username, manager, wxid, contact):
+    # 解析时缓存里的联系人可能已经换成别的会话的了，用创建时的
+    Singleton.contacts[wxid] = contact
+    return factory.create(message, username, manager)
+
+
+def create_lazy_messages(messages, username, manager):
+    """
+    只填充元数据，不解压message_content，其余字段第一次访问时再交给对应的工厂解析
+    @param messages: 从数据库获得的元组数据
+    @param username: 聊天对象的wxid
+    @param manager: 数据库管理接口
+    @return: Iterator[LazyMessage]
+    """
+    my_wxid = Me().wxid
+    senders = {}
+    unknown_factory = FACTORY_REGISTRY[-1]
+    for message in messages:
+        wxid = message[4]
+        contact = senders.get(wxid)
+        if contact is None:
+            contact = senders[wxid] = Singleton.get_contact(wxid, manager)
+        factory = FACTORY_REGISTRY.get(message[2], unknown_factory)
+        yield LazyMessage(
+            partial(_load_lazy_message, factory, message, username, manager, wxid, contact),
+            local_id=message[0],
+            server_id=message[1],
+            sort_seq=message[3],
+            timestamp=message[5],
+            str_time=message[6],
+            type=LAZY_TYPE_MAP.get(message[2], message[2]),
+            talker_id=username,
+            is_sender=wxid == my_wxid,
+            sender_id=wxid,
+            display_name=contact.remark,
+            avatar_src=contact.small_head_img_url,
+            status=message[7],
+        )
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/9 16:40
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-xml_parser.py
+@Description : 消息xml（appmsg、图片、视频、系统消息等）的统一解析，每条消息的xml只用lxml解析一次，按路径直接读取需要的字段
+"""
+import threading
+import traceback
+from typing import List
+
+from lxml import etree
+
+from wxManager.cache import LRUCache
+from wxManager.log import logger
+
+_local = threading.local()
+# 最近解析过的xml，同一条消息的xml会被子类型判断、工厂解析、hardlink查md5等多处用到
+_documents = LRUCache('xml_documents', maxsize=256)
+
+
+def _get_parser() -> etree.XMLParser:
+    # lxml的解析器不能多个线程同时使用，每个线程一个
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        # recover：容忍重复的属性、未转义的&等微信xml里常见的问题
+        parser = _local.parser = etree.XMLParser(recover=True, encoding='utf-8', resolve_entities=False,
+                                                 huge_tree=True, remove_comments=True)
+    return parser
+
+
+class XmlNode:
+    """
+    解析后的xml节点，按ElementPath路径读取字段
+    text的返回值和xmltodict的dict.get一致：节点不存在返回default，空节点返回None，文本去掉首尾空白
+    """
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    @property
+    def tag(self) -> str:
+        return self.element.tag
+
+    @property
+    def attrib(self):
+        return self.element.attrib
+
+    def find(self, path) -> 'XmlNode | None':
+        element = self.element.find(path)
+        return None if element is None else XmlNode(element)
+
+    def findall(self, path) -> List['XmlNode']:
+        return [XmlNode(element) for element in self.element.findall(path)]
+
+    def text(self, path='', default=''):
+        """
+        @param path: 相对当前节点的路径，如'appmsg/title'，为空表示当前节点
+        @param default: 节点不存在时的返回值
+        @return:
+        """
+        element = self.element.find(path) if path else self.element
+        if element is None:
+            return default
+        text = element.text
+        if text is None:
+            return None
+        return text.strip() or None
+
+    def texts(self, path) -> List[str]:
+        return [(element.text or '').strip() for element in self.element.findall(path)]
+
+    def attr(self, path, name, default=''):
+        """
+        @param path: 节点路径，为空表示当前节点
+        @param name: 属性名
+        @param default: 节点或属性不存在时的返回值
+        @return:
+        """
+        element = self.element.find(path) if path else self.element
+        if element is None:
+            return default
+        return element.get(name, default)
+
+
+def parse_xml(xml_content: str) -> XmlNode:
+    """
+    解析消息的xml，返回根节点，最近解析过的内容直接返回缓存的结果
+    @param xml_content:
+    @return: 根节点，不是xml时抛出ValueError
+    """
+    document = _documents.get(xml_content)
+    if document is not None:
+        return document
+    content = xml_content.strip()
+    if not content.startswith('<'):
+        raise ValueError('不是xml')
+    try:
+        root = etree.fromstring(content.encode('utf-8'), _get_parser())
+    except etree.XMLSyntaxError as e:
+        raise ValueError(f'xml解析失败：{e}')
+    if root is None:
+        raise ValueError('xml解析失败')
+    document = XmlNode(root)
+    _documents.put(xml_content, document)
+    return document
+
+
+def get_md5_from_xml(content, type_="img"):
+    """
+    图片、视频消息xml中的md5，用于在hardlink数据库中查找文件
+    @param content: 消息的xml
+    @param type_: img或video
+    @return: md5，没有时返回None
+    """
+    if not content:
+        return None
+    try:
+        document = parse_xml(content.strip('null:'))
+    except ValueError:
+        logger.error(traceback.format_exc())
+        logger.error(content)
+        return None
+    if type_ == "img":
+        return document.attr('.//img', 'md5', None)
+    elif type_ == "video":
+        return document.attr('.//videomsg', 'md5', None)
+    return None
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import xmltodict
+
+    from wxManager.parser.link_parser import parser_link, parser_applet, parser_file, parser_reply, \
+        parser_transfer, parser_red_envelop, parser_pat, wx_pay_data
+
+    corpus = [
+        (parser_link, '''<msg><appmsg appid="wx6618f1cfc6c132f8" sdkver="0"><title>一篇公众号文章的标题</title>
+<des>文章摘要，文章摘要，文章摘要</des><type>5</type><url>https://mp.weixin.qq.com/s?__biz=MzA&amp;mid=1&amp;idx=1</url>
+<thumburl>https://mmbiz.qpic.cn/mmbiz_jpg/xxx/0?wx_fmt=jpeg</thumburl><sourceusername>gh_123456</sourceusername>
+<sourcedisplayname>某公众号</sourcedisplayname><appattach><totallen>0</totallen><attachid /><fileext /></appattach>
+<mmreader><category type="0" count="1"><name>某公众号</name><item><itemshowtype>0</itemshowtype></item></category>
+</mmreader></appmsg><fromusername>wxid_a</fromusername><scene>0</scene><appinfo><version>1</version>
+<appname>微信</appname></appinfo><commenturl /></msg>'''),
+        (parser_applet, '''<msg><appmsg appid="" sdkver="0"><title>小程序标题</title><des /><type>33</type>
+<url>https://mp.weixin.qq.com/mp/waerrpage?appid=wx1&amp;type=upgrade</url><sourcedisplayname>某小程序</sourcedisplayname>
+<weappinfo appid="wx1234"><pagepath>pages/index/index.html?id=1&amp;cover=https://a.com/c.png</pagepath>
+<username>gh_abc@app</username><type>2</type><weappiconurl>http://mmbiz.qpic.cn/icon/0</weappiconurl>
+<weapppagethumbrawurl /></weappinfo></appmsg><fromusername>wxid_a</fromusername></msg>'''),
+        (parser_file, '''<msg><appmsg appid="" sdkver="0"><title>报告.pdf</title><des /><type>6</type>
+<appattach><totallen>1048576</totallen><attachid>@cdn_xxx</attachid><fileext>pdf</fileext>
+<cdnattachurl>30570201</cdnattachurl><aeskey>abc</aeskey></appattach><md5>0123456789abcdef0123456789abcdef</md5>
+</appmsg><fromusername>wxid_a</fromusername></msg>'''),
+        (parser_reply, '''<msg><appmsg appid="" sdkver="0"><title>回复的内容</title><des /><type>57</type>
+<refermsg><type>1</type><svrid>8264127813478123</svrid><fromusr>wxid_b</fromusr><chatusr>wxid_b</chatusr>
+<displayname>张三</displayname><content>被引用的消息</content><createtime>1700000000</createtime></refermsg>
+</appmsg><fromusername>wxid_a</fromusername></msg>'''),
+        (parser_transfer, '''<msg><appmsg appid="" sdkver=""><title>微信转账</title><des>收到转账0.01元</des>
+<type>2000</type><wcpayinfo><paysubtype>1</paysubtype><feedesc>￥0.01</feedesc><transcationid>1</transcationid>
+<transferid>1</transferid><invalidtime>1700086400</invalidtime><pay_memo>备注</pay_memo>
+<receiver_username>wxid_b</receiver_username></wcpayinfo></appmsg></msg>'''),
+        (parser_red_envelop, '''<msg><appmsg appid="" sdkver=""><title>恭喜发财，大吉大利</title><type>2001</type>
+<wcpayinfo><templateid>1</templateid><iconurl>https://wx.gtimg.com/hongbao/1.png</iconurl>
+<receivertitle>恭喜发财，大吉大利</receivertitle><innertype>0</innertype></wcpayinfo></appmsg></msg>'''),
+        (parser_pat, '''<msg><appmsg appid="" sdkver="0"><title>"张三" 拍了拍我</title><type>62</type>
+<patinfo><fromusername>wxid_b</fromusername><chatusername>wxid_a</chatusername><pattedusername>wxid_a</pattedusername>
+<patsuffix /><template><![CDATA["${wxid_b}" 拍了拍我]]></template></patinfo></appmsg></msg>'''),
+        (wx_pay_data, '''<msg><appmsg appid="" sdkver="0"><title>微信支付凭证</title><type>5</type>
+<template_id>abc</template_id><mmreader><template_header><title>微信支付凭证</title>
+<display_name>微信支付</display_name></template_header><template_detail><line_content><topline>
+<key><word>付款金额</word></key><value><word>￥12.00</word></value></topline><lines>
+<line><key><word>支付方式</word></key><value><word>零钱</word></value></line>
+<line><key><word>收单机构</word></key><value><word>财付通</word></value></line>
+<line><key><word>备注</word></key><value><word>午餐</word></value></line></lines></line_content>
+</template_detail></mmreader></appmsg></msg>'''),
+    ]
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    def old_parse(xml):
+        # 改用parse_xml之前的做法：每个解析函数各自完整解析一遍
+        return xmltodict.parse(xml)
+
+    for func, xml in corpus:
+        st = time.perf_counter()
+        for _ in range(num):
+            old_parse(xml)
+        old_seconds = time.perf_counter() - st
+        st = time.perf_counter()
+        for i in range(num):
+            _documents.clear()  # 不命中缓存，测量解析本身
+            func(xml)
+        new_seconds = time.perf_counter() - st
+        print(f'{func.__name__:<20}{num}条 xmltodict.parse：{old_seconds:.2f}s  parse_xml+读取字段：{new_seconds:.2f}s')
+
+    # 同一条消息的xml被多处使用：子类型判断+解析+导出时再取一次
+    xml = corpus[0][1]
+    st = time.perf_counter()
+    for _ in range(num):
+        int(old_parse(xml)['msg']['appmsg']['type'])
+        old_parse(xml)['msg']['appmsg'].get('title')
+        old_parse(xml)['msg']['appmsg'].get('url')
+    old_seconds = time.perf_counter() - st
+    st = time.perf_counter()
+    for i in range(num):
+        _documents.clear()
+        int(parse_xml(xml).text('appmsg/type'))
+        parser_link(xml)
+        parse_xml(xml).text('appmsg/url')
+    print(f'同一条xml使用3次，{num}条 xmltodict：{old_seconds:.2f}s  parse_xml：{time.perf_counter() - st:.2f}s')
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+@Time        : 2025/3/6 22:14
+@Author      : SiYuan
+@Email       : 863909694@qq.com
+@File        : MemoTrace-planner.py
+@Description : 根据各类消息实测的解析耗时决定串行还是多进程解析，以及每批的大小
+"""
+import math
+import multiprocessing
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Hashable, Mapping, Optional, Tuple
+
+
+@dataclass
+class ParsePlan:
+    parallel: bool  # 是否交给进程池解析
+    batch_num: int  # 并行时拆分的任务数
+    total: int  # 消息条数
+    serial_seconds: float  # 预计串行耗时
+    parallel_seconds: float  # 预计并行耗时
+
+    def __str__(self):
+        mode = f'并行 {self.batch_num}批' if self.parallel else '串行'
+        return (f'{self.total}条消息，预计串行{self.serial_seconds:.2f}s/并行{self.parallel_seconds:.2f}s，'
+                f'选择{mode}')
+
+
+class ParsePlanner:
+    """
+    记录每种消息（按数据库中的类型区分）平均每条的解析耗时，用消息的类型分布估算串行和并行的耗时
+    文本消息很快，合并转发、引用、链接等需要解析xml的消息慢得多，只看条数会误判
+    """
+    default_cost = 60e-6  # 没有测量过的类型，每条消息的解析耗时（秒）
+    ipc_cost = 5e-6  # 并行时主进程每条消息额外的开销：传输结果、还原Message
+    task_seconds = 0.5  # 并行时每个任务期望的耗时，太小调度开销占比高，太大负载不均
+    min_batch_size = 2000  # 每个任务最少的消息数
+    smoothing = 0.3  # 新测量值的权重
+
+    def __init__(self, priors: Optional[Mapping[Hashable, float]] = None):
+        """
+        @param priors: 测量之前使用的各类型每条消息的解析耗时
+        """
+        self.costs: Dict[Hashable, float] = dict(priors or {})
+        # 启动进程池的耗时，fork很快，spawn需要在每个进程中重新导入所有模块（Windows、macOS默认spawn）
+        self.startup_seconds = 0.3 if multiprocessing.get_start_method() == 'fork' else 2.0
+        self._lock = threading.Lock()
+
+    def cost(self, key) -> float:
+        return self.costs.get(key, self.default_cost)
+
+    def record(self, stats: Mapping[Hashable, Tuple[int, float]]):
+        """
+        记录一次解析的实测耗时
+        @param stats: {类型: (条数, 总耗时秒)}
+        @return:
+        """
+        with self._lock:
+            for key, (count, seconds) in stats.items():
+                if not count:
+                    continue
+                cost = seconds / count
+                old = self.costs.get(key)
+                self.costs[key] = cost if old is None else old + (cost - old) * self.smoothing
+
+    def plan(self, type_counts: Mapping[Hashable, int], workers: int, pool_started: bool,
+             parallel: Optional[bool] = None, batch_size: Optional[int] = None) -> ParsePlan:
+        """
+        @param type_counts: {类型: 条数}
+        @param workers: 进程池大小
+        @param pool_started: 进程池是否已经启动，启动过就不再计算启动耗时
+        @param parallel: 强制串行(False)或并行(True)，None表示自动选择
+        @param batch_size: 强制每批的消息数，None表示自动计算
+        @return:
+        """
+        total = sum(type_counts.values())
+        serial_seconds = sum(count * self.cost(key) for key, count in type_counts.items())
+        workers = max(workers, 1)
+        parallel_seconds = (0 if pool_started else self.startup_seconds) + total * self.ipc_cost + \
+            serial_seconds / workers
+        if batch_size:
+            batch_num = math.ceil(total / batch_size)
+        else:
+            batch_num = max(workers, math.ceil(serial_seconds / self.task_seconds))
+            batch_num = min(batch_num, total // self.min_batch_size)
+        batch_num = max(batch_num, 1)
+        if parallel is None:
+            parallel = workers > 1 and batch_num > 1 and parallel_seconds < serial_seconds
+        return ParsePlan(parallel, batch_num, total, serial_seconds, parallel_seconds)
+
+
+def timed_create_batch(factory, messages, username, context, key, stats):
+    """
+    调用factory.create_batch并把条数和耗时累加到stats[key]
+    @param stats: {类型: [条数, 总耗时秒]}
+    """
+    st = time.perf_counter()
+    results = factory.create_batch(messages, username, context)
+    item = stats.get(key)
+    if item is None:
+        item = stats[key] = [0, 0.0]
+    item[0] += len(messages)
+    item[1] += time.perf_counter() - st
+    return results
+
+
+if __name__ == '__main__':
+    planner = ParsePlanner({1: 15e-6})
+    print(planner.plan({1: 30000}, workers=8, pool_started=False))
+    print(planner.plan({1: 30000, 49: 30000}, workers=8, pool_started=False))
+    print(planner.plan({1: 300000}, workers=8, pool_started=True))